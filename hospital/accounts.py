@@ -0,0 +1,81 @@
+"""Signed-in users and their doctor or patient profile, for one query or none.
+
+A signed-in request used to read its session row and its user, and then
+``user.doctor`` and ``user.patient`` with a query each. Sessions now use the
+``cached_db`` engine on the shared cache (``SESSION_ENGINE``).
+``CachedUserBackend`` loads the user with its profile and the profile's
+hospital in one joined query. The result stays in the shared cache for
+``USER_CACHE_SECONDS``, so most signed-in requests reach the view without
+touching the database. ``profile(user)`` then costs nothing.
+
+Saving or deleting a user, doctor or patient forgets that user's entry
+(see ``signals.py``). That includes the ``last_login`` update on sign-in and
+password changes, so session verification never sees a stale hash.
+Changing a hospital retires every entry through the hospitals cache
+version, which is part of each key.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+
+from . import cache
+
+
+def _key(user_id):
+    return f'user:{cache.hospitals.version()}:{user_id}'
+
+
+def cache_seconds():
+    return getattr(settings, 'USER_CACHE_SECONDS', 300)
+
+
+def load_user(user_id):
+    return User.objects.select_related('doctor__hospital', 'patient__hospital').filter(pk=user_id).first()
+
+
+def get_user(user_id):
+    """The user with primary key ``user_id``, with their profile loaded, or None."""
+    shared = cache.hospitals.shared
+    key = _key(user_id)
+    user = shared.get(key)
+    if user is None:
+        user = load_user(user_id)
+        if user is not None:
+            shared.set(key, user, cache_seconds())
+    return user
+
+
+def forget(user_id):
+    """Drop the cached copy of a user now and once the surrounding transaction commits."""
+    if user_id is None:
+        return
+
+    def delete():
+        cache.hospitals.shared.delete(_key(user_id))
+    delete()
+    transaction.on_commit(delete)
+
+
+def profile(user):
+    """The user's Doctor or Patient record, or None."""
+    for name in ('doctor', 'patient'):
+        try:
+            return getattr(user, name)
+        except ObjectDoesNotExist:
+            pass
+    return None
+
+
+# For users loaded some other way, reading the profile is a query.
+aprofile = sync_to_async(profile)
+
+
+class CachedUserBackend(ModelBackend):
+    """``ModelBackend`` that restores the signed-in user through ``get_user`` above."""
+
+    def get_user(self, user_id):
+        user = get_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
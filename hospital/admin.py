@@ -1,9 +1,160 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
+
+from . import routers, search
+from .models import (
+    Appointment, Doctor, DoctorDay, Hospital, HospitalDay, HospitalStats, Patient, Prescription, SpecializationCount,
+    Task,
+)
+from .pagination import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow to millions of rows.
+
+    Newest first by primary key, so a page is an index scan; no exact
+    counts (see ``EstimatedCountPaginator``); and searches, including the
+    autocomplete widgets pointing here, go through the full-text index in
+    ``hospital.search`` instead of ``icontains``.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+    list_per_page = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.model in search.SEARCH_FIELDS:
+            return search.filter_queryset(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    # Derived rows, maintained by hospital.stats; edits would drift.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
-from .models import Hospital
 
 @admin.register(Hospital)
 class HospitalAdmin(admin.ModelAdmin):
-    list_display = ['name','email','capacity']
+    list_display = ['name','email','capacity','doctor_count','patient_count','appointment_count','utilization']
+    list_select_related = ['stats']
     search_fields = ['name','email',]
     list_per_page = 10
+
+    def changelist_view(self, request, extra_context=None):
+        # The list may be served from a read replica; render it here, while
+        # replica reads are allowed, rather than after the view returns.
+        with routers.replica_reads(request.method == 'GET'):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    # Read from hospital.stats' counters rather than counting per row.
+    def _stat(self, obj, field):
+        stats = getattr(obj, 'stats', None)
+        return getattr(stats, field, 0)
+
+    @admin.display(description='Doctors')
+    def doctor_count(self, obj):
+        return self._stat(obj, 'doctors')
+
+    @admin.display(description='Patients')
+    def patient_count(self, obj):
+        return self._stat(obj, 'patients')
+
+    @admin.display(description='Appointments')
+    def appointment_count(self, obj):
+        return self._stat(obj, 'appointments')
+
+    @admin.display(description='Utilization')
+    def utilization(self, obj):
+        if not obj.capacity:
+            return '-'
+        return f"{self._stat(obj, 'patients') / obj.capacity:.0%}"
+
+
+@admin.register(Doctor)
+class DoctorAdmin(LargeTableAdmin):
+    list_display = ['name', 'specialization', 'email', 'hospital', 'user', 'appointments']
+    list_select_related = ['hospital', 'user']
+    autocomplete_fields = ['user', 'hospital']
+    search_fields = ['name']
+
+    @admin.display(description='Appointments')
+    def appointments(self, obj):
+        url = reverse('admin:hospital_appointment_changelist')
+        return format_html('<a href="{}?doctor__id__exact={}">View</a>', url, obj.pk)
+
+
+@admin.register(Patient)
+class PatientAdmin(LargeTableAdmin):
+    list_display = ['name', 'email', 'phone_number', 'hospital', 'user']
+    list_select_related = ['hospital', 'user']
+    autocomplete_fields = ['user', 'hospital']
+    search_fields = ['name']
+
+
+@admin.register(Appointment)
+class AppointmentAdmin(LargeTableAdmin):
+    list_display = ['appointment_date', 'appointment_time', 'patient', 'doctor']
+    list_select_related = ['patient', 'doctor']
+    autocomplete_fields = ['patient', 'doctor']
+    search_fields = ['patient__name']
+    search_help_text = 'Patient name.'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.terms(search_term):
+            return queryset, False
+        # Match patients through their full-text index, then look them up in
+        # the appointment index that leads with the patient. (A doctor's
+        # thousands of appointments would all have to be sorted; the doctor
+        # list links to each doctor's appointments instead.)
+        patients = search.filter_queryset(Patient.objects.all(), search_term).values('pk')
+        return queryset.filter(patient__in=patients), False
+
+
+@admin.register(Prescription)
+class PrescriptionAdmin(LargeTableAdmin):
+    list_display = ['medication', 'patient', 'doctor', 'created_at']
+    list_select_related = ['patient', 'doctor']
+    autocomplete_fields = ['patient', 'doctor']
+    search_fields = ['medication']
+
+
+@admin.register(Task)
+class TaskAdmin(LargeTableAdmin):
+    list_display = ['name', 'status', 'run_at', 'attempts', 'finished_at']
+    list_filter = ['status']
+
+
+@admin.register(HospitalStats)
+class HospitalStatsAdmin(ReadOnlyAdmin):
+    list_display = ['hospital', 'doctors', 'patients', 'appointments', 'updated_at']
+    list_select_related = ['hospital']
+
+
+@admin.register(DoctorDay)
+class DoctorDayAdmin(ReadOnlyAdmin, LargeTableAdmin):
+    list_display = ['date', 'doctor', 'appointments']
+    list_select_related = ['doctor']
+
+
+@admin.register(HospitalDay)
+class HospitalDayAdmin(ReadOnlyAdmin, LargeTableAdmin):
+    list_display = ['date', 'hospital', 'appointments']
+    list_select_related = ['hospital']
+
+
+@admin.register(SpecializationCount)
+class SpecializationCountAdmin(ReadOnlyAdmin):
+    list_display = ['hospital', 'specialization', 'doctors']
+    list_select_related = ['hospital']
+    list_filter = ['hospital']
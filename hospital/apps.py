@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class HospitalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hospital'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import bulk, db, notifications, signals  # noqa: F401
+        post_migrate.connect(signals.ensure_search_indexes, sender=self)
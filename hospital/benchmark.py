@@ -0,0 +1,228 @@
+"""Request scenarios and measurement helpers for ``manage.py benchmark_urls``.
+
+Every route in ``hospital.urls`` is either driven by a scenario (one GET as
+a given role) or listed in ``SKIPPED`` with the reason, so a new route
+without a benchmark shows up as uncovered. The same scenarios run through
+Django's test client and over HTTP against a real server, either the WSGI
+or the ASGI application.
+"""
+import os
+import re
+import resource
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from . import urls
+
+
+Scenario = namedtuple('Scenario', 'name path role')
+
+ROLES = ('doctor', 'patient', 'staff')
+
+SKIPPED = {
+    'bulk/<str:kind>/import/': 'writes records',
+    'dashboard/events/': 'streams until the client disconnects',
+    'logout/': 'ends the session',
+    'patients/<int:pk>/export/': 'same export as profile/export/',
+    'tasks/<int:pk>/': 'needs a queued task',
+}
+
+GRAPHQL_QUERY = '{ hospitals(first: 5) { edges { node { name doctors { name specialization } } } } }'
+
+
+def scenarios(hospital_id):
+    """The requests to time; ``role`` is None for anonymous visitors."""
+    def path(name, *args, **params):
+        url = reverse(name, args=args)
+        return url + ('?' + urllib.parse.urlencode(params) if params else '')
+
+    return [
+        Scenario('home', path('home'), None),
+        Scenario('about', path('about'), None),
+        Scenario('contact', path('contact'), None),
+        Scenario('hospital_detail', path('hospital_detail', hospital_id), None),
+        Scenario('register_doctor', path('register_doctor'), None),
+        Scenario('register_patient', path('register_patient'), None),
+        Scenario('dashboard', path('dashboard'), 'doctor'),
+        Scenario('doctor_dashboard', path('doctor_dashboard'), 'doctor'),
+        Scenario('patient_dashboard', path('patient_dashboard'), 'patient'),
+        Scenario('feed_past_appointments', path('dashboard_feed', 'appointments', window='past'), 'doctor'),
+        Scenario('feed_prescriptions', path('dashboard_feed', 'prescriptions'), 'patient'),
+        Scenario('free_slots', path('free_slots', count=10), 'patient'),
+        Scenario('search', path('search', q='ada', kind='patients'), 'doctor'),
+        Scenario('doctor_directory', path('doctor_directory', hospital=hospital_id), 'patient'),
+        Scenario('doctor_typeahead', path('doctor_directory', q='ca'), 'patient'),
+        Scenario('bulk_export_doctors', path('bulk_export', 'doctors', format='jsonl'), 'staff'),
+        Scenario('record_export', path('record_export', format='ndjson'), 'patient'),
+        Scenario('hospital_export', path('hospital_export', hospital_id), 'staff'),
+        Scenario('profile', path('profile'), 'doctor'),
+        Scenario('profile_edit', path('profile_edit'), 'patient'),
+        Scenario('metrics', path('metrics'), 'staff'),
+        Scenario('graphql', '/graphql/?' + urllib.parse.urlencode({'query': GRAPHQL_QUERY}), 'doctor'),
+    ]
+
+
+def uncovered_routes(scenario_list):
+    """Routes in ``hospital.urls`` that no scenario requests and ``SKIPPED`` doesn't explain."""
+    covered = {resolve(s.path.split('?')[0]).route for s in scenario_list}
+    return sorted(
+        {str(pattern.pattern) for pattern in urls.urlpatterns} - covered - set(SKIPPED)
+    )
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def peak_rss_kb(pid=None):
+    """High-water resident set size of ``pid`` (default: this process) in KiB, if known."""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return children
+
+
+def summarize(timings, statuses, elapsed, queries=None, rss=None):
+    return {
+        'requests': len(timings),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': max(queries) if queries else None,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'peak_rss_kb': rss,
+    }
+
+
+def _consume(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+
+def run_client(clients, scenario_list, repeat, warmup):
+    """Time each scenario through the test client, counting queries per request."""
+    results = {}
+    for scenario in scenario_list:
+        client = clients[scenario.role]
+        for _ in range(warmup):
+            _consume(client.get(scenario.path))
+        timings, queries, statuses = [], [], Counter()
+        began = time.perf_counter()
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = client.get(scenario.path)
+                _consume(response)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(ctx.captured_queries))
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - began
+        results[scenario.name] = summarize(timings, statuses, elapsed, queries, peak_rss_kb())
+    return results
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def server_timing_queries(header):
+    """The query count ``RequestMetricsMiddleware`` put in a Server-Timing header."""
+    match = re.search(r'desc="(\d+) queries"', header or '')
+    return int(match.group(1)) if match else None
+
+
+def server_timing(header, metric):
+    """The duration in ms ``RequestMetricsMiddleware`` reported for ``metric``."""
+    match = re.search(rf'(?:^|, ){metric};dur=([\d.]+)', header or '')
+    return float(match.group(1)) if match else None
+
+
+def run_http(base_url, cookies, scenario_list, repeat, warmup, server_pid=None, concurrency=1):
+    """Time each scenario over HTTP; ``cookies`` maps a role to its Cookie header.
+
+    ``concurrency`` requests are kept in flight at once. Queries are read
+    back from the server's Server-Timing header.
+    """
+    opener = urllib.request.build_opener(_NoRedirect)
+
+    def get(scenario):
+        request = urllib.request.Request(base_url + scenario.path)
+        if cookies.get(scenario.role):
+            request.add_header('Cookie', cookies[scenario.role])
+        start = time.perf_counter()
+        try:
+            with opener.open(request) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as error:
+            error.read()
+            status, headers = error.code, error.headers
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, status, server_timing_queries(headers.get('Server-Timing'))
+
+    results = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        for scenario in scenario_list:
+            for _ in range(warmup):
+                get(scenario)
+            began = time.perf_counter()
+            outcomes = list(pool.map(lambda _: get(scenario), range(repeat)))
+            elapsed = time.perf_counter() - began
+            statuses = Counter(status for _, status, _ in outcomes)
+            queries = [count for _, _, count in outcomes if count is not None]
+            rss = None
+            if server_pid is not None:
+                peaks = [peak_rss_kb(pid) for pid in [server_pid] + child_pids(server_pid)]
+                rss = max((peak for peak in peaks if peak is not None), default=None)
+            results[scenario.name] = summarize(
+                [timing for timing, _, _ in outcomes], statuses, elapsed, queries, rss,
+            )
+    return results
+
+
+def compare(baseline, current):
+    """Yield ``(mode, scenario, metric, before, after)`` for every shared measurement."""
+    for mode, scenario_results in current.get('results', {}).items():
+        for name, result in scenario_results.items():
+            before = baseline.get('results', {}).get(mode, {}).get(name)
+            if before is None:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second', 'queries', 'peak_rss_kb'):
+                if before.get(metric) is not None and result.get(metric) is not None:
+                    yield mode, name, metric, before[metric], result[metric]
@@ -0,0 +1,334 @@
+"""Bulk import and export of doctors, patients and appointments.
+
+Imports read CSV or JSON-lines records lazily and process them in chunks:
+each record is validated with the same form the registration pages use,
+usernames are checked against the database with one query per chunk, and
+the chunk is written with ``bulk_create`` inside a single transaction.
+Exports stream rows straight from a server-side iterator, so neither side
+holds more than one chunk in memory.
+
+Large uploads can be imported in the background: ``spool`` copies the
+upload to ``TASK_SPOOL_DIR``, a directory every task worker can read, and
+``import_spooled`` runs as a task.
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+
+from . import cache, passwords, stats, tasks
+from .forms import AppointmentForm, DoctorRegistrationForm, PatientRegistrationForm
+from .models import Doctor, Patient, Appointment
+from .streaming import Echo, serialize
+
+
+FORMATS = ('csv', 'jsonl')
+
+EXPORT_FIELDS = {
+    'doctors': (
+        ('id', 'id'), ('username', 'user__username'), ('name', 'name'), ('email', 'email'),
+        ('phone_number', 'phone_number'), ('specialization', 'specialization'),
+        ('hospital', 'hospital_id'), ('created_at', 'created_at'),
+    ),
+    'patients': (
+        ('id', 'id'), ('username', 'user__username'), ('name', 'name'), ('email', 'email'),
+        ('phone_number', 'phone_number'), ('hospital', 'hospital_id'),
+        ('medical_record', 'medical_record'), ('created_at', 'created_at'),
+    ),
+    'appointments': (
+        ('id', 'id'), ('patient_username', 'patient__user__username'),
+        ('doctor_username', 'doctor__user__username'), ('appointment_date', 'appointment_date'),
+        ('appointment_time', 'appointment_time'), ('message', 'message'), ('created_at', 'created_at'),
+    ),
+}
+EXPORT_MODELS = {'doctors': Doctor, 'patients': Patient, 'appointments': Appointment}
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def error(self, record, errors):
+        self.errors.append({'record': record, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'errors': self.errors}
+
+
+class MalformedRecord(ValueError):
+    """Stands in for a record that could not be parsed; ``import_records`` reports it."""
+
+
+def read_records(lines, fmt):
+    """Yield one dict per record from an iterable of text lines.
+
+    A record that can't be parsed is yielded as a ``MalformedRecord``, so
+    the import reports it and carries on with the next one.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                yield next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield MalformedRecord(str(exc))
+    elif fmt == 'jsonl':
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    yield MalformedRecord(str(exc))
+    else:
+        raise ValueError(f'Unknown format {fmt!r}; expected one of {", ".join(FORMATS)}.')
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _announce(model, objs):
+    # bulk_create doesn't send post_save; the in-memory indexes rely on it.
+    # Counters and dashboard stamps were already updated for the whole chunk.
+    for obj in objs:
+        post_save.send(
+            sender=model, instance=obj, created=True, raw=False, using=obj._state.db, update_fields=None, bulk=True,
+        )
+
+
+def _import_accounts(chunk, report, form_class, make_profile):
+    valid = []
+    for number, record in chunk:
+        form = form_class(record)
+        if form.is_valid():
+            valid.append((number, form.cleaned_data))
+        else:
+            report.error(number, form.errors.get_json_data())
+
+    taken = set(User.objects.filter(
+        username__in=[data['username'] for _, data in valid],
+    ).values_list('username', flat=True))
+    accepted = []
+    for number, data in valid:
+        if data['username'] in taken:
+            report.error(number, {'username': [{'message': 'Username already exists.', 'code': 'unique'}]})
+            continue
+        taken.add(data['username'])
+        accepted.append((number, data))
+    if not accepted:
+        return
+
+    try:
+        hashes = passwords.make_passwords([data['password'] for _, data in accepted])
+    except passwords.HashingBusy:
+        for number, _ in accepted:
+            report.error(number, {'__all__': [{
+                'message': 'Not imported: the server was too busy hashing passwords; import it again.',
+                'code': 'busy',
+            }]})
+        return
+    try:
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=data['username'], email=data['email'], password=hashed)
+                for (_, data), hashed in zip(accepted, hashes)
+            ])
+            model, profiles = make_profile(zip(users, [data for _, data in accepted]))
+            profiles = model.objects.bulk_create(profiles)
+            stats.record_created(model, profiles)
+            if model is Patient:
+                cache.dashboards.bump_on_commit(*{f'patients:{profile.hospital_id}' for profile in profiles})
+    except IntegrityError:
+        # A username was taken after the check above; the chunk rolled back.
+        for number, _ in accepted:
+            report.error(number, {'__all__': [{
+                'message': 'Not imported: a username in this chunk was taken during the import.',
+                'code': 'conflict',
+            }]})
+        return
+    _announce(model, profiles)
+    report.created += len(profiles)
+
+
+def _doctor_profiles(pairs):
+    return Doctor, [
+        Doctor(
+            user=user, name=data['name'], email=data['email'], phone_number=data['phone_number'],
+            specialization=data.get('specialization', ''), hospital=data['hospital'],
+        )
+        for user, data in pairs
+    ]
+
+
+def _patient_profiles(pairs):
+    return Patient, [
+        Patient(
+            user=user, name=data['name'], email=data['email'], phone_number=data['phone_number'],
+            hospital=data['hospital'],
+        )
+        for user, data in pairs
+    ]
+
+
+def _import_doctors(chunk, report):
+    _import_accounts(chunk, report, DoctorRegistrationForm, _doctor_profiles)
+
+
+def _import_patients(chunk, report):
+    _import_accounts(chunk, report, PatientRegistrationForm, _patient_profiles)
+
+
+def _import_appointments(chunk, report):
+    """Appointments reference accounts by username; both sides are resolved per chunk.
+
+    Only field-level rules apply: imports carry history, so the booking
+    form's "not in the past" and overlap checks are not enforced. A second
+    appointment in a doctor's exact slot is rejected, which also keeps a
+    repeated import from booking everything twice.
+    """
+    fields = AppointmentForm.base_fields
+    patients = dict(Patient.objects.filter(
+        user__username__in={record.get('patient_username') for _, record in chunk},
+    ).values_list('user__username', 'id'))
+    doctors = dict(Doctor.objects.filter(
+        user__username__in={record.get('doctor_username') for _, record in chunk},
+    ).values_list('user__username', 'id'))
+
+    appointments = []
+    for number, record in chunk:
+        errors, values = {}, {}
+        for name in ('appointment_date', 'appointment_time', 'message'):
+            try:
+                values[name] = fields[name].clean(record.get(name, ''))
+            except ValidationError as exc:
+                errors[name] = [{'message': message, 'code': 'invalid'} for message in exc.messages]
+        for name, known in (('patient_username', patients), ('doctor_username', doctors)):
+            if record.get(name) not in known:
+                errors[name] = [{'message': 'No account with that username.', 'code': 'invalid_choice'}]
+        if errors:
+            report.error(number, errors)
+            continue
+        appointments.append((number, Appointment(
+            patient_id=patients[record['patient_username']],
+            doctor_id=doctors[record['doctor_username']],
+            **values,
+        )))
+
+    def slot(appointment):
+        return appointment.doctor_id, appointment.appointment_date, appointment.appointment_time
+
+    booked = set(Appointment.objects.filter(
+        doctor_id__in={appointment.doctor_id for _, appointment in appointments},
+        appointment_date__in={appointment.appointment_date for _, appointment in appointments},
+    ).values_list('doctor_id', 'appointment_date', 'appointment_time'))
+    accepted = []
+    for number, appointment in appointments:
+        if slot(appointment) in booked:
+            report.error(number, {'appointment_time': [{
+                'message': 'The doctor already has an appointment at that time.', 'code': 'unique',
+            }]})
+            continue
+        booked.add(slot(appointment))
+        accepted.append((number, appointment))
+    if not accepted:
+        return
+
+    try:
+        with transaction.atomic():
+            appointments = Appointment.objects.bulk_create([appointment for _, appointment in accepted])
+            stats.record_created(Appointment, appointments)
+            cache.dashboards.bump_on_commit(*{
+                f'{role}:{getattr(appointment, role + "_id")}' for appointment in appointments for role in ('doctor', 'patient')
+            })
+    except IntegrityError:
+        # A slot was booked after the check above; the chunk rolled back.
+        for number, _ in accepted:
+            report.error(number, {'__all__': [{
+                'message': 'Not imported: a slot in this chunk was booked during the import.',
+                'code': 'conflict',
+            }]})
+        return
+    _announce(Appointment, appointments)
+    report.created += len(appointments)
+
+
+IMPORTERS = {
+    'doctors': _import_doctors,
+    'patients': _import_patients,
+    'appointments': _import_appointments,
+}
+
+
+def import_records(kind, records, chunk_size=500):
+    importer = IMPORTERS[kind]
+    report = ImportReport()
+
+    def objects():
+        for number, record in enumerate(records, start=1):
+            if isinstance(record, dict):
+                yield number, record
+            elif isinstance(record, MalformedRecord):
+                report.error(number, {'__all__': [{'message': f'Malformed record: {record}', 'code': 'malformed'}]})
+            else:
+                # A JSON line holding a list, string or number.
+                report.error(number, {'__all__': [{'message': 'Expected an object.', 'code': 'invalid'}]})
+
+    for chunk in _chunks(objects(), chunk_size):
+        importer(chunk, report)
+    return report
+
+
+def spool(source, fmt):
+    """Copy a binary file-like upload to ``TASK_SPOOL_DIR`` and return its path."""
+    directory = settings.TASK_SPOOL_DIR
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}', dir=directory)
+    with os.fdopen(fd, 'wb') as out:
+        shutil.copyfileobj(source, out)
+    return path
+
+
+# One attempt: a rerun would import the records that already went in again.
+@tasks.task(max_attempts=1)
+def import_spooled(kind, path, fmt):
+    try:
+        with open(path, newline='', encoding='utf-8') as stream:
+            return import_records(kind, read_records(stream, fmt)).as_dict()
+    finally:
+        os.remove(path)
+
+
+def export_records(kind, fmt, chunk_size=2000):
+    """Yield the rows of ``kind`` as CSV or JSON lines, one line per item."""
+    columns = EXPORT_FIELDS[kind]
+    rows = EXPORT_MODELS[kind].objects.order_by('id').values_list(
+        *[lookup for _, lookup in columns],
+    ).iterator(chunk_size=chunk_size)
+    names = [name for name, _ in columns]
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow([serialize(value) for value in row])
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(names, map(serialize, row)))) + '\n'
+    else:
+        raise ValueError(f'Unknown format {fmt!r}; expected one of {", ".join(FORMATS)}.')
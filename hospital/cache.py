@@ -0,0 +1,175 @@
+"""Two-tier versioned cache for read-mostly data.
+
+Values live in a small per-process LRU in front of a shared Django cache
+(``HOSPITAL_CACHE_ALIAS``, a file-based cache by default) so every worker
+sees the same data. Each namespace has a version token stored in the shared
+tier and every key embeds it, so invalidating a namespace is a single write
+of a new token: stale entries in every process simply stop being addressed
+and age out.
+
+Each process also remembers the token for ``HOSPITAL_CACHE_VERSION_SECONDS``
+(1 s), so a local hit touches no file at all (about 1 µs against 30 µs with
+the token read from the file cache). An invalidation takes effect at once in
+the process that made it and within that interval in the others.
+
+``Stamps`` keeps the same kind of token per record (``doctor:12``) for the
+``{% cache %}`` template fragments, which embed the stamps they depend on
+in their keys. A stamp starts with the time it was issued, so readers can
+tell whether the change may still be missing from the read replicas.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def version_seconds():
+    return getattr(settings, 'HOSPITAL_CACHE_VERSION_SECONDS', 1.0)
+
+
+class VersionedCache:
+    def __init__(self, namespace, local_size=256):
+        self.namespace = namespace
+        self.local = LRUCache(local_size)
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        # (token, monotonic time it stops being trusted)
+        self._version = None
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, 'HOSPITAL_CACHE_ALIAS', 'default')]
+
+    @property
+    def _version_key(self):
+        return f'{self.namespace}:version'
+
+    def version(self):
+        now = time.monotonic()
+        remembered = self._version
+        if remembered is not None and now < remembered[1]:
+            return remembered[0]
+        token = self.shared.get(self._version_key)
+        if token is None:
+            token = uuid.uuid4().hex
+            if not self.shared.add(self._version_key, token, None):
+                token = self.shared.get(self._version_key, token)
+        self._version = (token, now + version_seconds())
+        return token
+
+    def get_or_set(self, key, factory, timeout=None):
+        """Return the cached value for ``key``, computing it with ``factory()`` on a miss.
+
+        Cached values are shared between requests and must be treated as
+        read-only.
+        """
+        full_key = f'{self.namespace}:{self.version()}:{key}'
+        value = self.local.get(full_key, _MISSING)
+        if value is not _MISSING:
+            self.stats['local_hits'] += 1
+            return value
+        value = self.shared.get(full_key, _MISSING)
+        if value is _MISSING:
+            self.stats['misses'] += 1
+            value = factory()
+            self.shared.set(full_key, value, timeout)
+        else:
+            self.stats['shared_hits'] += 1
+        self.local.set(full_key, value)
+        return value
+
+    def invalidate(self):
+        token = uuid.uuid4().hex
+        self.shared.set(self._version_key, token, None)
+        self._version = (token, time.monotonic() + version_seconds())
+        self.local.clear()
+
+    def invalidate_on_commit(self):
+        """Invalidate now and again once the surrounding transaction commits.
+
+        The second bump drops anything another request cached from the
+        pre-commit state in between.
+        """
+        self.invalidate()
+        transaction.on_commit(self.invalidate)
+
+
+class Stamps:
+    """Version tokens for individual records, kept in the shared cache."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    @staticmethod
+    def _token():
+        return f'{time.time():.3f}-{uuid.uuid4().hex}'
+
+    @staticmethod
+    def issued_at(token):
+        """The time ``token`` was issued, or None for a token without one."""
+        try:
+            return float(token.partition('-')[0])
+        except ValueError:
+            return None
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, 'HOSPITAL_CACHE_ALIAS', 'default')]
+
+    def get(self, *names):
+        """The current token for each of ``names``, in order."""
+        keys = [f'{self.prefix}:{name}' for name in names]
+        found = self.shared.get_many(keys)
+        missing = {key: self._token() for key in keys if key not in found}
+        for key, token in missing.items():
+            if not self.shared.add(key, token, None):
+                token = self.shared.get(key, token)
+            found[key] = token
+        return [found[key] for key in keys]
+
+    def bump(self, *names):
+        self.shared.set_many({f'{self.prefix}:{name}': self._token() for name in names}, None)
+
+    def bump_on_commit(self, *names):
+        """Bump now and once the surrounding transaction commits (see ``invalidate_on_commit``)."""
+        self.bump(*names)
+        transaction.on_commit(lambda: self.bump(*names))
+
+
+hospitals = VersionedCache('hospitals')
+dashboards = Stamps('dashboard')
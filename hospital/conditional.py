@@ -0,0 +1,83 @@
+"""Validators and cache policies for conditional GETs of read-mostly pages.
+
+Each validator returns ``(etag, last_modified)`` for a request without
+rendering anything, so a browser or reverse proxy revalidating its copy
+gets a 304 for the cost of a cache lookup (plus one query for a hospital's
+counters). The ETag covers everything the page shows: the model timestamps
+it is built from, and the visitor's variant (signed in, staff, and the CSRF
+cookie that ``{% csrf_token %}`` masks). Last-Modified only carries the
+timestamps, so clients that send both are answered by the ETag.
+
+The catalogue pages read ``Hospital.updated_at``; the hospital page also
+reads ``HospitalStats.updated_at``, which the counters bump, and turns over
+at midnight for its "today" figures. About and contact use their templates'
+modification times.
+"""
+import datetime
+import hashlib
+import os
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from . import cache, selectors
+from .models import Hospital, HospitalStats
+
+
+def _etag(request, *parts):
+    user = request.user
+    variant = (user.is_authenticated, user.is_staff, request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    digest = hashlib.blake2b(repr((variant, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def catalogue(request):
+    """Validators for pages listing every hospital (the home page)."""
+    latest = cache.hospitals.get_or_set(
+        'last_modified', lambda: Hospital.objects.aggregate(at=Max('updated_at'), n=Count('id')),
+    )
+    # The count changes when a hospital is deleted; the latest timestamp does not.
+    return _etag(request, latest['at'], latest['n']), latest['at']
+
+
+def hospital(request, pk):
+    """Validators for ``hospital_detail``: the hospital row, its counters and today's date."""
+    record = selectors.get_hospital(pk)
+    counted = HospitalStats.objects.filter(hospital_id=pk).values_list('updated_at', flat=True).first()
+    today = timezone.localdate()
+    midnight = timezone.make_aware(datetime.datetime.combine(today, datetime.time.min))
+    return (
+        _etag(request, record.updated_at, counted, today),
+        max(filter(None, (record.updated_at, counted, midnight))),
+    )
+
+
+def template(*names):
+    """Validators for pages rendered from ``names`` (and the base template) alone."""
+    def validators(request, *args, **kwargs):
+        mtimes = [
+            os.path.getmtime(get_template(name).origin.name)
+            for name in (*names, 'hospital/base.html')
+        ]
+        modified = datetime.datetime.fromtimestamp(max(mtimes), tz=datetime.timezone.utc)
+        return _etag(request, names, mtimes), modified
+    return validators
+
+
+def apply_policy(request, response, public_max_age=None):
+    """Set Cache-Control and Vary on ``response`` (a 200 or a 304).
+
+    Pages for signed-in users, and pages without a ``public_max_age``,
+    stay in the browser's private cache and are revalidated on every use.
+    Anonymous pages may be stored by shared caches for ``public_max_age``
+    seconds. Everything varies on Cookie, since the navigation does.
+    """
+    if public_max_age is None or request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=public_max_age)
+    patch_vary_headers(response, ('Cookie',))
+    return response
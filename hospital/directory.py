@@ -0,0 +1,89 @@
+"""The doctor directory behind the booking form's doctor picker.
+
+The booking form used to render every doctor into one ``<select>``. Now it
+asks ``doctor_directory`` for what it needs, a page at a time:
+
+* With no search text, ``doctors`` lists the doctors of a hospital, of a
+  specialization or of both, alphabetically. Pages follow a keyset cursor
+  over ``(name, id)``, and each filter has an index in that order.
+* With search text, every word matches as a prefix through the full-text
+  index in ``hospital.search``, within the same filters. The best
+  ``limit`` matches come back and there are no further pages.
+
+``facets`` returns how many doctors each hospital and each specialization
+has. The counts come from ``SpecializationCount``, which ``hospital.stats``
+keeps current as doctors are added, moved, re-specialized or removed, so
+they never count the doctors table. Each facet applies the other filter but
+not its own, so the picker can show what switching would find. Facets
+ignore the search text.
+"""
+from django.db.models import Sum
+
+from . import pagination, search, selectors
+from .models import Doctor, SpecializationCount
+
+
+PAGE_SIZE = 20
+MAX_PAGE = 50
+
+FIELDS = ('id', 'name', 'specialization', 'hospital_id')
+ORDER = ('name', 'id')
+
+
+def _filters(hospital_id, specialization):
+    filters = {}
+    if hospital_id is not None:
+        filters['hospital_id'] = hospital_id
+    if specialization:
+        filters['specialization'] = specialization
+    return filters
+
+
+def doctors(hospital_id=None, specialization=None, text='', cursor=None, limit=PAGE_SIZE):
+    """A ``pagination.Page`` of doctors matching the filters and, if given, every word of ``text``."""
+    filters = _filters(hospital_id, specialization)
+    if search.terms(text):
+        return pagination.Page(search.search(Doctor, text, limit=limit, **filters), None)
+    queryset = Doctor.objects.filter(**filters).only(*FIELDS)
+    return pagination.keyset_page(queryset, ORDER, cursor, size=limit)
+
+
+def entry(doctor):
+    hospital = selectors.hospitals_by_pk().get(doctor.hospital_id)
+    return {
+        'id': doctor.pk,
+        'name': doctor.name,
+        'specialization': doctor.specialization,
+        'hospital': doctor.hospital_id,
+        'hospital_name': hospital.name if hospital else '',
+        'label': str(doctor),
+    }
+
+
+def facets(hospital_id=None, specialization=None):
+    """Doctor counts per hospital and per specialization, and the total under both filters."""
+    counts = SpecializationCount.objects.filter(doctors__gt=0).order_by()
+    by_specialization = counts.filter(**_filters(hospital_id, None)).values_list('specialization').annotate(
+        n=Sum('doctors'),
+    )
+    by_hospital = dict(counts.filter(**_filters(None, specialization)).values_list('hospital_id').annotate(
+        n=Sum('doctors'),
+    ))
+    hospitals = [
+        {'id': hospital.pk, 'name': hospital.name, 'count': by_hospital[hospital.pk]}
+        for hospital in selectors.hospital_catalogue() if hospital.pk in by_hospital
+    ]
+    if hospital_id is not None:
+        total = by_hospital.get(hospital_id, 0)
+    else:
+        total = sum(by_hospital.values())
+    return {
+        'count': total,
+        'facets': {
+            'hospitals': hospitals,
+            # Doctors without a specialization count towards their hospital only.
+            'specializations': [
+                {'value': value, 'count': count} for value, count in sorted(by_specialization) if value
+            ],
+        },
+    }
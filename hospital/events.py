@@ -0,0 +1,240 @@
+"""Live doctor dashboards over Server-Sent Events.
+
+Every appointment or prescription save or delete writes a ``DashboardEvent``
+row in the same transaction (see ``signals.py``). Under ASGI the doctor
+dashboard keeps one ``EventSource`` open on ``dashboard_events``, and the
+stream pushes each change to the doctor's page as a rendered list item, so
+doctors stop reloading the page to see new bookings.
+
+Each worker process runs one ``Hub``. A single poller task reads the
+events added since its last look (``id > last``) and hands them to the
+streams of the doctors they concern. A write in the same process wakes the
+poller as soon as its transaction commits. Writes in other processes and
+task workers are picked up within ``DASHBOARD_EVENTS_POLL_SECONDS``. That
+costs one indexed query per interval per process, however many doctors are
+watching.
+
+Event ids double as SSE ids, so a reconnecting browser sends
+``Last-Event-ID`` and gets what it missed. Events are pruned after
+``DASHBOARD_EVENTS_RETENTION`` seconds. Under WSGI, where a worker cannot
+hold a connection open, a request gets the events it missed and the browser
+reconnects ``RETRY_MS`` later.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Appointment, DashboardEvent, Prescription
+
+
+logger = logging.getLogger('hospital.events')
+
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects, so a signed-out
+# user's stream doesn't outlive their session for long.
+STREAM_SECONDS = 300
+RETRY_MS = 2000
+PRUNE_EVERY = 1000
+BACKLOG_LIMIT = 200
+NEW_EVENTS_LIMIT = 1000
+
+KINDS = {Appointment: DashboardEvent.APPOINTMENT, Prescription: DashboardEvent.PRESCRIPTION}
+
+
+def poll_seconds():
+    return getattr(settings, 'DASHBOARD_EVENTS_POLL_SECONDS', 1.0)
+
+
+def retention():
+    return datetime.timedelta(seconds=getattr(settings, 'DASHBOARD_EVENTS_RETENTION', 3600))
+
+
+def record(instance, action, previous_doctor_id=None):
+    """Log a change to ``instance`` (an appointment or prescription) for its doctor's stream."""
+    kind = KINDS[type(instance)]
+    events = [DashboardEvent(doctor_id=instance.doctor_id, kind=kind, object_id=instance.pk, action=action)]
+    if previous_doctor_id is not None and previous_doctor_id != instance.doctor_id:
+        # Moved to another doctor: gone from the first one's lists.
+        events.append(DashboardEvent(
+            doctor_id=previous_doctor_id, kind=kind, object_id=instance.pk, action=DashboardEvent.DELETED,
+        ))
+    events = DashboardEvent.objects.bulk_create(events)
+    transaction.on_commit(hub.notify)
+    if events[0].pk % PRUNE_EVERY == 0:
+        prune()
+
+
+def prune():
+    DashboardEvent.objects.filter(created_at__lt=timezone.now() - retention()).delete()
+
+
+def latest_id():
+    return DashboardEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def new_events(after):
+    return list(DashboardEvent.objects.filter(id__gt=after).order_by('id')[:NEW_EVENTS_LIMIT])
+
+
+def backlog(doctor_id, last_event_id=None, since=None):
+    """Events for ``doctor_id`` after ``last_event_id``, or else since the ``since`` timestamp."""
+    events = DashboardEvent.objects.filter(doctor_id=doctor_id)
+    if last_event_id is not None:
+        events = events.filter(id__gt=last_event_id)
+    elif since is not None:
+        oldest = timezone.now() - retention()
+        events = events.filter(created_at__gte=max(since, oldest))
+    else:
+        return []
+    return list(events.order_by('id')[:BACKLOG_LIMIT])
+
+
+def _list(appointment, today):
+    return 'upcoming' if appointment.appointment_date >= today else 'past'
+
+
+def render(events):
+    """The SSE text for ``events``: one message per event, saved records with their list item."""
+    ids = defaultdict(set)
+    for event in events:
+        if event.action == DashboardEvent.SAVED:
+            ids[event.kind].add(event.object_id)
+    records = {
+        kind: model.objects.select_related('patient').in_bulk(ids[kind])
+        for model, kind in KINDS.items() if ids[kind]
+    }
+    today = timezone.localdate()
+    messages = []
+    for event in events:
+        data = {'id': event.object_id, 'action': event.action}
+        obj = records.get(event.kind, {}).get(event.object_id) if event.action == DashboardEvent.SAVED else None
+        if obj is not None and obj.doctor_id == event.doctor_id:
+            if event.kind == DashboardEvent.APPOINTMENT:
+                data['list'] = _list(obj, today)
+                template = 'hospital/partials/appointment_items.html'
+            else:
+                data['list'] = 'prescriptions'
+                template = 'hospital/partials/prescription_items.html'
+            data['html'] = render_to_string(template, {'items': [obj], 'role': 'doctor'})
+        else:
+            # Deleted, or moved to another doctor since.
+            data['action'] = DashboardEvent.DELETED
+        messages.append(f'id: {event.pk}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n')
+    return ''.join(messages)
+
+
+def opening(doctor_id, last_event_id=None, since=None):
+    """The start of a stream, and the id of the newest event when it was read.
+
+    The text holds the events missed since the page loaded or the last
+    connection. It ends by moving the browser's ``Last-Event-ID`` to the
+    newest event, so the next connection resumes from there even if nothing
+    concerned this doctor. A change may reach the page twice; applying it
+    again is harmless.
+    """
+    text = render(backlog(doctor_id, last_event_id, since))
+    newest = max(latest_id(), last_event_id or 0)
+    return f'{text}retry: {RETRY_MS}\nid: {newest}\n\n', newest
+
+
+# DB work for the streams runs on the shared executor rather than each
+# request's own thread, so an idle stream holds no thread or connection.
+arender = sync_to_async(render, thread_sensitive=False)
+aopening = sync_to_async(opening, thread_sensitive=False)
+anew_events = sync_to_async(new_events, thread_sensitive=False)
+
+
+class Hub:
+    """Fans new events out to this process's open streams."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.loop = None
+        self.wake = None
+        self.poller = None
+        self.last_id = 0
+
+    def subscribe(self, doctor_id):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop, self.wake, self.poller = loop, asyncio.Event(), None
+            self.subscribers.clear()
+        queue = asyncio.Queue()
+        self.subscribers[doctor_id].add(queue)
+        return queue
+
+    def start(self, after):
+        """Make sure the poller runs, reading events after ``after`` if it wasn't running yet.
+
+        Streams subscribe before reading their opening events and start the
+        poller after, so no event falls between the two.
+        """
+        if self.poller is None or self.poller.done():
+            self.last_id = after
+            self.poller = self.loop.create_task(self.poll())
+
+    def unsubscribe(self, doctor_id, queue):
+        queues = self.subscribers.get(doctor_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[doctor_id]
+
+    def notify(self):
+        """Wake the poller now; safe to call from any thread."""
+        loop, wake = self.loop, self.wake
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wake.set)
+
+    async def poll(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self.wake.wait(), poll_seconds())
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                events = await anew_events(self.last_id)
+            except Exception:
+                logger.exception('Reading dashboard events failed')
+                continue
+            for event in events:
+                self.last_id = event.pk
+                for queue in self.subscribers.get(event.doctor_id, ()):
+                    queue.put_nowait(event)
+            if len(events) == NEW_EVENTS_LIMIT:
+                self.wake.set()
+
+
+hub = Hub()
+
+
+async def stream(doctor_id, last_event_id=None, since=None):
+    """Yield SSE text for ``doctor_id``'s changes: first the missed ones, then new ones as they happen."""
+    queue = hub.subscribe(doctor_id)
+    try:
+        text, newest = await aopening(doctor_id, last_event_id, since)
+        hub.start(newest)
+        yield text
+        deadline = time.monotonic() + STREAM_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            events = [event]
+            while not queue.empty():
+                events.append(queue.get_nowait())
+            yield await arender(events)
+    finally:
+        hub.unsubscribe(doctor_id, queue)
@@ -1,23 +1,81 @@
+import datetime
+
 from django import forms
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+from django.urls import reverse
+from django.utils import timezone
+from . import selectors
 from .models import Doctor, Patient, Prescription, Hospital, Appointment
+from .scheduling import availability
+
+
+class CatalogueChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for hospital in selectors.hospital_catalogue():
+            yield self.choice(hospital)
+
+    def __len__(self):
+        return len(selectors.hospital_catalogue()) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(selectors.hospital_catalogue())
+
+
+class HospitalChoiceField(forms.ModelChoiceField):
+    """Hospital select whose choices and validation come from the cached catalogue."""
+    iterator = CatalogueChoiceIterator
+
+    def __init__(self, queryset=None, **kwargs):
+        super().__init__(queryset if queryset is not None else Hospital.objects.all(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, Hospital):
+            value = value.pk
+        try:
+            return selectors.hospitals_by_pk()[int(value)]
+        except (KeyError, ValueError, TypeError):
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
 
 
 class DoctorForm(forms.ModelForm):
     class Meta:
         model = Doctor
-        fields = ['name', 'email', 'phone_number', 'specialization', 'hospital']
+        fields = ['name', 'email', 'phone_number', 'specialization', 'hospital', 'work_start', 'work_end', 'slot_minutes']
+        field_classes = {'hospital': HospitalChoiceField}
+        widgets = {
+            'work_start': forms.TimeInput(attrs={'type': 'time'}),
+            'work_end': forms.TimeInput(attrs={'type': 'time'}),
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         for fname, field in self.fields.items():
             field.widget.attrs.update({'class': 'form-control', 'aria-label': fname})
 
+    def clean(self):
+        cleaned_data = super().clean()
+        work_start = cleaned_data.get('work_start')
+        work_end = cleaned_data.get('work_end')
+        if work_start and work_end and work_end <= work_start:
+            self.add_error('work_end', 'Working hours must end after they start.')
+        return cleaned_data
+
 
 class PatientForm(forms.ModelForm):
     class Meta:
         model = Patient
         fields = ['name', 'email', 'phone_number', 'hospital', 'medical_record']
+        field_classes = {'hospital': HospitalChoiceField}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -32,7 +90,7 @@ class DoctorRegistrationForm(forms.Form):
     email = forms.EmailField()
     phone_number = forms.CharField(max_length=20)
     specialization = forms.CharField(max_length=255, required=False)
-    hospital = forms.ModelChoiceField(queryset=Hospital.objects.all())
+    hospital = HospitalChoiceField()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -47,7 +105,7 @@ class PatientRegistrationForm(forms.Form):
     name = forms.CharField(max_length=255)
     email = forms.EmailField()
     phone_number = forms.CharField(max_length=20)
-    hospital = forms.ModelChoiceField(queryset=Hospital.objects.all())
+    hospital = HospitalChoiceField()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -66,6 +124,33 @@ class PrescriptionForm(forms.ModelForm):
             field.widget.attrs.update({'class': 'form-control', 'aria-label': fname})
 
 
+class DoctorPicker(forms.Widget):
+    """Type-ahead doctor picker fed by the ``doctor_directory`` endpoint.
+
+    Renders the selected doctor only, never the list of all doctors; the
+    script in ``partials/doctor_picker_script.html`` does the rest.
+    """
+    template_name = 'hospital/widgets/doctor_picker.html'
+
+    def __init__(self, attrs=None, hospital_id=None):
+        super().__init__(attrs)
+        self.hospital_id = hospital_id
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget'].update(
+            url=reverse('doctor_directory'), hospital_id=self.hospital_id, label=self.label(value),
+        )
+        return context
+
+    def label(self, value):
+        try:
+            doctor = Doctor.objects.filter(pk=int(value)).first() if value else None
+        except (TypeError, ValueError):
+            doctor = None
+        return str(doctor) if doctor is not None else ''
+
+
 class AppointmentForm(forms.ModelForm):
     class Meta:
         model = Appointment
@@ -73,11 +158,38 @@ class AppointmentForm(forms.ModelForm):
         widgets = {
             'appointment_date': forms.DateInput(attrs={'type': 'date'}),
             'appointment_time': forms.TimeInput(attrs={'type': 'time'}),
+            'doctor': DoctorPicker,
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, hospital_id=None, **kwargs):
         super().__init__(*args, **kwargs)
         for fname, field in self.fields.items():
             field.widget.attrs.update({'class': 'form-control', 'aria-label': fname})
-        self.fields['doctor'].queryset = Doctor.objects.all()
+        # The picker starts out listing this hospital's doctors.
+        self.fields['doctor'].widget.hospital_id = hospital_id
         self.fields['message'].widget.attrs.update({'placeholder': 'Reason for appointment (optional)'})
+
+    def clean(self):
+        cleaned_data = super().clean()
+        doctor = cleaned_data.get('doctor')
+        date = cleaned_data.get('appointment_date')
+        time = cleaned_data.get('appointment_time')
+        if not (doctor and date and time):
+            return cleaned_data
+
+        start = timezone.make_aware(datetime.datetime.combine(date, time))
+        end = datetime.datetime.combine(date, time) + datetime.timedelta(minutes=doctor.slot_minutes)
+        if start < timezone.now():
+            self.add_error('appointment_time', 'That time has already passed.')
+        elif time < doctor.work_start or end > datetime.datetime.combine(date, doctor.work_end):
+            self.add_error('appointment_time', (
+                f'Dr. {doctor.name} sees patients between '
+                f'{doctor.work_start:%H:%M} and {doctor.work_end:%H:%M}.'
+            ))
+        elif availability.conflicts(doctor, date, time, verify=True, exclude=self.instance.pk):
+            message = f'Dr. {doctor.name} is already booked at that time.'
+            slots = availability.next_free_slots(3, doctor_id=doctor.pk, after=start)
+            if slots:
+                message += ' Next free: ' + ', '.join(f'{s.date} {s.time:%H:%M}' for s in slots) + '.'
+            self.add_error('appointment_time', message)
+        return cleaned_data
@@ -0,0 +1,105 @@
+"""Validation rules that reject GraphQL queries too expensive to execute.
+
+Depth is checked with graphene's ``depth_limit_validator``. Complexity is
+an estimate of the number of fields resolved: every field costs the product
+of the list sizes above it. A connection's size is its literal ``first``,
+the default page size without one, or the largest page when ``first`` is a
+variable. Other lists count as ``GRAPHQL_LIST_SIZE``, the most rows the
+loaders return for a nested list (``allHospitals`` is the small hospital
+catalogue).
+"""
+from django.conf import settings
+from graphene.validation import depth_limit_validator
+from graphql import GraphQLError, GraphQLList, GraphQLNonNull, get_named_type
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode, IntValueNode
+from graphql.validation import ValidationRule
+
+from . import pagination
+from .loaders import list_size
+from .schema import MAX_PAGE_SIZE
+
+
+def max_depth():
+    return getattr(settings, 'GRAPHQL_MAX_DEPTH', 10)
+
+
+def max_complexity():
+    return getattr(settings, 'GRAPHQL_MAX_COMPLEXITY', 10000)
+
+
+def _connection_size(node):
+    # Capped the way schema.resolve_connection caps it.
+    for argument in node.arguments or ():
+        if argument.name.value == 'first':
+            if isinstance(argument.value, IntValueNode):
+                return min(max(int(argument.value.value), 1), MAX_PAGE_SIZE)
+            # A variable can ask for the largest page.
+            return MAX_PAGE_SIZE
+    return min(pagination.page_size(), MAX_PAGE_SIZE)
+
+
+def _list_factor(node, field):
+    if 'first' in field.args:
+        return _connection_size(node)
+    field_type = field.type
+    if isinstance(field_type, GraphQLNonNull):
+        field_type = field_type.of_type
+    # Connection edges are already bounded by the connection's ``first``.
+    if isinstance(field_type, GraphQLList) and node.name.value != 'edges':
+        return list_size()
+    return 1
+
+
+def query_cost(schema, selection_set, parent_type, fragments, multiplier=1, visiting=frozenset()):
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            fields = getattr(parent_type, 'fields', {})
+            if name.startswith('__') or name not in fields:
+                continue
+            field = fields[name]
+            child_multiplier = multiplier * _list_factor(selection, field)
+            cost += child_multiplier
+            if selection.selection_set:
+                cost += query_cost(
+                    schema, selection.selection_set, get_named_type(field.type),
+                    fragments, child_multiplier, visiting,
+                )
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is None or name in visiting:
+                continue
+            cost += query_cost(
+                schema, fragment.selection_set, schema.get_type(fragment.type_condition.name.value),
+                fragments, multiplier, visiting | {name},
+            )
+        elif isinstance(selection, InlineFragmentNode):
+            fragment_type = parent_type
+            if selection.type_condition is not None:
+                fragment_type = schema.get_type(selection.type_condition.name.value)
+            cost += query_cost(schema, selection.selection_set, fragment_type, fragments, multiplier, visiting)
+    return cost
+
+
+class QueryComplexityRule(ValidationRule):
+    def enter_operation_definition(self, node, *args):
+        schema = self.context.schema
+        root_type = schema.get_root_type(node.operation)
+        if root_type is None:
+            return
+        fragments = {
+            definition.name.value: definition
+            for definition in self.context.document.definitions
+            if definition.kind == 'fragment_definition'
+        }
+        cost = query_cost(schema, node.selection_set, root_type, fragments)
+        if cost > max_complexity():
+            self.report_error(GraphQLError(
+                f'Query complexity {cost} exceeds the maximum of {max_complexity()}.', node,
+            ))
+
+
+def validation_rules():
+    return [depth_limit_validator(max_depth=max_depth()), QueryComplexityRule]
@@ -0,0 +1,168 @@
+"""GraphQL endpoint with persisted queries and parse/validation caching.
+
+Clients may send only the SHA-256 of a query they have sent before (the
+Apollo "automatic persisted queries" protocol), and the parsed, validated
+document for each distinct query text is kept in a per-process LRU, so
+repeated queries skip graphql-core's parser and validator entirely. Read-only
+results can additionally be cached for ``GRAPHQL_RESULT_CACHE_TTL`` seconds,
+keyed on the query, its variables and the requesting user. Queries (not
+mutations) read from a replica when one is configured; see ``routers``.
+"""
+import hashlib
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.views import GraphQLView, HttpError
+from graphene_django.settings import graphene_settings
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, parse, validate_schema
+from graphql.validation import validate
+
+from . import routers
+from .cache import LRUCache
+
+
+documents = LRUCache(getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 1000))
+persisted_queries = LRUCache(getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 1000))
+stats = Counter()
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def shared_cache():
+    return caches[getattr(settings, 'HOSPITAL_CACHE_ALIAS', 'default')]
+
+
+def result_cache_ttl():
+    return getattr(settings, 'GRAPHQL_RESULT_CACHE_TTL', 0)
+
+
+def reset():
+    documents.clear()
+    persisted_queries.clear()
+    stats.clear()
+
+
+class CachedGraphQLView(GraphQLView):
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        persisted = (extensions or {}).get('persistedQuery')
+        if persisted:
+            query = self.resolve_persisted_query(query, persisted.get('sha256Hash'))
+        return query, variables, operation_name, id
+
+    def resolve_persisted_query(self, query, digest):
+        if not isinstance(digest, str):
+            raise HttpError(HttpResponseBadRequest('persistedQuery requires a sha256Hash.'))
+        key = f'graphql:persisted:{digest}'
+        if query:
+            if sha256(query) != digest:
+                raise HttpError(HttpResponseBadRequest('provided sha does not match query'))
+            persisted_queries.set(digest, query)
+            shared_cache().set(key, query, None)
+            return query
+
+        query = persisted_queries.get(digest)
+        if query is None:
+            query = shared_cache().get(key)
+            if query is None:
+                stats['persisted_misses'] += 1
+                # Apollo clients retry with the full query text on this message.
+                raise HttpError(HttpResponse(status=200), 'PersistedQueryNotFound')
+            persisted_queries.set(digest, query)
+        stats['persisted_hits'] += 1
+        return query
+
+    def parse_and_validate(self, schema, query):
+        """Return ``(document, errors)``, reusing the result for query text seen before."""
+        key = sha256(query)
+        entry = documents.get(key)
+        if entry is not None:
+            stats['document_hits'] += 1
+            return entry
+        stats['document_misses'] += 1
+        try:
+            document = parse(query)
+        except Exception as e:
+            return None, [e]
+        entry = (document, validate(schema, document, self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS))
+        documents.set(key, entry)
+        return entry
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        document, errors = self.parse_and_validate(schema, query)
+        if document is None or errors:
+            return ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if operation_ast is not None and operation_ast.operation != OperationType.QUERY:
+            if request.method.lower() == "get":
+                if show_graphiql:
+                    return None
+                raise HttpError(HttpResponseNotAllowed(
+                    ["POST"],
+                    f"Can only perform a {operation_ast.operation.value} operation from a POST request.",
+                ))
+            # Mutations keep graphene-django's transaction handling.
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql,
+            )
+
+        ttl = result_cache_ttl()
+        if not ttl or operation_ast is None:
+            with routers.replica_reads():
+                return self.execute(request, schema, document, variables, operation_name)
+
+        user = request.user
+        key = 'graphql:result:' + sha256(json.dumps(
+            [sha256(query), variables, operation_name, user.pk if user.is_authenticated else None],
+            sort_keys=True, default=str,
+        ))
+        cached = shared_cache().get(key)
+        if cached is not None:
+            stats['result_hits'] += 1
+            return ExecutionResult(data=cached)
+        stats['result_misses'] += 1
+        with routers.replica_reads():
+            result = self.execute(request, schema, document, variables, operation_name)
+        if not result.errors:
+            shared_cache().set(key, result.data, ttl)
+        return result
+
+    def execute(self, request, schema, document, variables, operation_name):
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
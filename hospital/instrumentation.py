@@ -0,0 +1,305 @@
+"""Per-request performance instrumentation.
+
+``RequestMetricsMiddleware`` times each request and, through a database
+``execute_wrapper``, counts its queries, their total time and how many were
+repeats of an identical statement (the N+1 signature). Templates rendered
+through ``TimedDjangoTemplates`` add their render time; queries evaluated
+lazily while rendering count towards both. Each request is reported three
+ways: a ``Server-Timing`` header, a JSON log line on ``hospital.requests``
+and per-route histograms served by the ``/metrics/`` view in Prometheus
+text format. The histograms are per process, so scrape every worker.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+
+logger = logging.getLogger('hospital.requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current():
+    """The ``RequestMetrics`` of the request being handled, or None outside one."""
+    return _current.get()
+
+
+def duplicate_query_threshold():
+    return getattr(settings, 'METRICS_DUPLICATE_QUERY_THRESHOLD', 5)
+
+
+def server_timing_enabled():
+    return getattr(settings, 'METRICS_SERVER_TIMING', True)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.view_started = None
+        self.view_seconds = 0.0
+        self.statements = Counter()
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.sql_seconds = Counter()
+        self.template_seconds = Counter()
+        self.duplicate_queries = Counter()
+
+    def record(self, route, method, status, seconds, metrics):
+        with self._lock:
+            self.requests[(route, method, status)] += 1
+            self.durations[(route, method)].observe(seconds)
+            self.queries[route].observe(metrics.queries)
+            self.sql_seconds[route] += metrics.sql_seconds
+            self.template_seconds[route] += metrics.template_seconds
+            self.duplicate_queries[route] += metrics.duplicate_queries
+
+    def _histogram(self, lines, name, histograms, label_names):
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+            lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            header('hospital_requests_total', 'counter', 'Requests served by route, method and status.')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'hospital_requests_total{_labels(route=route, method=method, status=status)} {count}')
+            header('hospital_request_duration_seconds', 'histogram', 'Time spent handling a request.')
+            self._histogram(lines, 'hospital_request_duration_seconds', self.durations, ('route', 'method'))
+            header('hospital_request_queries', 'histogram', 'Database queries per request.')
+            self._histogram(lines, 'hospital_request_queries', self.queries, ('route',))
+            for name, counter, text in (
+                ('hospital_request_sql_seconds_total', self.sql_seconds, 'Time spent in database queries.'),
+                ('hospital_request_template_seconds_total', self.template_seconds, 'Time spent rendering templates.'),
+                ('hospital_request_duplicate_queries_total', self.duplicate_queries,
+                 'Queries that repeated an earlier statement of the same request.'),
+            ):
+                header(name, 'counter', text)
+                for route, value in sorted(counter.items()):
+                    lines.append(f'{name}{_labels(route=route)} {value}')
+
+        from . import cache
+        header('hospital_cache_events_total', 'counter', 'Versioned cache lookups by outcome.')
+        for event, count in sorted(cache.hospitals.stats.items()):
+            lines.append(f'hospital_cache_events_total{_labels(namespace=cache.hospitals.namespace, event=event)} {count}')
+        from . import throttling
+        header('hospital_throttled_requests_total', 'counter', 'Requests turned away with a 429, by scope and reason.')
+        for (scope, reason), count in sorted(throttling.stats.items()):
+            lines.append(f'hospital_throttled_requests_total{_labels(scope=scope, reason=reason)} {count}')
+        gate = throttling.admission()
+        for name, value, text in (
+            ('hospital_admission_limit', gate.limit, 'Concurrent writes this process currently admits.'),
+            ('hospital_admission_active', gate.active, 'Writes running in this process.'),
+            ('hospital_admission_waiting', gate.waiting, 'Writes queued for admission in this process.'),
+            ('hospital_admission_query_seconds', gate.latency, 'Moving average of admitted requests\' query time.'),
+        ):
+            header(name, 'gauge', text)
+            lines.append(f'{name} {value}')
+        try:
+            from . import graphql_views
+        except ImportError:
+            graphql_views = None
+        if graphql_views is not None:
+            header('hospital_graphql_cache_events_total', 'counter', 'GraphQL document, persisted query and result cache lookups.')
+            for event, count in sorted(graphql_views.stats.items()):
+                lines.append(f'hospital_graphql_cache_events_total{_labels(event=event)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None or metrics.rendering:
+            return super().render(context, request)
+        metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_seconds += time.perf_counter() - start
+            metrics.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing top-level renders for the current request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _instrument(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    # Connections are per thread, and under ASGI the ORM runs in
+    # sync_to_async threads; the context variable finds the request.
+    _instrument(connection)
+
+
+def _instrument_connections():
+    for alias in connections:
+        _instrument(connections[alias])
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, start = self._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics, token, start = self._begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, start)
+
+    def _begin(self):
+        _instrument_connections()
+        metrics = RequestMetrics()
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def _finish(self, request, response, metrics, start):
+        end = time.perf_counter()
+        if metrics.view_started is not None:
+            metrics.view_seconds = end - metrics.view_started
+        total = end - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        registry.record(route, request.method, response.status_code, total, metrics)
+
+        if server_timing_enabled():
+            response['Server-Timing'] = (
+                f'total;dur={_ms(total)}, view;dur={_ms(metrics.view_seconds)}, '
+                f'sql;dur={_ms(metrics.sql_seconds)};desc="{metrics.queries} queries", '
+                f'template;dur={_ms(metrics.template_seconds)}'
+            )
+
+        record = {
+            'method': request.method, 'path': request.path, 'route': route,
+            'status': response.status_code, 'total_ms': _ms(total),
+            'view_ms': _ms(metrics.view_seconds), 'sql_ms': _ms(metrics.sql_seconds),
+            'template_ms': _ms(metrics.template_seconds), 'queries': metrics.queries,
+            'duplicate_queries': metrics.duplicate_queries,
+        }
+        if metrics.duplicate_queries >= duplicate_query_threshold():
+            record['most_repeated'] = dict(zip(('sql', 'count'), metrics.most_repeated()))
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
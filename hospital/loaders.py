@@ -0,0 +1,125 @@
+"""Per-request batch loaders for the GraphQL schema.
+
+graphene-django executes queries synchronously, so loads can't be deferred
+to the end of an event-loop tick the way an asyncio DataLoader does.
+Instead, every key is queued as soon as the parent row that owns it is
+produced, and the first ``load()`` fetches all queued keys in one query;
+the siblings resolved after it are served from the loader's cache. A
+nested query therefore costs one query per level, however many rows each
+level holds.
+
+Nested lists (a hospital's doctors, a doctor's appointments, ...) return at
+most ``GRAPHQL_LIST_SIZE`` rows per parent, in the order of the matching
+top-level connection; one windowed query still fetches every parent's rows.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import selectors
+from .models import Hospital, Doctor, Patient, Prescription, Appointment
+
+
+def list_size():
+    return getattr(settings, 'GRAPHQL_LIST_SIZE', 10)
+
+
+class BatchLoader:
+    def __init__(self, batch_load_fn, default_factory=lambda: None):
+        self.batch_load_fn = batch_load_fn
+        self.default_factory = default_factory
+        self._cache = {}
+        self._pending = {}
+
+    def prime(self, keys):
+        """Queue ``keys`` so they are fetched with the next batch."""
+        for key in keys:
+            if key not in self._cache:
+                self._pending[key] = None
+
+    def prime_values(self, values):
+        self._cache.update(values)
+
+    def load(self, key):
+        if key not in self._cache:
+            self._pending[key] = None
+            keys = list(self._pending)
+            self._pending.clear()
+            found = self.batch_load_fn(keys)
+            for k in keys:
+                self._cache[k] = found[k] if k in found else self.default_factory()
+        return self._cache[key]
+
+
+class Loaders:
+    def __init__(self, user):
+        self.user = user
+        self.list_size = list_size()
+        newest = ('-created_at', '-id')
+        soonest = ('appointment_date', 'appointment_time', 'id')
+        self.doctor = BatchLoader(self._by_id(Doctor.objects.all()))
+        self.patient = BatchLoader(self._by_id(Patient.objects.all()))
+        self.doctors_by_hospital = BatchLoader(
+            self._grouped(lambda: Doctor.objects.all(), 'hospital_id', newest), list)
+        self.patients_by_hospital = BatchLoader(
+            self._grouped(lambda: selectors.visible_patients(user), 'hospital_id', newest), list)
+        self.appointments_by_doctor = BatchLoader(
+            self._grouped(lambda: selectors.visible_appointments(user), 'doctor_id', soonest), list)
+        self.appointments_by_patient = BatchLoader(
+            self._grouped(lambda: selectors.visible_appointments(user), 'patient_id', soonest), list)
+        self.prescriptions_by_doctor = BatchLoader(
+            self._grouped(lambda: selectors.visible_prescriptions(user), 'doctor_id', newest), list)
+        self.prescriptions_by_patient = BatchLoader(
+            self._grouped(lambda: selectors.visible_prescriptions(user), 'patient_id', newest), list)
+
+    def _by_id(self, queryset):
+        def batch_load(keys):
+            rows = {row.pk: row for row in queryset.filter(pk__in=keys)}
+            self.seen(list(rows.values()))
+            return rows
+        return batch_load
+
+    def _grouped(self, queryset, attname, order):
+        def batch_load(keys):
+            groups = defaultdict(list)
+            rows = list(queryset().filter(**{f'{attname}__in': keys}).annotate(
+                row_number=Window(RowNumber(), partition_by=F(attname), order_by=order),
+            ).filter(row_number__lte=self.list_size).order_by(*order))
+            for row in rows:
+                groups[getattr(row, attname)].append(row)
+            self.seen(rows)
+            return groups
+        return batch_load
+
+    def seen(self, rows):
+        """Queue the relations of freshly produced ``rows`` for batched loading."""
+        if not rows:
+            return
+        model = type(rows[0])
+        ids = [row.pk for row in rows]
+        if model is Hospital:
+            self.doctors_by_hospital.prime(ids)
+            self.patients_by_hospital.prime(ids)
+        elif model is Doctor:
+            self.doctor.prime_values({row.pk: row for row in rows})
+            self.appointments_by_doctor.prime(ids)
+            self.prescriptions_by_doctor.prime(ids)
+        elif model is Patient:
+            self.patient.prime_values({row.pk: row for row in rows})
+            self.appointments_by_patient.prime(ids)
+            self.prescriptions_by_patient.prime(ids)
+        elif model in (Appointment, Prescription):
+            self.doctor.prime(row.doctor_id for row in rows)
+            self.patient.prime(row.patient_id for row in rows)
+
+
+def get_loaders(info):
+    """The loaders for the request being executed, created on first use."""
+    context = info.context
+    loaders = getattr(context, '_graphql_loaders', None)
+    if loaders is None:
+        loaders = Loaders(context.user)
+        context._graphql_loaders = loaders
+    return loaders
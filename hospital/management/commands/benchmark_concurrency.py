@@ -0,0 +1,150 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.utils import timezone
+
+from hospital import seed
+from hospital.models import Doctor, Patient, Appointment
+
+
+# What SQLite did before hospital.db tuned it: rollback journal, full
+# fsync and the driver's default 5 s lock timeout.
+SQLITE_BASELINE = {'options': {}, 'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'}}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def apply_profile(profile):
+    """Reconfigure the default connection of this process for ``profile``."""
+    connections.close_all()
+    if profile is not None:
+        connection.settings_dict['OPTIONS'] = profile['options']
+        settings.SQLITE_PRAGMAS = profile['pragmas']
+
+
+def run_worker(worker_id, profile, seconds, write_ratio, results):
+    apply_profile(profile)
+    rng = random.Random(worker_id)
+    doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+    patient_ids = list(Patient.objects.values_list('id', flat=True))
+    today = timezone.localdate()
+    reads, writes, errors = [], [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        write = rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if write:
+                with transaction.atomic():
+                    Appointment.objects.create(
+                        doctor_id=rng.choice(doctor_ids), patient_id=rng.choice(patient_ids),
+                        appointment_date=today, appointment_time=f'{rng.randint(8, 16)}:00',
+                    )
+            else:
+                list(Appointment.objects.filter(
+                    doctor_id=rng.choice(doctor_ids), appointment_date__gte=today,
+                ).order_by('appointment_date', 'appointment_time', 'id')[:20])
+        except OperationalError:
+            errors += 1
+            continue
+        except IntegrityError:
+            # The slot was already booked; the database still did the write's work.
+            pass
+        (writes if write else reads).append((time.perf_counter() - start) * 1000)
+    connections.close_all()
+    results.put({'reads': reads, 'writes': writes, 'errors': errors})
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer a throwaway copy of the database from several processes at once and report '
+        'throughput, latency and lock errors, comparing SQLite defaults with the tuned profile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable results.')
+
+    def handle(self, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('This benchmark needs the fork start method (Linux or macOS).')
+
+        tmpdir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'concurrency.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed.generate(hospitals=5, doctors=50, patients=500, appointments=5000, prescriptions=0)
+            if connection.vendor == 'sqlite':
+                tuned = {'options': dict(connection.settings_dict['OPTIONS']), 'pragmas': dict(settings.SQLITE_PRAGMAS)}
+                profiles = {'sqlite defaults': SQLITE_BASELINE, 'tuned': tuned}
+            else:
+                profiles = {connection.vendor: None}
+            results = {name: self.run_profile(profile, options) for name, profile in profiles.items()}
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, r in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  {r['ops_per_second']:.0f} ops/s, {r['lock_errors']} lock errors")
+            for kind in ('reads', 'writes'):
+                self.stdout.write(
+                    f"  {kind:<6} p50 {r[kind]['p50_ms'] or 0:7.2f} ms  "
+                    f"p95 {r[kind]['p95_ms'] or 0:7.2f} ms  p99 {r[kind]['p99_ms'] or 0:7.2f} ms"
+                )
+
+    def run_profile(self, profile, options):
+        # Switch the journal mode while no other connection holds the file.
+        apply_profile(profile)
+        connection.ensure_connection()
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [
+            context.Process(target=run_worker, args=(
+                i, profile, options['seconds'], options['write_ratio'], results,
+            ))
+            for i in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        reads = [value for r in collected for value in r['reads']]
+        writes = [value for r in collected for value in r['writes']]
+        summary = {
+            'ops_per_second': (len(reads) + len(writes)) / options['seconds'],
+            'lock_errors': sum(r['errors'] for r in collected),
+        }
+        for kind, values in (('reads', reads), ('writes', writes)):
+            summary[kind] = {
+                'count': len(values),
+                'p50_ms': statistics.median(values) if values else None,
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+            }
+        return summary
@@ -0,0 +1,85 @@
+import importlib.util
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from hospital import passwords
+from hospital.models import Hospital
+
+
+PROFILES = {
+    'pbkdf2 (Django default)': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'scrypt (tuned)': 'hospital.passwords.TunedScryptPasswordHasher',
+    'argon2id (tuned)': 'hospital.passwords.TunedArgon2PasswordHasher',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Register patients through the registration view on a throwaway database with each '
+        'password hasher, reporting registrations per CPU-second and pooled hashing throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registrations', type=int, default=20)
+        parser.add_argument('--hashes', type=int, default=50, help='Passwords hashed through the pool.')
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable results.')
+
+    def handle(self, **options):
+        profiles = dict(PROFILES)
+        if importlib.util.find_spec('argon2') is None:
+            del profiles['argon2id (tuned)']
+            self.stderr.write('argon2-cffi is not installed; skipping Argon2.')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            hospital = Hospital.objects.create(
+                name='Benchmark', address='1 Main St', phone_number='555', email='b@example.com', capacity=1,
+            )
+            results = {}
+            for name, hasher in profiles.items():
+                with override_settings(PASSWORD_HASHERS=[hasher]):
+                    passwords.reset()
+                    results[name] = self.measure(name, hospital, options)
+            passwords.reset()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f'{os.cpu_count()} CPU(s), pool of {passwords.pool().workers} worker(s)')
+        for name, r in results.items():
+            self.stdout.write(
+                f"  {name:<24} {r['registration_ms']:7.1f} ms/registration  "
+                f"{r['registrations_per_cpu_second']:6.1f} registrations per CPU-second  "
+                f"{r['pooled_hashes_per_second']:6.1f} pooled hashes/s"
+            )
+
+    def measure(self, name, hospital, options):
+        client = Client()
+        prefix = name.split()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        for i in range(options['registrations']):
+            response = client.post(reverse('register_patient'), {
+                'username': f'{prefix}-{i}', 'password': 'correct horse battery staple',
+                'name': f'Patient {i}', 'email': f'{prefix}-{i}@example.com',
+                'phone_number': '555', 'hospital': hospital.pk,
+            })
+            if response.status_code != 302:
+                raise CommandError(f'Registration failed with status {response.status_code}.')
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        start = time.perf_counter()
+        passwords.make_passwords(['correct horse battery staple'] * options['hashes'])
+        pooled = time.perf_counter() - start
+        return {
+            'registration_ms': wall * 1000 / options['registrations'],
+            'registrations_per_cpu_second': options['registrations'] / cpu,
+            'pooled_hashes_per_second': options['hashes'] / pooled,
+        }
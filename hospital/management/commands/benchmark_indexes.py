@@ -0,0 +1,121 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from hospital import seed
+from hospital.models import Doctor, Patient, Prescription, Appointment
+
+
+INDEXED_MODELS = (Doctor, Patient, Prescription, Appointment)
+
+
+def hot_queries(doctor, patient, today):
+    """The list queries the dashboards and pagination actually run."""
+    return {
+        'doctor upcoming appointments': Appointment.objects.filter(
+            doctor_id=doctor.id, appointment_date__gte=today,
+        ).order_by('appointment_date', 'appointment_time', 'id')[:21],
+        'doctor past appointments': Appointment.objects.filter(
+            doctor_id=doctor.id, appointment_date__lt=today,
+        ).order_by('-appointment_date', '-appointment_time', '-id')[:21],
+        'patient upcoming appointments': Appointment.objects.filter(
+            patient_id=patient.id, appointment_date__gte=today,
+        ).order_by('appointment_date', 'appointment_time', 'id')[:21],
+        'doctor prescriptions': Prescription.objects.filter(
+            doctor_id=doctor.id,
+        ).order_by('-created_at', '-id')[:21],
+        'patient prescriptions': Prescription.objects.filter(
+            patient_id=patient.id,
+        ).order_by('-created_at', '-id')[:21],
+        'hospital doctors': Doctor.objects.filter(hospital_id=doctor.hospital_id).order_by('-created_at', '-id')[:21],
+        'hospital patients': Patient.objects.filter(hospital_id=patient.hospital_id).order_by('-created_at', '-id')[:21],
+    }
+
+
+def sorts_after_scan(plan):
+    # SQLite reports "USE TEMP B-TREE FOR ORDER BY"; PostgreSQL a Sort node.
+    return 'TEMP B-TREE' in plan or 'Sort' in plan
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database and compare query plans and timings of the '
+        'dashboard list queries without and with the composite indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=1_000_000)
+        parser.add_argument('--prescriptions', type=int, default=200_000)
+        parser.add_argument('--patients', type=int, default=50_000)
+        parser.add_argument('--doctors', type=int, default=1_000)
+        parser.add_argument('--hospitals', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable results.')
+
+    def handle(self, **options):
+        verbosity = options['verbosity']
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if verbosity:
+                self.stderr.write(f"Seeding {options['appointments']} appointments...")
+            seed.generate(
+                hospitals=options['hospitals'], doctors=options['doctors'],
+                patients=options['patients'], appointments=options['appointments'],
+                prescriptions=options['prescriptions'],
+            )
+            doctor = Doctor.objects.order_by('id').first()
+            patient = Patient.objects.order_by('id').first()
+            queries = hot_queries(doctor, patient, timezone.localdate())
+
+            self.set_indexes(False)
+            before = self.measure(queries, options['repeat'])
+            self.set_indexes(True)
+            after = self.measure(queries, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results = {name: {'before': before[name], 'after': after[name]} for name in queries}
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label in ('before', 'after'):
+                r = result[label]
+                self.stdout.write(
+                    f"  {label:<6} {r['median_ms']:8.2f} ms  "
+                    f"{'sort after scan' if r['sorts'] else 'index-ordered scan'}"
+                )
+                for line in r['plan'].splitlines():
+                    self.stdout.write(f'           {line}')
+
+    def set_indexes(self, present):
+        with connection.schema_editor() as editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    if present:
+                        editor.add_index(model, index)
+                    else:
+                        editor.remove_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, queryset in queries.items():
+            plan = queryset.explain()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {
+                'plan': plan,
+                'sorts': sorts_after_scan(plan),
+                'median_ms': statistics.median(timings),
+            }
+        return results
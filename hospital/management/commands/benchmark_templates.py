@@ -0,0 +1,109 @@
+import copy
+import json
+import os
+import shutil
+import statistics
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from hospital import benchmark, seed
+from hospital.models import Appointment, Doctor, Patient
+
+
+def template_settings(production):
+    templates = copy.deepcopy(settings.TEMPLATES)
+    options = templates[0]['OPTIONS']
+    options.pop('loaders', None)
+    templates[0]['APP_DIRS'] = not production
+    options['debug'] = not production
+    if production:
+        options['loaders'] = [('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ])]
+    return templates
+
+
+# name: (production template profile, fragment caching)
+PROFILES = {
+    'development': (False, False),
+    'production': (True, False),
+    'production + fragments': (True, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the doctor and patient dashboards on a throwaway database under the development '
+        'and production template profiles, with and without fragment caching, reporting '
+        'template render time, total time and queries per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=50_000)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable results.')
+
+    def handle(self, **options):
+        tmpdir = tempfile.mkdtemp()
+        caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+        caches[settings.HOSPITAL_CACHE_ALIAS]['LOCATION'] = os.path.join(tmpdir, 'cache')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed.generate(hospitals=5, doctors=50, patients=2000, appointments=options['appointments'], prescriptions=5000)
+            clients = {}
+            for model, url_name in ((Doctor, 'doctor_dashboard'), (Patient, 'patient_dashboard')):
+                # The busiest profile, so every list fills a page.
+                column = f'{model._meta.model_name}_id'
+                busiest = Appointment.objects.values(column).annotate(n=Count('id')).order_by('-n').first()
+                profile = model.objects.get(pk=busiest[column])
+                profile.user = User.objects.create_user(username=f'bench-{url_name}')
+                profile.save()
+                clients[url_name] = Client()
+                clients[url_name].force_login(profile.user)
+
+            results = {}
+            for name, (production, fragments) in PROFILES.items():
+                profile_caches = dict(caches)
+                if not fragments:
+                    profile_caches['template_fragments'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+                with override_settings(TEMPLATES=template_settings(production), CACHES=profile_caches):
+                    results[name] = {
+                        url_name: self.measure(client, reverse(url_name), options['repeat'])
+                        for url_name, client in clients.items()
+                    }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, pages in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for url_name, r in pages.items():
+                self.stdout.write(
+                    f"  {url_name:<18} template p50 {r['template_ms']:6.2f} ms  "
+                    f"total p50 {r['total_ms']:6.2f} ms  {r['queries']:3d} queries"
+                )
+
+    def measure(self, client, path, repeat):
+        client.get(path)
+        template, total, queries = [], [], []
+        for _ in range(repeat):
+            header = client.get(path)['Server-Timing']
+            template.append(benchmark.server_timing(header, 'template'))
+            total.append(benchmark.server_timing(header, 'total'))
+            queries.append(benchmark.server_timing_queries(header))
+        return {
+            'template_ms': statistics.median(template),
+            'total_ms': statistics.median(total),
+            'queries': round(statistics.median(queries)),
+        }
@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+
+from hospital import benchmark, seed
+from hospital.models import Doctor, Hospital, Patient
+
+
+# gunicorn arguments by --mode; 'asgi' needs uvicorn installed.
+SERVERS = {
+    'wsgi': ['hospitalProject.wsgi:application'],
+    'asgi': ['hospitalProject.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database and time every hospital URL through the test client '
+        'and a local gunicorn (WSGI, or ASGI with uvicorn workers), reporting p50/p95/p99 '
+        'latency, throughput, queries per request and peak RSS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospitals', type=int, default=20)
+        parser.add_argument('--doctors', type=int, default=500)
+        parser.add_argument('--patients', type=int, default=20_000)
+        parser.add_argument('--appointments', type=int, default=200_000)
+        parser.add_argument('--prescriptions', type=int, default=50_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=50, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per scenario.')
+        parser.add_argument('--mode', action='append', choices=sorted(SERVERS) + ['client'],
+                            help='Repeat to run several; defaults to client and wsgi.')
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes.')
+        parser.add_argument('--concurrency', type=int, default=1, help='HTTP requests in flight at once.')
+        parser.add_argument('--scenario', action='append', help='Only run these scenarios.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument('--compare', help='A previous JSON report to print changes against.')
+
+    def handle(self, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as report:
+                baseline = json.load(report)
+
+        tmpdir = tempfile.mkdtemp()
+        # Keep the seeded catalogue out of the real shared cache.
+        cache_dir = os.path.join(tmpdir, 'cache')
+        caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+        caches[settings.HOSPITAL_CACHE_ALIAS]['LOCATION'] = cache_dir
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=caches):
+                report = self.run(options, cache_dir)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(output + '\n')
+        else:
+            self.print_report(report)
+        if baseline is not None:
+            self.print_comparison(baseline, report)
+
+    def run(self, options, cache_dir):
+        if options['verbosity']:
+            self.stderr.write(f"Seeding {options['appointments']} appointments...")
+        seed.generate(
+            hospitals=options['hospitals'], doctors=options['doctors'], patients=options['patients'],
+            appointments=options['appointments'], prescriptions=options['prescriptions'],
+            seed=options['seed'],
+        )
+        users = {
+            'doctor': seed.create_accounts(Doctor, 1)[0],
+            'patient': seed.create_accounts(Patient, 1)[0],
+            'staff': User.objects.create_user(username='benchmark-staff', is_staff=True),
+        }
+        clients = {None: Client()}
+        for role in benchmark.ROLES:
+            clients[role] = Client()
+            clients[role].force_login(users[role])
+
+        scenario_list = benchmark.scenarios(Hospital.objects.order_by('id').first().pk)
+        uncovered = benchmark.uncovered_routes(scenario_list)
+        if uncovered:
+            self.stderr.write(self.style.WARNING(f"Routes without a scenario: {', '.join(uncovered)}"))
+        if options['scenario']:
+            scenario_list = [s for s in scenario_list if s.name in options['scenario']]
+
+        report = {
+            'config': {
+                name: options[name] for name in (
+                    'hospitals', 'doctors', 'patients', 'appointments', 'prescriptions',
+                    'seed', 'repeat', 'warmup', 'workers', 'concurrency',
+                )
+            },
+            'environment': {
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'results': {},
+        }
+        modes = options['mode'] or ['client', 'wsgi']
+        if 'client' in modes:
+            report['results']['client'] = benchmark.run_client(
+                clients, scenario_list, options['repeat'], options['warmup'],
+            )
+        cookies = {
+            role: f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+            for role, client in clients.items() if role
+        }
+        for mode in SERVERS:
+            if mode in modes:
+                report['results'][mode] = self.run_server(mode, options, scenario_list, cookies, cache_dir)
+        return report
+
+    def run_server(self, mode, options, scenario_list, cookies, cache_dir):
+        port = free_port()
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'hospitalProject.settings'))
+        env['HOSPITAL_CACHE_DIR'] = cache_dir
+        if connection.vendor == 'sqlite':
+            env['SQLITE_PATH'] = connection.settings_dict['NAME']
+        else:
+            env['POSTGRES_DB'] = connection.settings_dict['NAME']
+        # Let the workers open the database without waiting on this process.
+        connections.close_all()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *SERVERS[mode],
+             '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']), '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            self.wait_for(server, base_url)
+            return benchmark.run_http(
+                base_url, cookies, scenario_list, options['repeat'], options['warmup'],
+                server.pid, options['concurrency'],
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def wait_for(self, server, base_url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('The server exited during startup; are gunicorn (and uvicorn) installed?')
+            try:
+                urllib.request.urlopen(base_url + '/about/', timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'The server did not answer within {timeout} s.')
+
+    def print_report(self, report):
+        for mode, results in report['results'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(mode))
+            for name, r in results.items():
+                queries = '' if r['queries'] is None else f"{r['queries']:4d} queries"
+                rss = '' if r['peak_rss_kb'] is None else f"{r['peak_rss_kb'] // 1024:5d} MiB"
+                self.stdout.write(
+                    f"  {name:<24} p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  "
+                    f"p99 {r['p99_ms']:8.2f} ms  {r['requests_per_second']:7.1f} req/s  "
+                    f"{queries}  {rss}  {r['statuses']}"
+                )
+
+    def print_comparison(self, baseline, report):
+        self.stdout.write(self.style.MIGRATE_HEADING('Change against baseline'))
+        for mode, name, metric, before, after in benchmark.compare(baseline, report):
+            change = f'{(after - before) / before:+.0%}' if before else 'n/a'
+            self.stdout.write(f'  {mode:<9} {name:<24} {metric:<12} {before:>10} -> {after:>10}  {change}')
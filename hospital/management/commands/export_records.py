@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from hospital import bulk
+
+
+class Command(BaseCommand):
+    help = 'Stream doctors, patients or appointments to CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(bulk.EXPORT_FIELDS))
+        parser.add_argument('--format', choices=bulk.FORMATS, default='csv')
+        parser.add_argument('--output', default='-', help="File to write, or '-' for stdout.")
+
+    def handle(self, kind, **options):
+        output = options['output']
+        stream = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+        try:
+            for line in bulk.export_records(kind, options['format']):
+                stream.write(line)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
@@ -0,0 +1,35 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital import bulk
+
+
+class Command(BaseCommand):
+    help = 'Import doctors, patients or appointments from a CSV or JSON-lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(bulk.IMPORTERS))
+        parser.add_argument('path', help="File to read, or '-' for stdin.")
+        parser.add_argument('--format', choices=bulk.FORMATS,
+                            help='Defaults to the file extension, or csv for stdin.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, kind, path, **options):
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            try:
+                report = bulk.import_records(kind, bulk.read_records(stream, fmt), options['chunk_size'])
+            except ValueError as exc:
+                raise CommandError(f'Malformed input: {exc}')
+
+        for error in report.errors:
+            self.stderr.write(f"record {error['record']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.created} {kind}; {len(report.errors)} record(s) rejected.'
+        ))
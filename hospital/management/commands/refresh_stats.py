@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hospital import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-hospital counters and daily appointment rollups from the base tables.'
+
+    def handle(self, **options):
+        start = time.perf_counter()
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Statistics rebuilt in {time.perf_counter() - start:.1f} s.'))
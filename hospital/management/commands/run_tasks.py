@@ -0,0 +1,30 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from hospital import tasks
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (appointment emails, background imports). Start one process per worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no tasks are due.')
+
+    def handle(self, **options):
+        worker = tasks.Worker()
+        if options['burst']:
+            count = worker.run_pending()
+            self.stdout.write(f'Ran {count} task(s).')
+            return
+
+        stopping = []
+
+        def stop(signum, frame):
+            # Finish the current task, then exit.
+            stopping.append(signum)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f'Worker {worker.name} waiting for tasks.')
+        worker.run_forever(sleep=options['sleep'], should_stop=lambda: bool(stopping))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hospital import seed
+from hospital.models import Doctor, Patient
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the configured database with deterministic synthetic hospitals, doctors, '
+        'patients, appointments and prescriptions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospitals', type=int, default=10)
+        parser.add_argument('--doctors', type=int, default=100)
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--appointments', type=int, default=10000)
+        parser.add_argument('--prescriptions', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--accounts', type=int, default=0,
+                            help='Doctor and patient logins to create (usernames doctor<id>, patient<id>).')
+        parser.add_argument('--password', help='Password for the created logins; unusable if omitted.')
+
+    def handle(self, **options):
+        start = time.perf_counter()
+        seed.generate(
+            hospitals=options['hospitals'], doctors=options['doctors'], patients=options['patients'],
+            appointments=options['appointments'], prescriptions=options['prescriptions'],
+            seed=options['seed'], batch_size=options['batch_size'],
+        )
+        usernames = []
+        for model in (Doctor, Patient):
+            users = seed.create_accounts(model, options['accounts'], options['password'])
+            usernames += [user.username for user in users]
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded in {time.perf_counter() - start:.1f} s.'
+            + (f" Logins: {', '.join(usernames)}" if usernames else '')
+        ))
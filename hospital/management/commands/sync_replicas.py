@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from hospital import routers
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database over each SQLite read replica, for trying the replica '
+        'router locally. PostgreSQL replicas follow the primary through streaming replication instead.'
+    )
+
+    def handle(self, **options):
+        if not routers.replicas():
+            raise CommandError('No replicas configured; set SQLITE_REPLICA_PATHS.')
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite replicas can be copied; use streaming replication for PostgreSQL.')
+        primary.ensure_connection()
+        for alias in routers.replicas():
+            connections[alias].close()
+            target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f'Copied the primary to {alias}.'))
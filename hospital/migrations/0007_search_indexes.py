@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_indexes(apps, schema_editor):
+    from hospital import search
+    search.ensure_indexes(schema_editor.connection)
+
+
+def drop_indexes(apps, schema_editor):
+    from hospital import search
+    search.drop_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0006_doctor_working_hours'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.0.14 on 2026-10-18 03:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    # Historical models: the live ones may have columns this migration
+    # hasn't created yet.
+    alias = schema_editor.connection.alias
+    Doctor = apps.get_model('hospital', 'Doctor')
+    Patient = apps.get_model('hospital', 'Patient')
+    Appointment = apps.get_model('hospital', 'Appointment')
+    HospitalStats = apps.get_model('hospital', 'HospitalStats')
+    DoctorDay = apps.get_model('hospital', 'DoctorDay')
+    HospitalDay = apps.get_model('hospital', 'HospitalDay')
+    appointments = Appointment.objects.using(alias).order_by()
+
+    totals = {}
+    for field, model in (('doctors', Doctor), ('patients', Patient)):
+        for hospital_id, count in model.objects.using(alias).order_by().values_list('hospital_id').annotate(n=Count('id')):
+            totals.setdefault(hospital_id, {})[field] = count
+    for hospital_id, count in appointments.values_list('doctor__hospital_id').annotate(n=Count('id')):
+        totals.setdefault(hospital_id, {})['appointments'] = count
+    HospitalStats.objects.using(alias).bulk_create(
+        [HospitalStats(hospital_id=hospital_id, **counts) for hospital_id, counts in totals.items()],
+        batch_size=1000,
+    )
+    DoctorDay.objects.using(alias).bulk_create((
+        DoctorDay(doctor_id=doctor_id, date=date, appointments=count)
+        for doctor_id, date, count in appointments.values_list('doctor_id', 'appointment_date').annotate(
+            n=Count('id'),
+        ).iterator()
+    ), batch_size=1000)
+    HospitalDay.objects.using(alias).bulk_create((
+        HospitalDay(hospital_id=hospital_id, date=date, appointments=count)
+        for hospital_id, date, count in appointments.values_list('doctor__hospital_id', 'appointment_date').annotate(
+            n=Count('id'),
+        ).iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0008_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HospitalStats',
+            fields=[
+                ('hospital', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='hospital.hospital')),
+                ('doctors', models.IntegerField(default=0)),
+                ('patients', models.IntegerField(default=0)),
+                ('appointments', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Hospital stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DoctorDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('appointments', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='days', to='hospital.doctor')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HospitalDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('appointments', models.IntegerField(default=0)),
+                ('hospital', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='days', to='hospital.hospital')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='doctorday',
+            constraint=models.UniqueConstraint(fields=('doctor', 'date'), name='doctor_day_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='hospitalday',
+            constraint=models.UniqueConstraint(fields=('hospital', 'date'), name='hospital_day_unique'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('appointment', 'Appointment'), ('prescription', 'Prescription')], max_length=12)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('action', models.CharField(choices=[('saved', 'Saved'), ('deleted', 'Deleted')], max_length=7)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='hospital.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'id'], name='event_doctor_idx'), models.Index(fields=['created_at'], name='event_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.14 on 2026-10-18 04:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Doctor = apps.get_model('hospital', 'Doctor')
+    SpecializationCount = apps.get_model('hospital', 'SpecializationCount')
+    SpecializationCount.objects.using(alias).bulk_create([
+        SpecializationCount(hospital_id=hospital_id, specialization=specialization, doctors=count)
+        for hospital_id, specialization, count in Doctor.objects.using(alias).order_by().values_list(
+            'hospital_id', 'specialization',
+        ).annotate(n=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0011_dashboard_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecializationCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specialization', models.CharField(blank=True, max_length=255)),
+                ('doctors', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['name', 'id'], name='doctor_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['hospital', 'name', 'id'], name='doctor_hospital_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialization', 'name', 'id'], name='doctor_specialization_name_idx'),
+        ),
+        migrations.AddField(
+            model_name='specializationcount',
+            name='hospital',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='specializations', to='hospital.hospital'),
+        ),
+        migrations.AddIndex(
+            model_name='specializationcount',
+            index=models.Index(fields=['specialization', 'hospital'], name='specialization_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='specializationcount',
+            constraint=models.UniqueConstraint(fields=('hospital', 'specialization'), name='specialization_count_unique'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
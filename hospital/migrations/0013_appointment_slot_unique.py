@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-18 05:09
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_double_bookings(apps, schema_editor):
+    # Which of two bookings to keep is not the migration's call.
+    Appointment = apps.get_model('hospital', 'Appointment')
+    taken = Appointment.objects.using(schema_editor.connection.alias).order_by().values(
+        'doctor_id', 'appointment_date', 'appointment_time',
+    ).annotate(n=Count('id')).filter(n__gt=1).count()
+    if taken:
+        raise RuntimeError(
+            f'{taken} doctor slots hold more than one appointment. Move or cancel the extra '
+            'appointments, then apply this migration again.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0012_directory'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('doctor', 'appointment_date', 'appointment_time'), name='appt_doctor_slot_unique'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -9,6 +11,7 @@ class Hospital(models.Model):
     email = models.EmailField()
     website = models.URLField(blank=True, null=True)
     capacity = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
 
 
     class Meta:
@@ -26,10 +29,20 @@ class Doctor(models.Model):
     phone_number = models.CharField(max_length=20)
     specialization = models.CharField(max_length=255, blank=True)
     hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='doctors')
+    work_start = models.TimeField(default=datetime.time(9, 0))
+    work_end = models.TimeField(default=datetime.time(17, 0))
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['hospital', 'created_at', 'id'], name='doctor_hospital_created_idx'),
+            # Directory listings, alphabetical within each filter.
+            models.Index(fields=['name', 'id'], name='doctor_name_idx'),
+            models.Index(fields=['hospital', 'name', 'id'], name='doctor_hospital_name_idx'),
+            models.Index(fields=['specialization', 'name', 'id'], name='doctor_specialization_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.specialization})"
@@ -46,6 +59,9 @@ class Patient(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['hospital', 'created_at', 'id'], name='patient_hospital_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -60,6 +76,12 @@ class Prescription(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+        # Ascending indexes also serve the newest-first keyset scans: the
+        # database walks them backwards.
+        indexes = [
+            models.Index(fields=['doctor', 'created_at', 'id'], name='rx_doctor_created_idx'),
+            models.Index(fields=['patient', 'created_at', 'id'], name='rx_patient_created_idx'),
+        ]
 
     def __str__(self):
         return f"Prescription for {self.patient.name} by {self.doctor.name}"
@@ -75,6 +97,129 @@ class Appointment(models.Model):
 
     class Meta:
         ordering = ('appointment_date', 'appointment_time')
+        indexes = [
+            models.Index(fields=['doctor', 'appointment_date', 'appointment_time', 'id'], name='appt_doctor_slot_idx'),
+            models.Index(fields=['patient', 'appointment_date', 'appointment_time', 'id'], name='appt_patient_slot_idx'),
+        ]
+        constraints = [
+            # Two bookings racing for the same slot: the second insert fails.
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'], name='appt_doctor_slot_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Appointment: {self.patient.name} with {self.doctor.name} on {self.appointment_date}"
+
+
+class Task(models.Model):
+    """A unit of background work for ``hospital.tasks``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('run_at', 'id')
+        indexes = [
+            models.Index(fields=['status', 'run_at', 'id'], name='task_due_idx'),
+            models.Index(fields=['status', 'locked_until'], name='task_lease_idx'),
+        ]
 
     def __str__(self):
-        return f"Appointment: {self.patient.name} with {self.doctor.name} on {self.appointment_date}"
\ No newline at end of file
+        return f"{self.name} ({self.status})"
+
+
+class DashboardEvent(models.Model):
+    """A change to one of a doctor's appointments or prescriptions, for ``hospital.events``."""
+    APPOINTMENT = 'appointment'
+    PRESCRIPTION = 'prescription'
+    KIND_CHOICES = [(APPOINTMENT, 'Appointment'), (PRESCRIPTION, 'Prescription')]
+    SAVED = 'saved'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [(SAVED, 'Saved'), (DELETED, 'Deleted')]
+
+    # No foreign key constraint: deleting a doctor deletes their appointments
+    # first, and each of those records an event for the doctor.
+    doctor = models.ForeignKey(Doctor, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', 'id'], name='event_doctor_idx'),
+            models.Index(fields=['created_at'], name='event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} {self.action}"
+
+
+# Counters kept current by hospital.stats.
+
+class HospitalStats(models.Model):
+    hospital = models.OneToOneField(Hospital, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    doctors = models.IntegerField(default=0)
+    patients = models.IntegerField(default=0)
+    appointments = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Hospital stats'
+
+    def __str__(self):
+        return f"Stats for hospital {self.hospital_id}"
+
+
+class DoctorDay(models.Model):
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='days')
+    date = models.DateField()
+    appointments = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='doctor_day_unique'),
+        ]
+
+
+class HospitalDay(models.Model):
+    hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='days')
+    date = models.DateField()
+    appointments = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hospital', 'date'], name='hospital_day_unique'),
+        ]
+
+
+class SpecializationCount(models.Model):
+    """Doctors per specialization per hospital: the doctor directory's facets."""
+    hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='specializations')
+    specialization = models.CharField(max_length=255, blank=True)
+    doctors = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hospital', 'specialization'], name='specialization_count_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['specialization', 'hospital'], name='specialization_count_idx'),
+        ]
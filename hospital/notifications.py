@@ -0,0 +1,63 @@
+"""Appointment emails, sent from the task queue rather than the request.
+
+Booking queues a confirmation for now and a reminder for
+``APPOINTMENT_REMINDER_HOURS`` before the appointment. Both tasks reload
+the appointment when they run. If it has been deleted, they do nothing.
+The reminder is also dropped if the appointment has moved.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import tasks
+from .models import Appointment
+
+
+def reminder_lead():
+    return datetime.timedelta(hours=getattr(settings, 'APPOINTMENT_REMINDER_HOURS', 24))
+
+
+def _appointment(appointment_id):
+    return Appointment.objects.select_related('patient', 'doctor__hospital').filter(pk=appointment_id).first()
+
+
+def _send(template, appointment):
+    context = {'appointment': appointment, 'patient': appointment.patient, 'doctor': appointment.doctor}
+    subject = render_to_string(f'hospital/email/{template}_subject.txt', context).strip()
+    body = render_to_string(f'hospital/email/{template}.txt', context)
+    return send_mail(subject, body, None, [appointment.patient.email])
+
+
+@tasks.task(max_attempts=5, retry_delay=60)
+def send_appointment_confirmation(appointment_id):
+    appointment = _appointment(appointment_id)
+    if appointment is None:
+        return {'sent': 0}
+    return {'sent': _send('appointment_confirmation', appointment)}
+
+
+@tasks.task(max_attempts=5, retry_delay=300)
+def send_appointment_reminder(appointment_id, date, time):
+    appointment = _appointment(appointment_id)
+    if appointment is None or (appointment.appointment_date.isoformat(), appointment.appointment_time.isoformat()) != (date, time):
+        return {'sent': 0}
+    return {'sent': _send('appointment_reminder', appointment)}
+
+
+def appointment_starts(appointment):
+    return timezone.make_aware(datetime.datetime.combine(appointment.appointment_date, appointment.appointment_time))
+
+
+def appointment_booked(appointment):
+    """Queue the confirmation, and the reminder if it is still in the future."""
+    tasks.enqueue(send_appointment_confirmation, appointment.pk)
+    remind_at = appointment_starts(appointment) - reminder_lead()
+    if remind_at > timezone.now():
+        tasks.enqueue(
+            send_appointment_reminder, appointment.pk,
+            appointment.appointment_date.isoformat(), appointment.appointment_time.isoformat(),
+            run_at=remind_at,
+        )
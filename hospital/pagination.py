@@ -0,0 +1,203 @@
+"""Keyset (cursor) pagination for the dashboard feeds.
+
+A page is fetched with ``WHERE (key) > (last key seen) ORDER BY key LIMIT n``
+instead of an OFFSET, so every page costs the same no matter how deep into
+a user's history it is. Cursors are opaque, URL-safe encodings of the last
+row's key.
+
+``EstimatedCountPaginator`` is for the admin changelists, where counting a
+table of millions of rows for the page links would cost more than the page.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+from django.utils import timezone
+
+
+APPOINTMENT_WINDOWS = ('upcoming', 'past')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class LazyPage:
+    """A ``Page`` fetched on first use, so a template fragment served from cache costs no query."""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._page = None
+
+    @property
+    def page(self):
+        if self._page is None:
+            self._page = self._fetch()
+        return self._page
+
+    @property
+    def items(self):
+        return self.page.items
+
+    @property
+    def next_cursor(self):
+        return self.page.next_cursor
+
+    @property
+    def has_next(self):
+        return self.page.has_next
+
+    def __iter__(self):
+        return iter(self.page)
+
+    def __len__(self):
+        return len(self.page)
+
+
+def page_size():
+    return getattr(settings, 'DASHBOARD_PAGE_SIZE', 20)
+
+
+def encode_cursor(obj, fields):
+    values = []
+    for name in fields:
+        value = getattr(obj, name)
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except Exception:
+        raise InvalidCursor('Malformed pagination cursor.')
+
+
+def _after(fields, values, descending):
+    """Build the row-value comparison ``(fields) > (values)`` (``<`` when descending)."""
+    op = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, name in enumerate(fields):
+        term = Q(**{f'{name}__{op}': values[i]})
+        for prev, value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev: value})
+        condition |= term
+    return condition
+
+
+def _page_rows(queryset, fields, cursor, descending, size):
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(*[prefix + name for name in fields])
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, fields)
+        queryset = queryset.filter(_after(fields, values, descending))
+    return queryset[:size + 1]
+
+
+def _page(rows, fields, size):
+    next_cursor = encode_cursor(rows[size - 1], fields) if len(rows) > size else None
+    return Page(rows[:size], next_cursor)
+
+
+def keyset_page(queryset, fields, cursor=None, descending=False, size=None):
+    """Return the page of ``queryset`` ordered by ``fields`` that follows ``cursor``.
+
+    ``fields`` must end in a unique column (normally ``id``) so the ordering
+    is total and no row is skipped or repeated across pages.
+    """
+    size = size or page_size()
+    return _page(list(_page_rows(queryset, fields, cursor, descending, size)), fields, size)
+
+
+APPOINTMENT_FIELDS = ('appointment_date', 'appointment_time', 'id')
+PRESCRIPTION_FIELDS = ('created_at', 'id')
+
+
+def _appointment_window(queryset, window, today):
+    if window not in APPOINTMENT_WINDOWS:
+        raise ValueError(f'Unknown appointment window {window!r}.')
+    today = today or timezone.localdate()
+    if window == 'upcoming':
+        return queryset.filter(appointment_date__gte=today), False
+    return queryset.filter(appointment_date__lt=today), True
+
+
+def appointment_page(queryset, window='upcoming', cursor=None, today=None, size=None):
+    """Upcoming appointments soonest first, or past ones most recent first."""
+    queryset, descending = _appointment_window(queryset, window, today)
+    return keyset_page(queryset, APPOINTMENT_FIELDS, cursor, descending, size)
+
+
+def prescription_page(queryset, cursor=None, size=None):
+    """Prescriptions newest first, matching ``Prescription.Meta.ordering``."""
+    return keyset_page(queryset, PRESCRIPTION_FIELDS, cursor, descending=True, size=size)
+
+
+def estimated_rows(model, using='default'):
+    """A cheap estimate of how many rows ``model``'s table holds, or None."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table is first vacuumed or analyzed.
+        return row[0] if row and row[0] >= 0 else None
+    if model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):
+        # The highest id, read from the end of the primary key index. Rows
+        # deleted since only make it an overestimate.
+        return model._default_manager.using(using).aggregate(n=Max('pk'))['n'] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Pages without an exact ``COUNT(*)`` over large tables.
+
+    An unfiltered list whose table holds at least ``threshold`` rows uses
+    ``estimated_rows()``. A filtered or searched list counts at most
+    ``threshold`` matches. Pages past an overestimated end are empty rather
+    than errors.
+    """
+    threshold = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+            return queryset.count()
+        return queryset.order_by()[:self.threshold].count()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if int(number) < 1:
+                raise
+            return int(number)
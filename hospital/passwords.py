@@ -0,0 +1,119 @@
+"""Password hashers with configurable cost, and a bounded pool to run them on.
+
+``TunedArgon2PasswordHasher`` and ``TunedScryptPasswordHasher`` are Django's
+hashers with their parameters read from ``PASSWORD_ARGON2`` and
+``PASSWORD_SCRYPT``. Whichever is first in ``PASSWORD_HASHERS`` is used for
+new passwords; Django's ``check_password`` rehashes a stored password on
+the next successful login whenever its algorithm or parameters differ, so
+existing PBKDF2 accounts upgrade themselves.
+
+Registration hashes on a shared pool of ``PASSWORD_HASHING_WORKERS``
+threads (hashlib and argon2-cffi release the GIL while hashing) that
+accepts at most ``PASSWORD_HASHING_QUEUE`` waiting jobs, so a registration
+drive can't take every CPU away from the rest of the site. When the pool is
+full for ``PASSWORD_HASHING_WAIT`` seconds, ``HashingBusy`` is raised.
+Bulk imports hash one password per worker at a time, so the queue stays
+free for people registering while an import runs.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+from django.contrib.auth.hashers import make_password as django_make_password
+from django.contrib.auth.models import User
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    def __init__(self):
+        params = getattr(settings, 'PASSWORD_ARGON2', {})
+        self.time_cost = params.get('time_cost', self.time_cost)
+        self.memory_cost = params.get('memory_cost', self.memory_cost)
+        self.parallelism = params.get('parallelism', self.parallelism)
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    def __init__(self):
+        params = getattr(settings, 'PASSWORD_SCRYPT', {})
+        self.work_factor = params.get('work_factor', self.work_factor)
+        self.block_size = params.get('block_size', self.block_size)
+        self.parallelism = params.get('parallelism', self.parallelism)
+        # OpenSSL refuses more than 32 MiB unless told otherwise.
+        self.maxmem = 2 * 128 * self.work_factor * self.block_size
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingPool:
+    def __init__(self, workers, queue, wait):
+        self.workers = workers
+        self.wait = wait
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            raise HashingBusy('Too many passwords are being hashed; try again shortly.')
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1,
+                    queue=getattr(settings, 'PASSWORD_HASHING_QUEUE', 32),
+                    wait=getattr(settings, 'PASSWORD_HASHING_WAIT', 5),
+                )
+    return _pool
+
+
+def reset():
+    """Drop the pool so the next hash picks up changed settings."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+def make_password(password):
+    return pool().submit(django_make_password, password).result()
+
+
+def make_passwords(passwords):
+    """Hash several passwords in order, holding no more pool slots than there are workers."""
+    hashing = pool()
+    hashes = []
+    for start in range(0, len(passwords), hashing.workers):
+        futures = [
+            hashing.submit(django_make_password, password)
+            for password in passwords[start:start + hashing.workers]
+        ]
+        hashes.extend(future.result() for future in futures)
+    return hashes
+
+
+def create_user(username, email, password):
+    """``User.objects.create_user`` with the password hashed on the pool."""
+    user = User(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+        password=make_password(password),
+    )
+    user.save()
+    return user
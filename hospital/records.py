@@ -0,0 +1,161 @@
+"""Complete patient histories as CSV or FHIR-style NDJSON, streamed.
+
+A history is the patient row followed by all of their appointments and
+prescriptions. Exports walk the patients in keyset chunks of
+``PATIENT_CHUNK``. For each chunk they read the appointments and then the
+prescriptions through a server-side iterator. Rows are plain value tuples,
+never model instances. Memory stays at one chunk of patients plus one batch
+of rows, whether the export covers one patient or a whole hospital.
+
+CSV puts every record type in one table, with a ``record`` column saying
+which it is. NDJSON has one FHIR resource per line: ``Patient``,
+``Appointment`` and ``MedicationRequest``. They refer to each other as
+``Patient/<id>``, ``Practitioner/<id>`` and ``Organization/<id>``.
+"""
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+from django.utils.html import escape
+
+from .models import Appointment, Prescription
+from .streaming import Echo, serialize
+
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/fhir+ndjson'}
+
+PATIENT_CHUNK = 500
+ROW_CHUNK = 2000
+
+PATIENT_FIELDS = ('id', 'name', 'email', 'phone_number', 'hospital_id', 'medical_record', 'created_at')
+APPOINTMENT_FIELDS = (
+    'id', 'patient_id', 'doctor_id', 'doctor__name', 'appointment_date', 'appointment_time', 'message', 'created_at',
+)
+PRESCRIPTION_FIELDS = ('id', 'patient_id', 'doctor_id', 'doctor__name', 'medication', 'notes', 'created_at')
+
+CSV_COLUMNS = (
+    'record', 'id', 'patient_id', 'name', 'email', 'phone_number', 'hospital_id',
+    'doctor_id', 'doctor', 'date', 'time', 'text', 'notes', 'created_at',
+)
+
+
+def _patient_chunks(patients, size):
+    last = 0
+    while True:
+        chunk = list(
+            patients.filter(id__gt=last).order_by('id').values_list(*PATIENT_FIELDS, named=True)[:size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1].id
+
+
+def histories(patients, chunk_size=PATIENT_CHUNK):
+    """Yield ``(record, row)`` for each patient in ``patients`` and each of their appointments and prescriptions."""
+    for chunk in _patient_chunks(patients, chunk_size):
+        ids = [patient.id for patient in chunk]
+        for patient in chunk:
+            yield 'patient', patient
+        appointments = Appointment.objects.filter(patient_id__in=ids).order_by(
+            'patient_id', 'appointment_date', 'appointment_time', 'id',
+        ).values_list(*APPOINTMENT_FIELDS, named=True)
+        for appointment in appointments.iterator(chunk_size=ROW_CHUNK):
+            yield 'appointment', appointment
+        prescriptions = Prescription.objects.filter(patient_id__in=ids).order_by(
+            'patient_id', 'created_at', 'id',
+        ).values_list(*PRESCRIPTION_FIELDS, named=True)
+        for prescription in prescriptions.iterator(chunk_size=ROW_CHUNK):
+            yield 'prescription', prescription
+
+
+def csv_row(record, row, tz):
+    if record == 'patient':
+        values = {
+            'patient_id': row.id, 'name': row.name, 'email': row.email, 'phone_number': row.phone_number,
+            'hospital_id': row.hospital_id, 'text': row.medical_record,
+        }
+    elif record == 'appointment':
+        values = {
+            'patient_id': row.patient_id, 'doctor_id': row.doctor_id, 'doctor': row.doctor__name,
+            'date': row.appointment_date, 'time': row.appointment_time, 'text': row.message,
+        }
+    else:
+        values = {
+            'patient_id': row.patient_id, 'doctor_id': row.doctor_id, 'doctor': row.doctor__name,
+            'date': row.created_at.astimezone(tz).date(), 'text': row.medication, 'notes': row.notes,
+        }
+    values.update(record=record, id=row.id, created_at=row.created_at)
+    return [serialize(values.get(column, '')) for column in CSV_COLUMNS]
+
+
+def _reference(resource_type, pk, display=None):
+    reference = {'reference': f'{resource_type}/{pk}'}
+    if display is not None:
+        reference['display'] = display
+    return reference
+
+
+def fhir_resource(record, row, tz):
+    if record == 'patient':
+        resource = {
+            'resourceType': 'Patient',
+            'id': str(row.id),
+            'name': [{'text': row.name}],
+            'telecom': [{'system': 'email', 'value': row.email}, {'system': 'phone', 'value': row.phone_number}],
+            'managingOrganization': _reference('Organization', row.hospital_id),
+        }
+        if row.medical_record:
+            resource['text'] = {
+                'status': 'additional',
+                'div': f'<div xmlns="http://www.w3.org/1999/xhtml">{escape(row.medical_record)}</div>',
+            }
+        return resource
+    if record == 'appointment':
+        start = datetime.datetime.combine(row.appointment_date, row.appointment_time, tzinfo=tz)
+        resource = {
+            'resourceType': 'Appointment',
+            'id': str(row.id),
+            'status': 'booked',
+            'start': start.isoformat(),
+            'created': row.created_at.isoformat(),
+            'participant': [
+                {'actor': _reference('Patient', row.patient_id), 'status': 'accepted'},
+                {'actor': _reference('Practitioner', row.doctor_id, row.doctor__name), 'status': 'accepted'},
+            ],
+        }
+        if row.message:
+            resource['description'] = row.message
+        return resource
+    resource = {
+        'resourceType': 'MedicationRequest',
+        'id': str(row.id),
+        'status': 'active',
+        'intent': 'order',
+        'medicationCodeableConcept': {'text': row.medication},
+        'subject': _reference('Patient', row.patient_id),
+        'requester': _reference('Practitioner', row.doctor_id, row.doctor__name),
+        'authoredOn': row.created_at.isoformat(),
+    }
+    if row.notes:
+        resource['note'] = [{'text': row.notes}]
+    return resource
+
+
+def export(patients, fmt, chunk_size=PATIENT_CHUNK):
+    """Yield the histories of ``patients`` (a Patient queryset) as lines of CSV or NDJSON."""
+    rows = histories(patients, chunk_size)
+    # Dates are local; look the zone up once rather than per row.
+    tz = timezone.get_current_timezone()
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_COLUMNS)
+        for record, row in rows:
+            yield writer.writerow(csv_row(record, row, tz))
+    elif fmt == 'ndjson':
+        for record, row in rows:
+            yield json.dumps(fhir_resource(record, row, tz)) + '\n'
+    else:
+        raise ValueError(f'Unknown format {fmt!r}; expected one of {", ".join(FORMATS)}.')
@@ -0,0 +1,147 @@
+"""Send opted-in reads to read replicas, and a client's reads to the primary after it writes.
+
+Reads go to the primary (``default``) unless code marks them as safe to
+serve slightly stale with ``replica_reads()``: the dashboard lists, the
+admin hospital list and GraphQL queries do. Each request then uses one of
+``DATABASE_REPLICAS``, picked at random, for all of them.
+
+Writes always go to the primary. Once a request writes, its remaining
+reads stay on the primary, and ``ReplicaPinMiddleware`` sets a cookie that
+keeps the client's reads there for ``DATABASE_REPLICA_LAG`` seconds. A
+patient who just booked an appointment sees it on the next page, even if
+the replicas have not caught up yet. Code outside a request (task workers,
+management commands) always uses the primary.
+"""
+import contextlib
+import contextvars
+import math
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+PIN_COOKIE = 'primary_until'
+
+# Read from the primary even in replica_reads(): a replica that has not
+# caught up with a login would sign the user out.
+PRIMARY_APPS = {'auth', 'contenttypes', 'sessions'}
+
+# Writes that don't change what the client reads (session and message
+# storage) don't pin it.
+UNPINNED_APPS = {'sessions'}
+
+
+class ReadState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica_reads = 0
+        self.replica = None
+
+
+_state = contextvars.ContextVar('replica_read_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def replica_lag():
+    return getattr(settings, 'DATABASE_REPLICA_LAG', 5)
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """Let reads in this block go to a replica, unless the request must see its own writes."""
+    state = _state.get()
+    if state is None or not enabled:
+        yield
+        return
+    state.replica_reads += 1
+    try:
+        yield
+    finally:
+        state.replica_reads -= 1
+
+
+def recently_written(timestamp):
+    """Whether a change made at ``timestamp`` may not have reached the replicas yet."""
+    return timestamp is None or time.time() - timestamp < replica_lag()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None or not state.replica_reads or state.pinned or state.wrote
+            or not replicas() or model._meta.app_label in PRIMARY_APPS
+        ):
+            # None falls back to the instance's database, then to 'default'.
+            return None
+        if state.replica is None:
+            state.replica = random.choice(replicas())
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in UNPINNED_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {'default', *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self._begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self._begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    def _begin(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        state = ReadState(pinned)
+        return state, _state.set(state)
+
+    def _finish(self, state, response):
+        if state.wrote and replicas():
+            lag = replica_lag()
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + lag:.3f}', max_age=math.ceil(lag), httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,271 @@
+"""In-memory appointment availability index.
+
+Each doctor's booked appointments inside the booking horizon are kept as
+sorted minute-of-day offsets per date, so a conflict check is a bisect and
+"next free slots" walks a doctor's working day without touching the
+database. The index is built lazily in each process and kept current by
+the Appointment and Doctor signal handlers in ``signals.py``.
+
+Other worker processes don't see each other's in-memory updates, so
+bookings check the slot against the database (``verify=True``) instead of
+trusting the index either way. The index is rebuilt every
+``APPOINTMENT_INDEX_SECONDS`` and when the date changes, which drops past
+days and bookings other processes cancelled or moved.
+"""
+import bisect
+import datetime
+import heapq
+import itertools
+import threading
+from collections import defaultdict, namedtuple
+from time import monotonic
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Appointment, Doctor
+
+
+Slot = namedtuple('Slot', ['doctor_id', 'doctor_name', 'specialization', 'date', 'time'])
+
+
+def horizon_days():
+    return getattr(settings, 'APPOINTMENT_HORIZON_DAYS', 90)
+
+
+def rebuild_seconds():
+    return getattr(settings, 'APPOINTMENT_INDEX_SECONDS', 300)
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def _key(specialization):
+    return (specialization or '').strip().lower()
+
+
+class DoctorSchedule:
+    def __init__(self, doctor_id, name, hospital_id, specialization, work_start, work_end, slot_minutes):
+        self.doctor_id = doctor_id
+        self.booked = defaultdict(list)
+        self.configure(name, hospital_id, specialization, work_start, work_end, slot_minutes)
+
+    def configure(self, name, hospital_id, specialization, work_start, work_end, slot_minutes):
+        self.name = name
+        self.hospital_id = hospital_id
+        self.specialization = specialization
+        self.work_start = _minutes(work_start)
+        self.work_end = _minutes(work_end)
+        self.slot_minutes = max(slot_minutes, 1)
+
+    def book(self, date, minute):
+        bisect.insort(self.booked[date], minute)
+
+    def release(self, date, minute):
+        day = self.booked.get(date)
+        if not day:
+            return
+        i = bisect.bisect_left(day, minute)
+        if i < len(day) and day[i] == minute:
+            del day[i]
+        if not day:
+            del self.booked[date]
+
+    def conflicts(self, date, minute):
+        """True if a slot starting at ``minute`` overlaps an existing booking."""
+        day = self.booked.get(date, ())
+        i = bisect.bisect_left(day, minute - self.slot_minutes + 1)
+        return i < len(day) and day[i] < minute + self.slot_minutes
+
+    def free_slots(self, start, last_date):
+        """Yield free ``(date, minute)`` slot starts from ``start`` through ``last_date``."""
+        date = start.date()
+        while date <= last_date:
+            minute = self.work_start
+            if date == start.date():
+                earliest = _minutes(start.time()) + (1 if start.second or start.microsecond else 0)
+                if earliest > minute:
+                    minute += -(-(earliest - minute) // self.slot_minutes) * self.slot_minutes
+            while minute + self.slot_minutes <= self.work_end:
+                if not self.conflicts(date, minute):
+                    yield date, minute
+                minute += self.slot_minutes
+            date += datetime.timedelta(days=1)
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Drop everything; the next query rebuilds from the database."""
+        with self._lock:
+            self._schedules = None
+            self._by_hospital = defaultdict(set)
+            self._by_specialization = defaultdict(set)
+            self._appointments = {}
+            self._first = self._last = None
+            self._built = None
+
+    @property
+    def loaded(self):
+        return self._schedules is not None
+
+    def _ensure_loaded(self):
+        today = timezone.localdate()
+        last = today + datetime.timedelta(days=horizon_days())
+        if self._schedules is not None and (today > self._first or monotonic() - self._built > rebuild_seconds()):
+            self.reset()
+        if self._schedules is None:
+            self._built = monotonic()
+            self._schedules = {}
+            for row in Doctor.objects.order_by().values_list(
+                'id', 'name', 'hospital_id', 'specialization', 'work_start', 'work_end', 'slot_minutes',
+            ):
+                self._put_doctor(*row)
+            self._first, self._last = today, last
+            self._load_appointments(today, last)
+        elif last > self._last:
+            self._load_appointments(self._last + datetime.timedelta(days=1), last)
+            self._last = last
+
+    def _load_appointments(self, first, last):
+        rows = Appointment.objects.filter(appointment_date__range=(first, last)).order_by().values_list(
+            'id', 'doctor_id', 'appointment_date', 'appointment_time',
+        )
+        for row in rows.iterator(chunk_size=5000):
+            self._add(*row)
+
+    def _put_doctor(self, doctor_id, name, hospital_id, specialization, work_start, work_end, slot_minutes):
+        schedule = self._schedules.get(doctor_id)
+        if schedule is None:
+            schedule = self._schedules[doctor_id] = DoctorSchedule(
+                doctor_id, name, hospital_id, specialization, work_start, work_end, slot_minutes,
+            )
+        else:
+            self._drop_doctor_groups(schedule)
+            schedule.configure(name, hospital_id, specialization, work_start, work_end, slot_minutes)
+        self._by_hospital[hospital_id].add(doctor_id)
+        self._by_specialization[_key(specialization)].add(doctor_id)
+
+    def _drop_doctor_groups(self, schedule):
+        self._by_hospital[schedule.hospital_id].discard(schedule.doctor_id)
+        self._by_specialization[_key(schedule.specialization)].discard(schedule.doctor_id)
+
+    def _add(self, appointment_id, doctor_id, date, time):
+        schedule = self._schedules.get(doctor_id)
+        if schedule is None:
+            return
+        minute = _minutes(time)
+        schedule.book(date, minute)
+        self._appointments[appointment_id] = (doctor_id, date, minute)
+
+    def _discard(self, appointment_id):
+        entry = self._appointments.pop(appointment_id, None)
+        if entry is not None:
+            doctor_id, date, minute = entry
+            schedule = self._schedules.get(doctor_id)
+            if schedule is not None:
+                schedule.release(date, minute)
+
+    def _covers(self, date):
+        return self._first <= date <= self._last
+
+    # Signal hooks. They are no-ops until the index has been built.
+
+    def appointment_saved(self, appointment):
+        with self._lock:
+            if not self.loaded:
+                return
+            self._discard(appointment.pk)
+            if self._covers(appointment.appointment_date):
+                self._add(appointment.pk, appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+
+    def appointment_deleted(self, appointment):
+        with self._lock:
+            if self.loaded:
+                self._discard(appointment.pk)
+
+    def doctor_saved(self, doctor):
+        with self._lock:
+            if self.loaded:
+                self._put_doctor(
+                    doctor.pk, doctor.name, doctor.hospital_id, doctor.specialization,
+                    doctor.work_start, doctor.work_end, doctor.slot_minutes,
+                )
+
+    def doctor_deleted(self, doctor):
+        with self._lock:
+            if not self.loaded:
+                return
+            schedule = self._schedules.pop(doctor.pk, None)
+            if schedule is not None:
+                self._drop_doctor_groups(schedule)
+
+    # Queries
+
+    def conflicts(self, doctor, date, time, verify=False, exclude=None):
+        """True if booking ``doctor`` at ``date``/``time`` overlaps another appointment.
+
+        With ``verify`` the database answers, since it sees bookings other
+        processes made, cancelled or moved; the index may not yet.
+        """
+        minute = _minutes(time)
+        if not verify:
+            with self._lock:
+                self._ensure_loaded()
+                schedule = self._schedules.get(doctor.pk)
+                if schedule is not None and self._covers(date):
+                    own = self._appointments.get(exclude)
+                    if own is not None:
+                        schedule.release(*own[1:])
+                    try:
+                        return schedule.conflicts(date, minute)
+                    finally:
+                        if own is not None:
+                            schedule.book(*own[1:])
+        return self._conflicts_in_db(doctor, date, minute, exclude)
+
+    def _conflicts_in_db(self, doctor, date, minute, exclude):
+        booked = Appointment.objects.filter(doctor_id=doctor.pk, appointment_date=date)
+        if exclude is not None:
+            booked = booked.exclude(pk=exclude)
+        return any(
+            abs(_minutes(t) - minute) < doctor.slot_minutes
+            for t in booked.values_list('appointment_time', flat=True)
+        )
+
+    def next_free_slots(self, count, hospital_id=None, specialization=None, doctor_id=None, after=None):
+        """The ``count`` earliest free slots across matching doctors, soonest first."""
+        after = timezone.localtime(after) if after else timezone.localtime()
+        with self._lock:
+            self._ensure_loaded()
+            if doctor_id is not None:
+                candidates = {doctor_id} & self._schedules.keys()
+            else:
+                candidates = set(self._schedules)
+            if hospital_id is not None:
+                candidates &= self._by_hospital.get(hospital_id, set())
+            if specialization:
+                candidates &= self._by_specialization.get(_key(specialization), set())
+
+            streams = []
+            for pk in sorted(candidates):
+                schedule = self._schedules[pk]
+                streams.append(
+                    (date, minute, schedule.doctor_id) for date, minute in schedule.free_slots(after, self._last)
+                )
+            slots = []
+            for date, minute, pk in itertools.islice(heapq.merge(*streams), count):
+                schedule = self._schedules[pk]
+                slots.append(Slot(pk, schedule.name, schedule.specialization, date, _time(minute)))
+            return slots
+
+
+availability = AvailabilityIndex()
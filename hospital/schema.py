@@ -1,17 +1,201 @@
 import graphene
 from graphene_django import  DjangoObjectType
-from .models import Hospital
+from graphql import GraphQLError
+
+from . import pagination, selectors
+from .loaders import get_loaders
+from .models import Hospital, Doctor, Patient, Prescription, Appointment
+
+
+MAX_PAGE_SIZE = 100
+
+
+def nested_list(of_type, order):
+    return graphene.List(
+        graphene.NonNull(of_type), required=True,
+        description=f'At most GRAPHQL_LIST_SIZE rows, {order}.',
+    )
+
 
 class HospitalType(DjangoObjectType):
+    doctors = nested_list(lambda: DoctorType, 'newest first')
+    patients = nested_list(lambda: PatientType, 'newest first')
+
     class Meta:
         model = Hospital
         fields = ('id','name','address','phone_number','email','website','capacity')
 
+    def resolve_doctors(self, info):
+        return get_loaders(info).doctors_by_hospital.load(self.pk)
+
+    def resolve_patients(self, info):
+        return get_loaders(info).patients_by_hospital.load(self.pk)
+
+
+class DoctorType(DjangoObjectType):
+    hospital = graphene.Field(HospitalType, required=True)
+    appointments = nested_list(lambda: AppointmentType, 'soonest first')
+    prescriptions = nested_list(lambda: PrescriptionType, 'newest first')
+
+    class Meta:
+        model = Doctor
+        fields = ('id', 'name', 'email', 'phone_number', 'specialization', 'work_start', 'work_end', 'slot_minutes')
+
+    def resolve_hospital(self, info):
+        return selectors.hospitals_by_pk().get(self.hospital_id)
+
+    def resolve_appointments(self, info):
+        return get_loaders(info).appointments_by_doctor.load(self.pk)
+
+    def resolve_prescriptions(self, info):
+        return get_loaders(info).prescriptions_by_doctor.load(self.pk)
+
+
+class PatientType(DjangoObjectType):
+    hospital = graphene.Field(HospitalType, required=True)
+    appointments = nested_list(lambda: AppointmentType, 'soonest first')
+    prescriptions = nested_list(lambda: PrescriptionType, 'newest first')
+
+    class Meta:
+        model = Patient
+        fields = ('id', 'name', 'email', 'phone_number', 'medical_record', 'created_at')
+
+    def resolve_hospital(self, info):
+        return selectors.hospitals_by_pk().get(self.hospital_id)
+
+    def resolve_appointments(self, info):
+        return get_loaders(info).appointments_by_patient.load(self.pk)
+
+    def resolve_prescriptions(self, info):
+        return get_loaders(info).prescriptions_by_patient.load(self.pk)
+
+
+class AppointmentType(DjangoObjectType):
+    doctor = graphene.Field(DoctorType, required=True)
+    patient = graphene.Field(PatientType, required=True)
+
+    class Meta:
+        model = Appointment
+        fields = ('id', 'appointment_date', 'appointment_time', 'message', 'created_at')
+
+    def resolve_doctor(self, info):
+        return get_loaders(info).doctor.load(self.doctor_id)
+
+    def resolve_patient(self, info):
+        return get_loaders(info).patient.load(self.patient_id)
+
+
+class PrescriptionType(DjangoObjectType):
+    doctor = graphene.Field(DoctorType, required=True)
+    patient = graphene.Field(PatientType, required=True)
+
+    class Meta:
+        model = Prescription
+        fields = ('id', 'medication', 'notes', 'created_at')
+
+    def resolve_doctor(self, info):
+        return get_loaders(info).doctor.load(self.doctor_id)
+
+    def resolve_patient(self, info):
+        return get_loaders(info).patient.load(self.patient_id)
+
+
+class HospitalConnection(graphene.relay.Connection):
+    class Meta:
+        node = HospitalType
+
+
+class DoctorConnection(graphene.relay.Connection):
+    class Meta:
+        node = DoctorType
+
+
+class PatientConnection(graphene.relay.Connection):
+    class Meta:
+        node = PatientType
+
+
+class AppointmentConnection(graphene.relay.Connection):
+    class Meta:
+        node = AppointmentType
+
+
+class PrescriptionConnection(graphene.relay.Connection):
+    class Meta:
+        node = PrescriptionType
+
+
+def connection(connection_type, **filters):
+    return graphene.Field(
+        connection_type, required=True,
+        first=graphene.Int(), after=graphene.String(), **filters,
+    )
+
+
+def resolve_connection(connection_type, info, queryset, fields, first=None, after=None, descending=False):
+    """Resolve a Relay connection with the keyset cursors used by the dashboards."""
+    size = min(first or pagination.page_size(), MAX_PAGE_SIZE)
+    if size < 1:
+        raise GraphQLError('first must be positive.')
+    try:
+        page = pagination.keyset_page(queryset, fields, after, descending=descending, size=size)
+    except pagination.InvalidCursor as exc:
+        raise GraphQLError(str(exc))
+    get_loaders(info).seen(page.items)
+    edges = [
+        connection_type.Edge(node=node, cursor=pagination.encode_cursor(node, fields))
+        for node in page.items
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            has_next_page=page.has_next,
+            has_previous_page=bool(after),
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+
+
 class Query(graphene.ObjectType):
 
     all_hospitals = graphene.List(HospitalType)
+    hospitals = connection(HospitalConnection)
+    doctors = connection(DoctorConnection, hospital=graphene.ID(), specialization=graphene.String())
+    patients = connection(PatientConnection, hospital=graphene.ID())
+    appointments = connection(AppointmentConnection)
+    prescriptions = connection(PrescriptionConnection)
 
     def resolve_all_hospitals(self, info):
-        return Hospital.objects.all()
-    
-schema = graphene.Schema(query=Query)
\ No newline at end of file
+        hospitals = list(selectors.hospital_catalogue())
+        get_loaders(info).seen(hospitals)
+        return hospitals
+
+    def resolve_hospitals(self, info, **kwargs):
+        return resolve_connection(HospitalConnection, info, Hospital.objects.all(), ('name', 'id'), **kwargs)
+
+    def resolve_doctors(self, info, hospital=None, specialization=None, **kwargs):
+        queryset = Doctor.objects.all()
+        if hospital is not None:
+            queryset = queryset.filter(hospital_id=hospital)
+        if specialization:
+            queryset = queryset.filter(specialization__iexact=specialization)
+        return resolve_connection(DoctorConnection, info, queryset, ('created_at', 'id'), descending=True, **kwargs)
+
+    def resolve_patients(self, info, hospital=None, **kwargs):
+        queryset = selectors.visible_patients(info.context.user)
+        if hospital is not None:
+            queryset = queryset.filter(hospital_id=hospital)
+        return resolve_connection(PatientConnection, info, queryset, ('created_at', 'id'), descending=True, **kwargs)
+
+    def resolve_appointments(self, info, **kwargs):
+        queryset = selectors.visible_appointments(info.context.user)
+        return resolve_connection(
+            AppointmentConnection, info, queryset, ('appointment_date', 'appointment_time', 'id'), **kwargs,
+        )
+
+    def resolve_prescriptions(self, info, **kwargs):
+        queryset = selectors.visible_prescriptions(info.context.user)
+        return resolve_connection(PrescriptionConnection, info, queryset, ('created_at', 'id'), descending=True, **kwargs)
+
+schema = graphene.Schema(query=Query)
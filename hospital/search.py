@@ -0,0 +1,194 @@
+"""Full-text search over patients, doctors and prescriptions.
+
+On SQLite each searchable table has an FTS5 external-content index kept in
+sync by triggers, so bulk_create() and queryset.update() are covered too;
+on PostgreSQL a generated ``tsvector`` column with a GIN index plays the
+same role. Other backends fall back to ``icontains`` lookups.
+
+SQLite drops a table's triggers whenever a migration rebuilds it, so
+``ensure_indexes`` also runs after every ``migrate`` and recreates (and
+re-fills) anything missing.
+"""
+import re
+
+from django.db import connection as default_connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Doctor, Patient, Prescription
+
+
+SEARCH_FIELDS = {
+    Patient: ('name', 'email', 'phone_number', 'medical_record'),
+    Doctor: ('name', 'email', 'phone_number', 'specialization'),
+    Prescription: ('medication', 'notes'),
+}
+
+MAX_TERMS = 8
+
+
+def terms(text):
+    return re.findall(r'\w+', (text or '').lower())[:MAX_TERMS]
+
+
+def _fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def _columns(model):
+    return [model._meta.get_field(name).column for name in SEARCH_FIELDS[model]]
+
+
+def _sqlite_statements(model, rebuild):
+    table, fts = model._meta.db_table, _fts_table(model)
+    columns = _columns(model)
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+    ]
+    if rebuild:
+        statements.append(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return statements
+
+
+def _postgresql_statements(model):
+    table = model._meta.db_table
+    document = " || ' ' || ".join(f"coalesce({c}, '')" for c in _columns(model))
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)",
+    ]
+
+
+def ensure_indexes(connection=None):
+    """Create whatever part of the search indexes is missing."""
+    connection = connection or default_connection
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for model in SEARCH_FIELDS:
+            if model._meta.db_table not in tables:
+                continue
+            if connection.vendor == 'sqlite':
+                triggers = [f'{_fts_table(model)}_{suffix}' for suffix in ('ai', 'ad', 'au')]
+                cursor.execute(
+                    "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                    triggers,
+                )
+                # Missing triggers mean rows may have changed unindexed.
+                statements = _sqlite_statements(model, rebuild=cursor.fetchone()[0] < len(triggers))
+            elif connection.vendor == 'postgresql':
+                statements = _postgresql_statements(model)
+            else:
+                statements = []
+            for statement in statements:
+                cursor.execute(statement)
+
+
+def drop_indexes(connection=None):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        for model in SEARCH_FIELDS:
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {_fts_table(model)}_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {_fts_table(model)}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+                cursor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+def _match_sql(model, words):
+    """SQL selecting the ids of ``model``'s rows that match every word, with its params."""
+    if default_connection.vendor == 'sqlite':
+        fts = _fts_table(model)
+        return f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [' AND '.join(f'"{word}"*' for word in words)]
+    return (
+        f"SELECT id FROM {model._meta.db_table} WHERE search_vector @@ to_tsquery('simple', %s)",
+        [' & '.join(f'{word}:*' for word in words)],
+    )
+
+
+def _ranked_ids(model, words, filters, limit):
+    table = model._meta.db_table
+    quote = default_connection.ops.quote_name
+    where, params = [], []
+    for attname, value in filters.items():
+        where.append(f't.{quote(model._meta.get_field(attname).column)} = %s')
+        params.append(value)
+    scope = ''.join(f' AND {clause}' for clause in where)
+
+    if default_connection.vendor == 'sqlite':
+        fts = _fts_table(model)
+        sql = (
+            f'SELECT t.id FROM {fts} JOIN {table} t ON t.id = {fts}.rowid '
+            f'WHERE {fts} MATCH %s{scope} ORDER BY bm25({fts}) LIMIT %s'
+        )
+        match = ' AND '.join(f'"{word}"*' for word in words)
+        params = [match] + params + [limit]
+    else:
+        sql = (
+            f"SELECT t.id FROM {table} t WHERE t.search_vector @@ to_tsquery('simple', %s){scope} "
+            f"ORDER BY ts_rank(t.search_vector, to_tsquery('simple', %s)) DESC LIMIT %s"
+        )
+        match = ' & '.join(f'{word}:*' for word in words)
+        params = [match] + params + [match, limit]
+    with default_connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(model, text, limit=20, **filters):
+    """Rows of ``model`` matching every word of ``text`` as a prefix, best first.
+
+    ``filters`` are column equality constraints applied inside the ranked
+    query (e.g. ``hospital_id=3``), so scoping doesn't cost a second pass.
+    """
+    words = terms(text)
+    if not words:
+        return []
+    if default_connection.vendor in ('sqlite', 'postgresql'):
+        ids = _ranked_ids(model, words, filters, limit)
+        rows = model.objects.in_bulk(ids)
+        return [rows[pk] for pk in ids if pk in rows]
+
+    queryset = model.objects.filter(**filters)
+    for word in words:
+        match = Q()
+        for name in SEARCH_FIELDS[model]:
+            match |= Q(**{f'{name}__icontains': word})
+        queryset = queryset.filter(match)
+    return list(queryset[:limit])
+
+
+def filter_queryset(queryset, text):
+    """Narrow ``queryset`` to the rows matching ``text``, through the index.
+
+    Used by the admin's search boxes and autocomplete widgets, where
+    ``icontains`` would scan the whole table. The match is a subquery, so
+    the queryset's own filters (list filters, ``limit_choices_to``) apply
+    to every matching row.
+    """
+    words = terms(text)
+    if not words:
+        return queryset
+    model = queryset.model
+    if default_connection.vendor in ('sqlite', 'postgresql'):
+        return queryset.filter(pk__in=RawSQL(*_match_sql(model, words)))
+    for word in words:
+        match = Q()
+        for name in SEARCH_FIELDS[model]:
+            match |= Q(**{f'{name}__icontains': word})
+        queryset = queryset.filter(match)
+    return queryset
@@ -0,0 +1,127 @@
+"""Synthetic hospital data for benchmarks.
+
+Rows are generated deterministically from ``seed`` and written with
+``bulk_create`` in batches, so millions of rows can be produced without
+holding them all in memory.
+"""
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import stats
+from .models import Hospital, Doctor, Patient, Prescription, Appointment
+
+
+SPECIALIZATIONS = (
+    'Cardiology', 'Dermatology', 'Neurology', 'Oncology', 'Paediatrics',
+    'Psychiatry', 'Radiology', 'Surgery', 'General Practice', 'Orthopaedics',
+)
+MEDICATIONS = (
+    'Amoxicillin', 'Ibuprofen', 'Paracetamol', 'Metformin', 'Atorvastatin',
+    'Omeprazole', 'Lisinopril', 'Salbutamol', 'Sertraline', 'Cetirizine',
+)
+FIRST_NAMES = ('Ada', 'Ben', 'Chidi', 'Dara', 'Emeka', 'Funmi', 'Grace', 'Hassan', 'Ife', 'Joy')
+LAST_NAMES = ('Okafor', 'Smith', 'Adeyemi', 'Bello', 'Chen', 'Diallo', 'Eze', 'Garcia', 'Ibrahim', 'Nwosu')
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(model, rows, batch_size, using, ignore_conflicts=False):
+    for batch in _batched(rows, batch_size):
+        with transaction.atomic(using=using):
+            model.objects.using(using).bulk_create(batch, batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+
+
+def _name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def generate(hospitals=10, doctors=100, patients=1000, appointments=10000, prescriptions=5000,
+             seed=0, today=None, batch_size=5000, using='default'):
+    """Populate the database with the given number of rows of each model.
+
+    Appointments are spread evenly over two years either side of ``today``
+    so both the upcoming and past dashboard windows are exercised.
+    """
+    rng = random.Random(seed)
+    today = today or timezone.localdate()
+
+    _insert(Hospital, (
+        Hospital(
+            name=f'Hospital {i:04d}', address=f'{i} Health Way', phone_number='5550100',
+            email=f'hospital{i}@example.com', capacity=rng.randint(20, 500),
+        )
+        for i in range(hospitals)
+    ), batch_size, using)
+    hospital_ids = list(Hospital.objects.using(using).values_list('id', flat=True))
+
+    _insert(Doctor, (
+        Doctor(
+            name=_name(rng), email=f'doctor{i}@example.com', phone_number='555',
+            specialization=rng.choice(SPECIALIZATIONS), hospital_id=rng.choice(hospital_ids),
+        )
+        for i in range(doctors)
+    ), batch_size, using)
+    doctor_ids = list(Doctor.objects.using(using).values_list('id', flat=True))
+
+    _insert(Patient, (
+        Patient(
+            name=_name(rng), email=f'patient{i}@example.com', phone_number='555',
+            hospital_id=rng.choice(hospital_ids),
+        )
+        for i in range(patients)
+    ), batch_size, using)
+    patient_ids = list(Patient.objects.using(using).values_list('id', flat=True))
+
+    # A random draw of a slot that is already taken is skipped.
+    _insert(Appointment, (
+        Appointment(
+            doctor_id=rng.choice(doctor_ids), patient_id=rng.choice(patient_ids),
+            appointment_date=today + datetime.timedelta(days=rng.randint(-730, 730)),
+            appointment_time=datetime.time(rng.randint(8, 16), rng.choice((0, 15, 30, 45))),
+        )
+        for _ in range(appointments)
+    ), batch_size, using, ignore_conflicts=True)
+
+    _insert(Prescription, (
+        Prescription(
+            doctor_id=rng.choice(doctor_ids), patient_id=rng.choice(patient_ids),
+            medication=f'{rng.choice(MEDICATIONS)} {rng.choice((250, 500, 1000))}mg',
+        )
+        for _ in range(prescriptions)
+    ), batch_size, using)
+    # bulk_create skips the signals that keep the counters current.
+    stats.rebuild(using=using)
+
+
+def create_accounts(model, count, password=None, using='default'):
+    """Give the first ``count`` ``model`` profiles that have no login a user account.
+
+    Usernames are ``<model name><pk>`` (e.g. ``doctor12``) and every account
+    shares one password hash; without ``password`` they cannot log in with
+    a password at all.
+    """
+    profiles = list(model.objects.using(using).filter(user__isnull=True).order_by('id')[:count])
+    hashed = make_password(password)
+    with transaction.atomic(using=using):
+        users = User.objects.using(using).bulk_create([
+            User(username=f'{model._meta.model_name}{profile.pk}', email=profile.email, password=hashed)
+            for profile in profiles
+        ])
+        for profile, user in zip(profiles, users):
+            profile.user = user
+        model.objects.using(using).bulk_update(profiles, ['user'])
+    return users
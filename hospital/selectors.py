@@ -0,0 +1,111 @@
+"""Read-side query helpers.
+
+Every queryset returned here joins the related rows its template needs,
+so rendering a list costs one query no matter how many rows it holds.
+The hospital catalogue is served from ``cache.hospitals``.
+"""
+from django.http import Http404
+
+from . import cache
+from .models import Hospital, Doctor, Patient, Prescription, Appointment
+
+
+def hospital_catalogue():
+    """All hospitals in ``Hospital.Meta.ordering``, cached until a hospital changes."""
+    return cache.hospitals.get_or_set('catalogue', lambda: tuple(Hospital.objects.all()))
+
+
+def hospitals_by_pk():
+    return cache.hospitals.get_or_set(
+        'by_pk', lambda: {hospital.pk: hospital for hospital in hospital_catalogue()},
+    )
+
+
+def get_hospital(pk):
+    try:
+        return hospitals_by_pk()[pk]
+    except KeyError:
+        raise Http404('No Hospital matches the given query.')
+
+
+def doctor_appointments(doctor):
+    return doctor.appointments.select_related('patient')
+
+
+def doctor_prescriptions(doctor):
+    return doctor.prescriptions.select_related('patient')
+
+
+def patient_appointments(patient):
+    return patient.appointments.select_related('doctor')
+
+
+def patient_prescriptions(patient):
+    return patient.prescriptions.select_related('doctor')
+
+
+def _profile(user, name):
+    try:
+        return getattr(user, name)
+    except (Doctor.DoesNotExist, Patient.DoesNotExist):
+        return None
+
+
+def visible_patients(user):
+    """Patients ``user`` may see: staff see everyone, doctors their hospital's, patients themselves."""
+    if not user.is_authenticated:
+        return Patient.objects.none()
+    if user.is_staff:
+        return Patient.objects.all()
+    doctor = _profile(user, 'doctor')
+    if doctor is not None:
+        return Patient.objects.filter(hospital_id=doctor.hospital_id)
+    return Patient.objects.filter(user_id=user.pk)
+
+
+def _visible_records(model, user):
+    if not user.is_authenticated:
+        return model.objects.none()
+    if user.is_staff:
+        return model.objects.all()
+    doctor = _profile(user, 'doctor')
+    if doctor is not None:
+        return model.objects.filter(doctor_id=doctor.pk)
+    return model.objects.filter(patient__user_id=user.pk)
+
+
+def visible_appointments(user):
+    return _visible_records(Appointment, user)
+
+
+def visible_prescriptions(user):
+    return _visible_records(Prescription, user)
+
+
+def search_scope(user, kind):
+    """Column filters limiting a ``search`` of ``kind`` to rows ``user`` may see, or None for none.
+
+    Mirrors the ``visible_*`` helpers, except that patients may look up
+    their own hospital's doctors.
+    """
+    if not user.is_authenticated:
+        return None
+    if user.is_staff:
+        return {}
+    doctor = _profile(user, 'doctor')
+    if doctor is not None:
+        if kind == 'prescriptions':
+            return {'doctor_id': doctor.pk}
+        return {'hospital_id': doctor.hospital_id}
+    patient = _profile(user, 'patient')
+    if patient is None or kind == 'patients':
+        return None
+    if kind == 'prescriptions':
+        return {'patient_id': patient.pk}
+    return {'hospital_id': patient.hospital_id}
+
+
+def prescribable_patients(doctor):
+    """Patients a doctor may prescribe for: their hospital's, or everyone if it has none."""
+    hospital_patients = Patient.objects.filter(hospital_id=doctor.hospital_id)
+    return hospital_patients if hospital_patients.exists() else Patient.objects.all()
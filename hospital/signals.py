@@ -0,0 +1,139 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import accounts, cache, events, search, stats
+from .models import Appointment, DashboardEvent, Doctor, Hospital, Patient, Prescription
+from .scheduling import availability
+
+
+# bulk._announce passes bulk=True: bulk imports count their chunks in
+# stats.record_created instead of one UPDATE per row.
+
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def hospital_changed(sender, instance, **kwargs):
+    cache.hospitals.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Hospital)
+def hospital_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        stats.hospital_saved(instance, created)
+
+
+@receiver(pre_save, sender=Appointment)
+def appointment_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.appointment_saving(instance)
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, raw=False, bulk=False, **kwargs):
+    availability.appointment_saved(instance)
+    if not (raw or bulk):
+        stats.appointment_saved(instance, created)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    availability.appointment_deleted(instance)
+    stats.appointment_deleted(instance)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Prescription)
+@receiver(post_delete, sender=Prescription)
+def dashboard_record_changed(sender, instance, bulk=False, **kwargs):
+    # Both dashboards list the record; their cached fragments go stale.
+    if not bulk:
+        stamps = {f'doctor:{instance.doctor_id}', f'patient:{instance.patient_id}'}
+        before = getattr(instance, '_stats_before', None)
+        if before is not None:
+            stamps.add(f'doctor:{before[0]}')
+        cache.dashboards.bump_on_commit(*stamps)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Prescription)
+def dashboard_record_saved(sender, instance, raw=False, bulk=False, **kwargs):
+    # Streamed to the doctor's open dashboard; imports show up on reload.
+    if not (raw or bulk):
+        before = getattr(instance, '_stats_before', None)
+        events.record(instance, DashboardEvent.SAVED, previous_doctor_id=before[0] if before else None)
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Prescription)
+def dashboard_record_deleted(sender, instance, **kwargs):
+    events.record(instance, DashboardEvent.DELETED)
+
+
+@receiver(pre_save, sender=Doctor)
+def doctor_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.doctor_saving(instance)
+
+
+@receiver(pre_save, sender=Patient)
+def profile_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.profile_saving(instance)
+
+
+@receiver(post_save, sender=Doctor)
+def doctor_saved(sender, instance, created, raw=False, bulk=False, **kwargs):
+    availability.doctor_saved(instance)
+    if not (raw or bulk):
+        stats.doctor_saved(instance, created)
+
+
+@receiver(post_delete, sender=Doctor)
+def doctor_deleted(sender, instance, **kwargs):
+    availability.doctor_deleted(instance)
+    stats.doctor_deleted(instance)
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, raw=False, bulk=False, **kwargs):
+    if not (raw or bulk):
+        stats.patient_saved(instance, created)
+
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, instance, **kwargs):
+    stats.patient_deleted(instance)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def hospital_patients_changed(sender, instance, bulk=False, **kwargs):
+    # Doctors' prescription forms list their hospital's patients.
+    if not bulk:
+        stamps = {f'patients:{instance.hospital_id}'}
+        before = getattr(instance, '_stats_before', None)
+        if before is not None:
+            stamps.add(f'patients:{before}')
+        cache.dashboards.bump_on_commit(*stamps)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    accounts.forget(instance.pk)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def account_profile_changed(sender, instance, bulk=False, **kwargs):
+    # Imported profiles are new; nobody has them cached yet.
+    if not bulk:
+        accounts.forget(instance.user_id)
+
+
+def ensure_search_indexes(sender, using, **kwargs):
+    search.ensure_indexes(connections[using])
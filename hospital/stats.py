@@ -0,0 +1,229 @@
+"""Per-hospital counters and daily appointment rollups.
+
+``HospitalStats`` holds each hospital's doctor, patient and appointment
+counts. ``DoctorDay`` and ``HospitalDay`` hold appointments per doctor and
+per hospital per day. ``SpecializationCount`` holds doctors per
+specialization per hospital, the facets of the doctor directory. The signal handlers in ``signals.py`` adjust them
+with ``UPDATE ... SET n = n + 1`` in the same transaction as the change, so
+the detail page and the admin read a few rows instead of counting the large
+tables. Bulk imports add a whole chunk at once through ``record_created``.
+
+``rebuild()`` (``python manage.py refresh_stats``) recomputes every
+counter from the base tables. Use it to backfill, or to repair drift after
+writes that bypass the ORM signals (``QuerySet.update``, raw SQL).
+"""
+import datetime
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Appointment, Doctor, DoctorDay, HospitalDay, HospitalStats, Patient, SpecializationCount
+
+
+def _bump(model, lookup, field, delta, **extra):
+    if not delta:
+        return
+    if model.objects.filter(**lookup).update(**{field: F(field) + delta}, **extra):
+        return
+    if delta < 0:
+        # The row went with its doctor or hospital in a cascading delete.
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **{field: delta})
+    except IntegrityError:
+        # Another request created the row first.
+        model.objects.filter(**lookup).update(**{field: F(field) + delta}, **extra)
+
+
+def _hospital(hospital_id, field, delta):
+    # QuerySet.update() skips auto_now; the conditional GET validators read updated_at.
+    _bump(HospitalStats, {'hospital_id': hospital_id}, field, delta, updated_at=timezone.now())
+
+
+def _specialization(hospital_id, specialization, delta):
+    _bump(SpecializationCount, {'hospital_id': hospital_id, 'specialization': specialization}, 'doctors', delta)
+
+
+def _appointments(doctor_id, hospital_id, date, delta):
+    _bump(DoctorDay, {'doctor_id': doctor_id, 'date': date}, 'appointments', delta)
+    _bump(HospitalDay, {'hospital_id': hospital_id, 'date': date}, 'appointments', delta)
+    _hospital(hospital_id, 'appointments', delta)
+
+
+def _doctor_hospital(doctor_id):
+    return Doctor.objects.filter(pk=doctor_id).values_list('hospital_id', flat=True).first()
+
+
+def _appointment_key(appointment):
+    doctor = appointment._state.fields_cache.get('doctor')
+    hospital_id = doctor.hospital_id if doctor is not None else _doctor_hospital(appointment.doctor_id)
+    return appointment.doctor_id, hospital_id, appointment.appointment_date
+
+
+# Signal hooks. ``*_saving`` runs before an update and remembers the row as
+# stored, so ``*_saved`` can move counts when the hospital, specialization,
+# doctor or date changed.
+
+def hospital_saved(hospital, created):
+    if created:
+        HospitalStats.objects.get_or_create(hospital=hospital)
+
+
+def profile_saving(instance):
+    if not instance._state.adding and instance.pk is not None:
+        instance._stats_before = type(instance).objects.filter(pk=instance.pk).values_list(
+            'hospital_id', flat=True,
+        ).first()
+
+
+def doctor_saving(doctor):
+    if not doctor._state.adding and doctor.pk is not None:
+        before = Doctor.objects.filter(pk=doctor.pk).values_list('hospital_id', 'specialization').first()
+        if before is not None:
+            doctor._stats_before, doctor._specialization_before = before
+
+
+def doctor_saved(doctor, created):
+    before = getattr(doctor, '_stats_before', None)
+    if created:
+        _hospital(doctor.hospital_id, 'doctors', 1)
+        _specialization(doctor.hospital_id, doctor.specialization, 1)
+        return
+    if before is None:
+        return
+    if (before, doctor._specialization_before) != (doctor.hospital_id, doctor.specialization):
+        _specialization(before, doctor._specialization_before, -1)
+        _specialization(doctor.hospital_id, doctor.specialization, 1)
+    if before != doctor.hospital_id:
+        _hospital(before, 'doctors', -1)
+        _hospital(doctor.hospital_id, 'doctors', 1)
+        # The doctor's appointments follow them to the new hospital.
+        for date, count in DoctorDay.objects.filter(doctor_id=doctor.pk).values_list('date', 'appointments'):
+            _bump(HospitalDay, {'hospital_id': before, 'date': date}, 'appointments', -count)
+            _bump(HospitalDay, {'hospital_id': doctor.hospital_id, 'date': date}, 'appointments', count)
+            _hospital(before, 'appointments', -count)
+            _hospital(doctor.hospital_id, 'appointments', count)
+
+
+def doctor_deleted(doctor):
+    _hospital(doctor.hospital_id, 'doctors', -1)
+    _specialization(doctor.hospital_id, doctor.specialization, -1)
+
+
+def patient_saved(patient, created):
+    before = getattr(patient, '_stats_before', None)
+    if created:
+        _hospital(patient.hospital_id, 'patients', 1)
+    elif before is not None and before != patient.hospital_id:
+        _hospital(before, 'patients', -1)
+        _hospital(patient.hospital_id, 'patients', 1)
+
+
+def patient_deleted(patient):
+    _hospital(patient.hospital_id, 'patients', -1)
+
+
+def appointment_saving(appointment):
+    if not appointment._state.adding and appointment.pk is not None:
+        appointment._stats_before = Appointment.objects.filter(pk=appointment.pk).values_list(
+            'doctor_id', 'doctor__hospital_id', 'appointment_date',
+        ).first()
+
+
+def appointment_saved(appointment, created):
+    before = getattr(appointment, '_stats_before', None)
+    if created:
+        _appointments(*_appointment_key(appointment), 1)
+        return
+    if before is None:
+        return
+    after = _appointment_key(appointment)
+    if before != after:
+        _appointments(*before, -1)
+        _appointments(*after, 1)
+
+
+def appointment_deleted(appointment):
+    _appointments(*_appointment_key(appointment), -1)
+
+
+def record_created(model, objs):
+    """Count a chunk of bulk-created doctors, patients or appointments."""
+    if model is Appointment:
+        hospitals = dict(Doctor.objects.filter(
+            pk__in={obj.doctor_id for obj in objs},
+        ).values_list('id', 'hospital_id'))
+        for (doctor_id, date), count in Counter((obj.doctor_id, obj.appointment_date) for obj in objs).items():
+            _appointments(doctor_id, hospitals[doctor_id], date, count)
+        return
+    if model is Doctor:
+        for (hospital_id, specialization), count in Counter(
+            (obj.hospital_id, obj.specialization) for obj in objs
+        ).items():
+            _specialization(hospital_id, specialization, count)
+    field = 'doctors' if model is Doctor else 'patients'
+    for hospital_id, count in Counter(obj.hospital_id for obj in objs).items():
+        _hospital(hospital_id, field, count)
+
+
+def rebuild(using='default'):
+    """Recompute every counter and rollup from the base tables."""
+    appointments = Appointment.objects.using(using).order_by()
+    with transaction.atomic(using=using):
+        for model in (HospitalStats, DoctorDay, HospitalDay, SpecializationCount):
+            model.objects.using(using).all().delete()
+
+        totals = {}
+        for field, model in (('doctors', Doctor), ('patients', Patient)):
+            for hospital_id, count in model.objects.using(using).order_by().values_list('hospital_id').annotate(n=Count('id')):
+                totals.setdefault(hospital_id, {})[field] = count
+        for hospital_id, count in appointments.values_list('doctor__hospital_id').annotate(n=Count('id')):
+            totals.setdefault(hospital_id, {})['appointments'] = count
+        HospitalStats.objects.using(using).bulk_create(
+            [HospitalStats(hospital_id=hospital_id, **counts) for hospital_id, counts in totals.items()],
+            batch_size=1000,
+        )
+        SpecializationCount.objects.using(using).bulk_create([
+            SpecializationCount(hospital_id=hospital_id, specialization=specialization, doctors=count)
+            for hospital_id, specialization, count in Doctor.objects.using(using).order_by().values_list(
+                'hospital_id', 'specialization',
+            ).annotate(n=Count('id'))
+        ], batch_size=1000)
+        DoctorDay.objects.using(using).bulk_create((
+            DoctorDay(doctor_id=doctor_id, date=date, appointments=count)
+            for doctor_id, date, count in appointments.values_list('doctor_id', 'appointment_date').annotate(
+                n=Count('id'),
+            ).iterator()
+        ), batch_size=1000)
+        HospitalDay.objects.using(using).bulk_create((
+            HospitalDay(hospital_id=hospital_id, date=date, appointments=count)
+            for hospital_id, date, count in appointments.values_list('doctor__hospital_id', 'appointment_date').annotate(
+                n=Count('id'),
+            ).iterator()
+        ), batch_size=1000)
+
+
+def hospital_summary(hospital, today=None):
+    """Counts, today's and this week's appointments and occupancy for ``hospital``, in two queries."""
+    today = today or timezone.localdate()
+    monday = today - datetime.timedelta(days=today.weekday())
+    totals = HospitalStats.objects.filter(hospital_id=hospital.pk).values(
+        'doctors', 'patients', 'appointments',
+    ).first() or {'doctors': 0, 'patients': 0, 'appointments': 0}
+    week = dict(HospitalDay.objects.filter(
+        hospital_id=hospital.pk, date__range=(monday, monday + datetime.timedelta(days=6)),
+    ).values_list('date', 'appointments'))
+    return {
+        **totals,
+        'appointments_today': week.get(today, 0),
+        'appointments_this_week': sum(week.values()),
+        # Registered patients against the hospital's stated capacity.
+        'utilization': totals['patients'] / hospital.capacity if hospital.capacity else None,
+    }
+
+
+ahospital_summary = sync_to_async(hospital_summary)
@@ -0,0 +1,16 @@
+"""Helpers shared by the streamed CSV and JSON-lines exports in ``bulk`` and ``records``."""
+
+
+class Echo:
+    """File-like object whose write() hands the row back to the caller.
+
+    ``csv.writer(Echo()).writerow(row)`` returns the formatted line, so an
+    export can yield it rather than write to a buffer.
+    """
+    def write(self, value):
+        return value
+
+
+def serialize(value):
+    """``value`` as CSV or JSON can hold it: dates and times as ISO 8601."""
+    return value.isoformat() if hasattr(value, 'isoformat') else value
@@ -0,0 +1,209 @@
+"""A small database-backed task queue.
+
+Functions decorated with ``@task`` can be queued with ``enqueue`` (or
+``aenqueue`` from coroutine views), now or at a later ``run_at``. Queuing
+is an INSERT inside the caller's transaction, so a rolled-back request
+queues nothing. Each ``python manage.py run_tasks`` process is one worker.
+Workers claim one due task at a time with a conditional UPDATE, so on
+SQLite or PostgreSQL a task goes to exactly one worker, which holds it for
+``TASK_LEASE_SECONDS`` and renews the lease every third of that while the
+task runs. When a worker dies mid-task, the lease expires and another
+worker picks the task up, so tasks should be safe to repeat. A worker that
+finds its lease gone, before or after running a task, leaves the task to
+whoever holds it now.
+A task that raises is retried with exponential backoff until it has
+made ``max_attempts`` attempts, then marked failed.
+
+Callers only use ``task``, ``enqueue`` and ``Worker``. A Redis-backed queue
+could replace the ``Task`` table behind them without touching callers.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+
+logger = logging.getLogger('hospital.tasks')
+
+_registry = {}
+
+
+class TaskType:
+    def __init__(self, func, name, max_attempts, retry_delay):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def backoff(self, attempts):
+        return datetime.timedelta(seconds=self.retry_delay * 2 ** (attempts - 1))
+
+
+def task(name=None, max_attempts=5, retry_delay=30):
+    """Register a function as a task; its arguments must be JSON-serializable."""
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        _registry[task_name] = TaskType(func, task_name, max_attempts, retry_delay)
+        func.task_name = task_name
+        return func
+    return decorator
+
+
+def _task_type(func_or_name):
+    name = getattr(func_or_name, 'task_name', func_or_name)
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f'{name!r} is not a registered task.') from None
+
+
+def enqueue(func_or_name, *args, run_at=None, **kwargs):
+    """Queue a call to a registered task, due at ``run_at`` (default: now)."""
+    task_type = _task_type(func_or_name)
+    return Task.objects.create(
+        name=task_type.name, args=list(args), kwargs=kwargs,
+        run_at=run_at or timezone.now(), max_attempts=task_type.max_attempts,
+    )
+
+
+aenqueue = sync_to_async(enqueue)
+
+
+def lease_seconds():
+    return getattr(settings, 'TASK_LEASE_SECONDS', 300)
+
+
+def extend_lease(task):
+    """Renew ``task``'s lease if this worker still holds it; returns whether it does."""
+    return bool(Task.objects.filter(pk=task.pk, locked_by=task.locked_by, status=Task.RUNNING).update(
+        locked_until=timezone.now() + datetime.timedelta(seconds=lease_seconds()),
+    ))
+
+
+class Heartbeat:
+    """Renews a running task's lease from a background thread until the task returns."""
+
+    def __init__(self, task):
+        self.task = task
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'task-{task.pk}-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(lease_seconds() / 3):
+                try:
+                    if not extend_lease(self.task):
+                        logger.warning('Task %s (%s) lost its lease while running.', self.task.pk, self.task.name)
+                        return
+                except Exception:
+                    logger.exception('Renewing the lease of task %s failed', self.task.pk)
+        finally:
+            connections.close_all()
+
+
+class Worker:
+    # Due tasks looked at per claim; the first one no other worker took wins.
+    CANDIDATES = 10
+
+    def __init__(self, name=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+
+    def claim(self):
+        """Lock the next due task for this worker and return it, or None when none is due."""
+        token = f'{self.name}:{uuid.uuid4().hex[:8]}'
+        while True:
+            now = timezone.now()
+            due = Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+            ids = list(Task.objects.filter(due).order_by('run_at', 'id').values_list('id', flat=True)[:self.CANDIDATES])
+            if not ids:
+                return None
+            for pk in ids:
+                # Re-checking ``due`` in the UPDATE is what keeps two workers
+                # from taking the same task: only one UPDATE matches the row.
+                if Task.objects.filter(due, pk=pk).update(
+                    status=Task.RUNNING, locked_by=token, attempts=F('attempts') + 1,
+                    locked_until=now + datetime.timedelta(seconds=lease_seconds()),
+                ):
+                    return Task.objects.get(pk=pk)
+
+    def execute(self, task):
+        mine = Task.objects.filter(pk=task.pk, locked_by=task.locked_by, status=Task.RUNNING)
+        if task.attempts > task.max_attempts:
+            # Reclaimed after the worker running its last attempt died.
+            logger.error('Task %s (%s) abandoned after %s attempts.', task.pk, task.name, task.max_attempts)
+            mine.update(
+                status=Task.FAILED, last_error='Worker lease expired.', locked_until=None,
+                finished_at=timezone.now(),
+            )
+            return False
+        if not extend_lease(task):
+            logger.warning('Task %s (%s) was reclaimed before it started; leaving it.', task.pk, task.name)
+            return False
+        try:
+            task_type = _task_type(task.name)
+            with Heartbeat(task):
+                result = task_type.func(*task.args, **task.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            task_type = _registry.get(task.name)
+            if task_type is None or task.attempts >= task.max_attempts:
+                logger.error('Task %s (%s) failed for good:\n%s', task.pk, task.name, error)
+                mine.update(status=Task.FAILED, last_error=error, locked_until=None, finished_at=timezone.now())
+                return False
+            logger.warning('Task %s (%s) failed on attempt %s:\n%s', task.pk, task.name, task.attempts, error)
+            mine.update(
+                status=Task.PENDING, last_error=error, locked_until=None,
+                run_at=timezone.now() + task_type.backoff(task.attempts),
+            )
+            return False
+        if not mine.update(status=Task.DONE, result=result, locked_until=None, finished_at=timezone.now()):
+            logger.error(
+                'Task %s (%s) finished after another worker took it over; its result was not recorded.',
+                task.pk, task.name,
+            )
+            return False
+        return True
+
+    def run_pending(self):
+        """Run due tasks until none are left; returns how many were run."""
+        count = 0
+        while True:
+            task = self.claim()
+            if task is None:
+                return count
+            self.execute(task)
+            count += 1
+
+    def run_forever(self, sleep=1.0, should_stop=lambda: False):
+        """Poll for due tasks, one at a time, until ``should_stop()``."""
+        while not should_stop():
+            close_old_connections()
+            task = self.claim()
+            if task is None:
+                time.sleep(sleep)
+            else:
+                self.execute(task)
+
+
+def run_pending():
+    return Worker().run_pending()
@@ -1,3 +1,1744 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import warnings
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, get_hasher
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Max
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    accounts, benchmark, cache, directory, events, graphql_views, instrumentation, notifications, pagination, passwords, records,
+    routers, search, seed, selectors, stats, tasks, throttling,
+)
+from .forms import PatientRegistrationForm
+from .models import (
+    Hospital, Doctor, Patient, Prescription, Appointment, Task, DoctorDay, HospitalDay, HospitalStats, DashboardEvent,
+    SpecializationCount,
+)
+from .scheduling import availability
+
+
+def make_hospital(name='General', **kwargs):
+    defaults = {
+        'address': '1 Main St',
+        'phone_number': '5550100',
+        'email': 'info@general.test',
+        'capacity': 100,
+    }
+    defaults.update(kwargs)
+    return Hospital.objects.create(name=name, **defaults)
+
+
+def make_doctor(hospital, username='doc', specialization='Cardiology'):
+    user = User.objects.create_user(username=username)
+    return Doctor.objects.create(
+        user=user, name=f'Dr {username}', email=f'{username}@test',
+        phone_number='555', specialization=specialization, hospital=hospital,
+    )
+
+
+def make_patient(hospital, username='pat'):
+    user = User.objects.create_user(username=username)
+    return Patient.objects.create(
+        user=user, name=f'Patient {username}', email=f'{username}@test',
+        phone_number='555', hospital=hospital,
+    )
+
+
+def add_history(doctor, count):
+    """Give ``doctor`` ``count`` appointments and prescriptions, each with a new patient."""
+    for i in range(count):
+        patient = make_patient(doctor.hospital, username=f'{doctor.user.username}-p{i}')
+        Appointment.objects.create(
+            patient=patient, doctor=doctor,
+            appointment_date=datetime.date(2030, 1, 1) + datetime.timedelta(days=i),
+            appointment_time=datetime.time(9, 0),
+        )
+        Prescription.objects.create(doctor=doctor, patient=patient, medication=f'med {i}')
+
+
+def reset_process_state():
+    # Caches and in-memory indexes outlive the per-test transaction rollback.
+    availability.reset()
+    cache.hospitals.shared.clear()
+    cache.hospitals.invalidate()
+    graphql_views.reset()
+    instrumentation.registry.reset()
+    caches['template_fragments'].clear()
+    throttling.reset()
+
+
+class HospitalTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        reset_process_state()
+
+
+class DashboardQueryBudgetTests(HospitalTestCase):
+    # The user with their profile (the session comes from the cache), the
+    # prescription form's patients and one query per list page. The booking
+    # form's doctor picker loads its choices from the directory instead.
+    DOCTOR_DASHBOARD_BUDGET = 6
+    PATIENT_DASHBOARD_BUDGET = 4
+
+    def dashboard_queries(self, username, url_name):
+        # Measure the cold render; FragmentCacheTests covers the warm one.
+        caches['template_fragments'].clear()
+        self.client.force_login(User.objects.get(username=username))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_doctor_dashboard_is_constant_in_history_length(self):
+        hospital = make_hospital()
+        small = make_doctor(hospital, username='small')
+        large = make_doctor(hospital, username='large')
+        add_history(small, 1)
+        add_history(large, 25)
+
+        small_count = self.dashboard_queries('small', 'doctor_dashboard')
+        large_count = self.dashboard_queries('large', 'doctor_dashboard')
+        self.assertEqual(small_count, large_count)
+        self.assertLessEqual(large_count, self.DOCTOR_DASHBOARD_BUDGET)
+
+    def test_patient_dashboard_is_constant_in_history_length(self):
+        hospital = make_hospital()
+        patient = make_patient(hospital)
+        for i in range(25):
+            doctor = make_doctor(hospital, username=f'd{i}')
+            Appointment.objects.create(
+                patient=patient, doctor=doctor,
+                appointment_date=datetime.date(2030, 1, 1),
+                appointment_time=datetime.time(9, i),
+            )
+            Prescription.objects.create(doctor=doctor, patient=patient, medication='m')
+
+        # The availability index loads once per process, not per request.
+        availability.next_free_slots(1)
+        self.assertLessEqual(
+            self.dashboard_queries('pat', 'patient_dashboard'),
+            self.PATIENT_DASHBOARD_BUDGET,
+        )
+
+
+@override_settings(DASHBOARD_PAGE_SIZE=4)
+class DashboardFeedTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_doctor(make_hospital())
+        self.client.force_login(self.doctor.user)
+
+    def collect(self, feed, **params):
+        """Follow the feed's cursors to the end, returning the id order seen."""
+        seen, cursor = [], None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            data = self.client.get(reverse('dashboard_feed', args=[feed]), query).json()
+            seen.extend(int(i) for i in re.findall(r'data-id="(\d+)"', data['html']))
+            cursor = data['next_cursor']
+            if not cursor:
+                return seen
+
+    def test_upcoming_and_past_windows_cover_every_appointment_once(self):
+        patient = make_patient(self.doctor.hospital)
+        today = timezone.localdate()
+        for offset in range(-5, 6):
+            for hour in (9, 10):
+                Appointment.objects.create(
+                    patient=patient, doctor=self.doctor,
+                    appointment_date=today + datetime.timedelta(days=offset),
+                    appointment_time=datetime.time(hour, 0),
+                )
+        ordered = Appointment.objects.order_by('appointment_date', 'appointment_time', 'id')
+        upcoming = list(ordered.filter(appointment_date__gte=today).values_list('id', flat=True))
+        past = list(ordered.filter(appointment_date__lt=today).values_list('id', flat=True))
+
+        self.assertEqual(self.collect('appointments', window='upcoming'), upcoming)
+        self.assertEqual(self.collect('appointments', window='past'), past[::-1])
+
+    def test_prescriptions_are_paged_newest_first(self):
+        patient = make_patient(self.doctor.hospital)
+        for i in range(10):
+            Prescription.objects.create(doctor=self.doctor, patient=patient, medication=f'm{i}')
+        expected = list(Prescription.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.collect('prescriptions'), expected)
+
+    def test_malformed_cursor_is_rejected(self):
+        response = self.client.get(reverse('dashboard_feed', args=['prescriptions']), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AppointmentSchedulingTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital, specialization='Cardiology')
+        self.patient = make_patient(self.hospital)
+        self.tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        self.client.force_login(self.patient.user)
+
+    def book(self, time, doctor=None):
+        return self.client.post(reverse('patient_dashboard'), {
+            'doctor': (doctor or self.doctor).pk,
+            'appointment_date': self.tomorrow.isoformat(),
+            'appointment_time': time,
+        })
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book('10:00').status_code, 302)
+        response = self.book('10:15')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('already booked', response.content.decode())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_booking_outside_working_hours_is_rejected(self):
+        response = self.book('17:45')
+        self.assertContains(response, 'sees patients between')
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_conflict_check_sees_bookings_the_index_missed(self):
+        availability.next_free_slots(1)
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=self.tomorrow, appointment_time=datetime.time(11, 0),
+        )])
+        self.assertFalse(availability.conflicts(self.doctor, self.tomorrow, datetime.time(11, 0)))
+        self.assertTrue(availability.conflicts(self.doctor, self.tomorrow, datetime.time(11, 0), verify=True))
+
+    def test_slot_taken_after_the_form_checked_it_is_a_form_error(self):
+        other = make_patient(self.hospital, username='other')
+
+        def taken(*args, **kwargs):
+            # Another request books the slot between the checks and the insert.
+            Appointment.objects.create(
+                patient=other, doctor=self.doctor, appointment_date=self.tomorrow, appointment_time=datetime.time(10, 0),
+            )
+
+        with mock.patch.object(Appointment, 'validate_constraints', taken):
+            response = self.book('10:00')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('already booked', response.content.decode())
+        self.assertEqual(list(Appointment.objects.values_list('patient', flat=True)), [other.pk])
+
+    def test_conflict_check_sees_deletes_the_index_missed(self):
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=self.tomorrow, appointment_time=datetime.time(9, 0),
+        )
+        after = timezone.make_aware(datetime.datetime.combine(self.tomorrow, datetime.time(0, 0)))
+        self.assertEqual(availability.next_free_slots(1, after=after)[0].time, datetime.time(9, 30))
+        # Cancelled by another process: no signal reaches this one.
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM hospital_appointment WHERE id = %s', [appointment.pk])
+        self.assertTrue(availability.conflicts(self.doctor, self.tomorrow, datetime.time(9, 0)))
+        self.assertFalse(availability.conflicts(self.doctor, self.tomorrow, datetime.time(9, 0), verify=True))
+        self.assertEqual(self.book('09:00').status_code, 302)
+
+    def test_index_is_rebuilt_after_a_while(self):
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=self.tomorrow, appointment_time=datetime.time(9, 0),
+        )
+        after = timezone.make_aware(datetime.datetime.combine(self.tomorrow, datetime.time(0, 0)))
+        availability.next_free_slots(1, after=after)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM hospital_appointment')
+        self.assertEqual(availability.next_free_slots(1, after=after)[0].time, datetime.time(9, 30))
+        with override_settings(APPOINTMENT_INDEX_SECONDS=0):
+            self.assertEqual(availability.next_free_slots(1, after=after)[0].time, datetime.time(9, 0))
+
+    def test_index_follows_saves_and_deletes(self):
+        after = timezone.make_aware(datetime.datetime.combine(self.tomorrow, datetime.time(0, 0)))
+        first = availability.next_free_slots(1, doctor_id=self.doctor.pk, after=after)[0]
+        self.assertEqual((first.date, first.time), (self.tomorrow, datetime.time(9, 0)))
+
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=self.tomorrow, appointment_time=datetime.time(9, 0),
+        )
+        first = availability.next_free_slots(1, doctor_id=self.doctor.pk, after=after)[0]
+        self.assertEqual(first.time, datetime.time(9, 30))
+
+        appointment.delete()
+        first = availability.next_free_slots(1, doctor_id=self.doctor.pk, after=after)[0]
+        self.assertEqual(first.time, datetime.time(9, 0))
+
+    def test_free_slots_filter_by_specialization_and_hospital(self):
+        make_doctor(self.hospital, username='derm', specialization='Dermatology')
+        make_doctor(make_hospital('Elsewhere'), username='far', specialization='Cardiology')
+
+        response = self.client.get(reverse('free_slots'), {
+            'specialization': 'cardiology', 'hospital': self.hospital.pk, 'count': 4,
+        })
+        slots = response.json()['slots']
+        self.assertEqual(len(slots), 4)
+        self.assertEqual({slot['doctor'] for slot in slots}, {self.doctor.pk})
+        starts = [(slot['date'], slot['time']) for slot in slots]
+        self.assertEqual(starts, sorted(starts))
+
+    def test_free_slots_count_is_clamped(self):
+        for count, expected in (('-1', 1), ('0', 1), ('500', 50)):
+            response = self.client.get(reverse('free_slots'), {'count': count})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['slots']), expected)
+        self.assertEqual(self.client.get(reverse('free_slots'), {'count': 'x'}).status_code, 400)
+
+
+class HospitalCacheTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital('St Mary')
+
+    def test_anonymous_home_is_served_without_queries_once_warm(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'St Mary')
+
+    def test_hospital_changes_invalidate_listing_and_detail(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('hospital_detail', args=[self.hospital.pk]))
+
+        self.hospital.name = 'St Mary Royal'
+        self.hospital.save()
+        self.assertContains(self.client.get(reverse('home')), 'St Mary Royal')
+        self.assertContains(self.client.get(reverse('hospital_detail', args=[self.hospital.pk])), 'St Mary Royal')
+
+        url = reverse('hospital_detail', args=[self.hospital.pk])
+        self.hospital.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_registration_form_validates_hospital_from_catalogue(self):
+        data = {
+            'username': 'new', 'password': 'pw', 'name': 'New Patient',
+            'email': 'new@example.com', 'phone_number': '555',
+        }
+        warm = PatientRegistrationForm(dict(data, hospital=self.hospital.pk))
+        self.assertTrue(warm.is_valid(), warm.errors)
+        with self.assertNumQueries(0):
+            form = PatientRegistrationForm(dict(data, hospital=self.hospital.pk))
+            self.assertTrue(form.is_valid())
+            self.assertEqual(form.cleaned_data['hospital'], self.hospital)
+            self.assertIn('St Mary', form.as_p())
+        self.assertFalse(PatientRegistrationForm(dict(data, hospital=9999)).is_valid())
+
+    def test_version_token_is_remembered_briefly(self):
+        namespace = cache.hospitals
+        self.assertEqual(namespace.get_or_set('k', lambda: 'old'), 'old')
+        # Another worker invalidates the namespace.
+        namespace.shared.set(namespace._version_key, 'elsewhere', None)
+        self.assertEqual(namespace.get_or_set('k', lambda: 'new'), 'old')
+        with override_settings(HOSPITAL_CACHE_VERSION_SECONDS=0):
+            namespace._version = None
+            self.assertEqual(namespace.get_or_set('k', lambda: 'new'), 'new')
+
+
+class GraphQLTests(HospitalTestCase):
+    NESTED = '{ allHospitals { name doctors { name appointments { patient { name } } } } }'
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(username='staff', is_staff=True)
+
+    def query(self, query, variables=None):
+        response = self.client.post('/graphql/', {'query': query, 'variables': variables or {}},
+                                    content_type='application/json')
+        return response.json()
+
+    def nested_query_count(self):
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.query(self.NESTED)
+        self.assertNotIn('errors', result)
+        return len(ctx.captured_queries), result
+
+    def test_nested_query_uses_a_fixed_number_of_queries(self):
+        for name in ('A', 'B'):
+            add_history(make_doctor(make_hospital(name), username=f'doc{name}'), 2)
+        small, _ = self.nested_query_count()
+
+        for name in ('C', 'D', 'E'):
+            add_history(make_doctor(make_hospital(name), username=f'doc{name}'), 6)
+        large, result = self.nested_query_count()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(result['data']['allHospitals']), 5)
+        doctor = result['data']['allHospitals'][2]['doctors'][0]
+        self.assertEqual(len(doctor['appointments']), 6)
+
+    def test_records_are_scoped_to_the_viewer(self):
+        doctor = make_doctor(make_hospital())
+        add_history(doctor, 2)
+        anonymous = self.query('{ appointments { edges { node { id } } } }')
+        self.assertEqual(anonymous['data']['appointments']['edges'], [])
+
+        patient = Patient.objects.filter(appointments__isnull=False).first()
+        self.client.force_login(patient.user)
+        own = self.query('{ appointments { edges { node { patient { name } } } } }')
+        self.assertEqual(
+            [edge['node']['patient']['name'] for edge in own['data']['appointments']['edges']],
+            [patient.name],
+        )
+
+    @override_settings(DASHBOARD_PAGE_SIZE=2)
+    def test_connections_page_with_cursors(self):
+        for i in range(5):
+            make_hospital(f'H{i}')
+        names, after = [], None
+        while True:
+            result = self.query(
+                'query($after: String) { hospitals(after: $after) { '
+                'edges { node { name } } pageInfo { hasNextPage endCursor } } }',
+                {'after': after},
+            )['data']['hospitals']
+            names.extend(edge['node']['name'] for edge in result['edges'])
+            if not result['pageInfo']['hasNextPage']:
+                break
+            after = result['pageInfo']['endCursor']
+        self.assertEqual(names, [f'H{i}' for i in range(5)])
+
+    @override_settings(GRAPHQL_LIST_SIZE=4)
+    def test_nested_lists_are_capped_per_parent(self):
+        for name in ('A', 'B'):
+            add_history(make_doctor(make_hospital(name), username=f'doc{name}'), 6)
+        _, result = self.nested_query_count()
+        for hospital in result['data']['allHospitals']:
+            self.assertEqual(len(hospital['doctors'][0]['appointments']), 4)
+
+    @override_settings(GRAPHQL_MAX_COMPLEXITY=50)
+    def test_expensive_queries_are_rejected(self):
+        result = self.query(self.NESTED)
+        self.assertIn('complexity', result['errors'][0]['message'])
+        result = self.query('{ hospitals(first: 2) { edges { node { name } } } }')
+        self.assertNotIn('errors', result)
+
+    @override_settings(GRAPHQL_MAX_COMPLEXITY=50)
+    def test_connections_are_costed_at_their_page_size(self):
+        # Without first, a page of DASHBOARD_PAGE_SIZE (20) nodes.
+        result = self.query('{ hospitals { edges { node { name } } } }')
+        self.assertIn('complexity', result['errors'][0]['message'])
+        # A variable first may be as large as MAX_PAGE_SIZE.
+        result = self.query(
+            'query($first: Int) { hospitals(first: $first) { edges { node { name } } } }', {'first': 2},
+        )
+        self.assertIn('complexity', result['errors'][0]['message'])
+
+
+class GraphQLCachingTests(HospitalTestCase):
+    QUERY = '{ allHospitals { name } }'
+
+    def post(self, body):
+        return self.client.post('/graphql/', body, content_type='application/json')
+
+    def test_repeated_queries_reuse_the_parsed_document(self):
+        make_hospital()
+        self.post({'query': self.QUERY})
+        self.post({'query': self.QUERY})
+        self.assertEqual(graphql_views.stats['document_misses'], 1)
+        self.assertEqual(graphql_views.stats['document_hits'], 1)
+
+    def test_persisted_query_round_trip(self):
+        make_hospital('Persisted')
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': graphql_views.sha256(self.QUERY)}}
+
+        miss = self.post({'extensions': extensions}).json()
+        self.assertEqual(miss['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        self.post({'query': self.QUERY, 'extensions': extensions})
+        hit = self.post({'extensions': extensions}).json()
+        self.assertEqual(hit['data']['allHospitals'], [{'name': 'Persisted'}])
+
+        wrong = {'persistedQuery': {'version': 1, 'sha256Hash': '0' * 64}}
+        self.assertEqual(self.post({'query': self.QUERY, 'extensions': wrong}).status_code, 400)
+
+    @override_settings(GRAPHQL_RESULT_CACHE_TTL=30)
+    def test_results_are_cached_per_user_when_enabled(self):
+        make_hospital()
+        self.post({'query': self.QUERY})
+        with self.assertNumQueries(0):
+            result = self.post({'query': self.QUERY}).json()
+        self.assertEqual(len(result['data']['allHospitals']), 1)
+        self.assertEqual(graphql_views.stats['result_hits'], 1)
+
+        self.client.force_login(User.objects.create_user(username='someone'))
+        self.post({'query': self.QUERY})
+        self.assertEqual(graphql_views.stats['result_misses'], 2)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkImportExportTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True))
+
+    def patients_csv(self, count, extra=''):
+        lines = ['username,password,name,email,phone_number,hospital']
+        lines += [f'p{i},secret,Patient {i},p{i}@example.com,555,{self.hospital.pk}' for i in range(count)]
+        return '\n'.join(lines) + '\n' + extra
+
+    def import_csv(self, kind, body):
+        return self.client.post(
+            reverse('bulk_import', args=[kind]) + '?format=csv', body, content_type='text/csv',
+        )
+
+    def test_import_validates_and_deduplicates_usernames(self):
+        make_patient(self.hospital, username='p1')
+        body = self.patients_csv(3, extra=(
+            f'p0,secret,Again,again@example.com,555,{self.hospital.pk}\n'
+            'p9,secret,Nowhere,nowhere@example.com,555,9999\n'
+        ))
+        report = self.import_csv('patients', body).json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(
+            sorted((error['record'], list(error['errors'])) for error in report['errors']),
+            [(2, ['username']), (4, ['username']), (5, ['hospital'])],
+        )
+        self.assertTrue(User.objects.get(username='p0').check_password('secret'))
+        self.assertEqual(Patient.objects.get(user__username='p2').hospital, self.hospital)
+
+    def test_import_cost_does_not_grow_with_chunk_length(self):
+        def queries(body):
+            with CaptureQueriesContext(connection) as ctx:
+                self.import_csv('patients', body)
+            return len(ctx.captured_queries)
+
+        selectors.hospital_catalogue()
+        accounts.get_user(User.objects.get(username='admin').pk)
+        small = queries(self.patients_csv(2))
+        Patient.objects.all().delete()
+        User.objects.filter(username__startswith='p').delete()
+        self.assertEqual(queries(self.patients_csv(40)), small)
+
+    def test_appointments_import_resolves_usernames(self):
+        doctor = make_doctor(self.hospital, username='doc')
+        make_patient(self.hospital, username='pat')
+        body = (
+            'patient_username,doctor_username,appointment_date,appointment_time,message\n'
+            'pat,doc,2020-01-02,10:00,history\n'
+            'pat,ghost,2020-01-03,10:00,\n'
+        )
+        report = self.import_csv('appointments', body).json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'][0]['record'], 2)
+        self.assertEqual(doctor.appointments.get().message, 'history')
+
+    def test_appointments_import_rejects_taken_slots(self):
+        make_doctor(self.hospital, username='doc')
+        make_patient(self.hospital, username='pat')
+        body = (
+            'patient_username,doctor_username,appointment_date,appointment_time,message\n'
+            'pat,doc,2020-01-02,10:00,\n'
+            'pat,doc,2020-01-02,10:00,again\n'
+        )
+        report = self.import_csv('appointments', body).json()
+        self.assertEqual((report['created'], [error['record'] for error in report['errors']]), (1, [2]))
+        # Importing the same file again books nothing twice.
+        report = self.import_csv('appointments', body).json()
+        self.assertEqual((report['created'], [error['record'] for error in report['errors']]), (0, [1, 2]))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_jsonl_lines_that_are_not_objects_are_rejected(self):
+        body = '[1, 2]\n"x"\n' + json.dumps({
+            'username': 'ok', 'password': 'pw', 'name': 'Okay', 'email': 'ok@example.com',
+            'phone_number': '555', 'hospital': self.hospital.pk,
+        }) + '\n'
+        response = self.client.post(
+            reverse('bulk_import', args=['patients']) + '?format=jsonl', body, content_type='application/jsonl',
+        )
+        report = response.json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['record'] for error in report['errors']], [1, 2])
+
+    def test_unparseable_records_are_reported_and_skipped(self):
+        record = {
+            'username': 'ok', 'password': 'pw', 'name': 'Okay', 'email': 'ok@example.com',
+            'phone_number': '555', 'hospital': self.hospital.pk,
+        }
+        body = '{"username": \n' + json.dumps(record) + '\n'
+        response = self.client.post(
+            reverse('bulk_import', args=['patients']) + '?format=jsonl', body, content_type='application/jsonl',
+        )
+        report = response.json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([(e['record'], e['errors']['__all__'][0]['code']) for e in report['errors']], [(1, 'malformed')])
+
+        # Longer than the csv module's field size limit.
+        body = self.patients_csv(2, extra=f'huge,secret,{"x" * 200_000},huge@example.com,555,{self.hospital.pk}\n')
+        report = self.import_csv('patients', body).json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([(e['record'], e['errors']['__all__'][0]['code']) for e in report['errors']], [(3, 'malformed')])
+
+    def test_username_taken_mid_import_rejects_the_chunk(self):
+        original = User.objects.bulk_create
+
+        def racing(objs, *args, **kwargs):
+            User.objects.create_user(username='p1')
+            return original(objs, *args, **kwargs)
+
+        with mock.patch.object(User.objects, 'bulk_create', racing):
+            report = self.import_csv('patients', self.patients_csv(3)).json()
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([error['record'] for error in report['errors']], [1, 2, 3])
+        self.assertFalse(Patient.objects.exists())
+
+    def test_export_streams_rows(self):
+        make_patient(self.hospital, username='exported')
+        response = self.client.get(reverse('bulk_export', args=['patients']), {'format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['exported'])
+
+    def test_non_staff_are_refused(self):
+        self.client.force_login(make_patient(self.hospital, username='nosy').user)
+        self.assertEqual(self.client.get(reverse('bulk_export', args=['patients'])).status_code, 403)
+
+
+class SearchTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.other = make_hospital(name='Elsewhere')
+        self.doctor = make_doctor(self.hospital)
+        self.ada = make_patient(self.hospital, username='ada')
+        Patient.objects.filter(pk=self.ada.pk).update(name='Ada Lovelace', medical_record='asthma')
+        make_patient(self.hospital, username='adam')
+        make_patient(self.other, username='adelaide')
+
+    def search(self, q, kind='patients'):
+        response = self.client.get(reverse('search'), {'q': q, 'kind': kind})
+        return response.status_code, response.json()
+
+    def test_prefix_search_is_ranked_and_scoped_to_the_doctors_hospital(self):
+        self.client.force_login(self.doctor.user)
+        status, body = self.search('ad')
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            sorted(result['email'] for result in body['results']), ['ada@test', 'adam@test'],
+        )
+        _, body = self.search('lovel asth')
+        self.assertEqual([result['name'] for result in body['results']], ['Ada Lovelace'])
+
+    def test_index_follows_bulk_writes_updates_and_deletes(self):
+        Doctor.objects.bulk_create([Doctor(
+            user=User.objects.create_user(username='bulk'), name='Grace Hopper', email='grace@test',
+            phone_number='555', specialization='Neurology', hospital=self.hospital,
+        )])
+        self.assertEqual([d.name for d in search.search(Doctor, 'neuro')], ['Grace Hopper'])
+        Doctor.objects.filter(name='Grace Hopper').update(specialization='Oncology')
+        self.assertEqual(search.search(Doctor, 'neuro'), [])
+        Doctor.objects.filter(name='Grace Hopper').delete()
+        self.assertEqual(search.search(Doctor, 'onco'), [])
+
+    def test_patients_may_only_search_their_hospitals_doctors(self):
+        make_doctor(self.other, username='faraway')
+        self.client.force_login(self.ada.user)
+        self.assertEqual(self.search('ad')[0], 403)
+        status, body = self.search('dr', kind='doctors')
+        self.assertEqual([result['name'] for result in body['results']], ['Dr doc'])
+
+    def test_filter_queryset_applies_the_querysets_filters_to_every_match(self):
+        for n in range(5):
+            make_patient(self.hospital, username=f'adair{n}')
+        queryset = Patient.objects.filter(hospital=self.other)
+        self.assertEqual([p.email for p in search.filter_queryset(queryset, 'ad')], ['adelaide@test'])
+
+    def test_ensure_indexes_restores_dropped_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite triggers only')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER hospital_patient_fts_au')
+        Patient.objects.filter(pk=self.ada.pk).update(name='Augusta King')
+        search.ensure_indexes()
+        self.assertEqual([p.pk for p in search.search(Patient, 'augusta')], [self.ada.pk])
+
+
+class BenchmarkTests(HospitalTestCase):
+    def test_every_route_is_benchmarked_or_skipped_with_a_reason(self):
+        self.assertEqual(benchmark.uncovered_routes(benchmark.scenarios(1)), [])
+
+    def test_scenarios_succeed_against_seeded_data(self):
+        seed.generate(hospitals=2, doctors=4, patients=10, appointments=40, prescriptions=20)
+        users = {
+            'doctor': seed.create_accounts(Doctor, 1)[0],
+            'patient': seed.create_accounts(Patient, 1)[0],
+            'staff': User.objects.create_user(username='staff', is_staff=True),
+        }
+        clients = {None: self.client_class()}
+        for role, user in users.items():
+            clients[role] = self.client_class()
+            clients[role].force_login(user)
+
+        scenarios = benchmark.scenarios(Hospital.objects.first().pk)
+        results = benchmark.run_client(clients, scenarios, repeat=1, warmup=0)
+        self.assertEqual(
+            {name: list(r['statuses']) for name, r in results.items() if set(r['statuses']) - {'200', '302'}}, {},
+        )
+        self.assertEqual(users['doctor'].username, f'doctor{users["doctor"].doctor.pk}')
+
+
+class InstrumentationTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_doctor(make_hospital())
+        add_history(self.doctor, 2)
+        self.client.force_login(self.doctor.user)
+
+    def test_server_timing_reports_queries_and_template_time(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('doctor_dashboard'))
+        timing = dict(
+            part.split(';', 1) for part in response['Server-Timing'].split(', ')
+        )
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing['sql'])
+        self.assertGreater(float(timing['template'].split('=')[1]), 0)
+
+    def test_repeated_statements_are_counted_as_duplicates(self):
+        metrics = instrumentation.RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for patient in Patient.objects.all():
+                Prescription.objects.filter(patient=patient).count()
+        self.assertEqual(metrics.queries, 3)
+        self.assertEqual(metrics.duplicate_queries, 1)
+
+    @override_settings(METRICS_DUPLICATE_QUERY_THRESHOLD=0)
+    def test_log_line_is_structured(self):
+        with self.assertLogs('hospital.requests', 'WARNING') as logs:
+            self.client.get(reverse('doctor_dashboard'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['route'], record['status']), ('dashboard/doctor/', 200))
+
+    def test_metrics_endpoint_exposes_per_route_histograms(self):
+        self.client.get(reverse('doctor_dashboard'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'hospital_request_duration_seconds_count{route="dashboard/doctor/",method="GET"} 1', body,
+        )
+        self.assertIn('hospital_request_queries_bucket{route="dashboard/doctor/",le="+Inf"} 1', body)
+        remote = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(remote.status_code, 403)
+
+
+class AsyncViewTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+        add_history(self.doctor, 3)
+
+    async def test_dashboards_render_through_the_async_stack(self):
+        await self.async_client.aforce_login(self.doctor.user)
+        response = await self.async_client.get(reverse('doctor_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['upcoming_appointments']), 3)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+
+        response = await self.async_client.get(reverse('patient_dashboard'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    async def test_booking_through_the_async_stack(self):
+        await self.async_client.aforce_login(self.patient.user)
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        response = await self.async_client.post(reverse('patient_dashboard'), {
+            'doctor': self.doctor.pk,
+            'appointment_date': tomorrow.isoformat(),
+            'appointment_time': '10:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Appointment.objects.filter(
+            patient=self.patient, appointment_date=tomorrow,
+        ).aexists())
+
+    async def test_anonymous_visitors_are_sent_to_login(self):
+        response = await self.async_client.get(reverse('doctor_dashboard'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/accounts/login/', response['Location'])
+
+
+class PasswordHashingTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.addCleanup(passwords.reset)
+
+    def register(self, username):
+        return self.client.post(reverse('register_patient'), {
+            'username': username, 'password': 'correct horse battery staple', 'name': 'New Patient',
+            'email': f'{username}@example.com', 'phone_number': '555', 'hospital': self.hospital.pk,
+        })
+
+    def test_registration_uses_the_preferred_hasher(self):
+        self.assertEqual(self.register('fresh').status_code, 302)
+        user = User.objects.get(username='fresh')
+        self.assertTrue(user.password.startswith(get_hasher().algorithm + '$'))
+        self.assertTrue(user.check_password('correct horse battery staple'))
+
+    def test_legacy_hashes_are_upgraded_on_login(self):
+        legacy = PBKDF2PasswordHasher().encode('old secret', 'legacysalt', iterations=1000)
+        User.objects.create(username='legacy', password=legacy)
+        self.assertTrue(self.client.login(username='legacy', password='old secret'))
+        upgraded = User.objects.get(username='legacy').password
+        self.assertTrue(upgraded.startswith(get_hasher().algorithm + '$'))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_QUEUE=0, PASSWORD_HASHING_WAIT=0.01)
+    def test_registration_is_refused_while_the_pool_is_saturated(self):
+        passwords.reset()
+        release = threading.Event()
+        passwords.pool().submit(release.wait)
+        try:
+            response = self.register('crowded')
+        finally:
+            release.set()
+        self.assertContains(response, 'try again in a moment', status_code=503)
+        self.assertFalse(User.objects.filter(username='crowded').exists())
+
+    @override_settings(PASSWORD_HASHING_WORKERS=2, PASSWORD_HASHING_QUEUE=1, PASSWORD_HASHING_WAIT=0.01)
+    def test_batches_hold_no_more_slots_than_workers(self):
+        passwords.reset()
+        hashes = passwords.make_passwords([f'pw{i}' for i in range(5)])
+        self.assertEqual(len(hashes), 5)
+        self.assertTrue(check_password('pw3', hashes[3]))
+
+    def test_import_reports_rows_when_hashing_is_busy(self):
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True))
+        body = 'username,password,name,email,phone_number,hospital\n' + ''.join(
+            f'b{i},secret,Patient {i},b{i}@example.com,555,{self.hospital.pk}\n' for i in range(2)
+        )
+        with mock.patch.object(passwords, 'make_passwords', side_effect=passwords.HashingBusy):
+            response = self.client.post(
+                reverse('bulk_import', args=['patients']) + '?format=csv', body, content_type='text/csv',
+            )
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([error['errors']['__all__'][0]['code'] for error in report['errors']], ['busy', 'busy'])
+
+
+@tasks.task(name='tests.always_fails', max_attempts=2, retry_delay=0)
+def always_fails():
+    raise RuntimeError('mail server unreachable')
+
+
+@tasks.task(name='tests.taken_over', max_attempts=1)
+def taken_over():
+    # Another worker reclaims the task while this one is still running it.
+    Task.objects.filter(name='tests.taken_over').update(locked_by='other')
+
+
+@tasks.task(name='tests.sleeps', max_attempts=1)
+def sleeps():
+    time.sleep(0.1)
+
+
+class TaskQueueTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+        self.client.force_login(self.patient.user)
+        self.day = timezone.localdate() + datetime.timedelta(days=3)
+
+    def book(self):
+        response = self.client.post(reverse('patient_dashboard'), {
+            'doctor': self.doctor.pk, 'appointment_date': self.day.isoformat(), 'appointment_time': '10:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        return Appointment.objects.get(patient=self.patient)
+
+    def test_booking_queues_confirmation_now_and_reminder_later(self):
+        appointment = self.book()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Appointment confirmed', mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].to, [self.patient.email])
+
+        reminder = Task.objects.get(status=Task.PENDING)
+        self.assertEqual(reminder.run_at, notifications.appointment_starts(appointment) - datetime.timedelta(hours=24))
+        Task.objects.filter(pk=reminder.pk).update(run_at=timezone.now())
+        tasks.run_pending()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('Reminder', mail.outbox[1].subject)
+
+    def test_reminder_is_dropped_when_the_appointment_moves(self):
+        appointment = self.book()
+        appointment.appointment_time = datetime.time(11, 0)
+        appointment.save()
+        Task.objects.update(run_at=timezone.now())
+        tasks.run_pending()
+        self.assertEqual([message.subject.split(':')[0] for message in mail.outbox], ['Appointment confirmed'])
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 2)
+
+    def test_failing_tasks_are_retried_then_marked_failed(self):
+        task = tasks.enqueue(always_fails)
+        with self.assertLogs('hospital.tasks', 'WARNING') as logs:
+            self.assertEqual(tasks.run_pending(), 2)
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'ERROR'])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertIn('mail server unreachable', task.last_error)
+
+    def test_a_task_goes_to_one_worker_until_its_lease_expires(self):
+        task = tasks.enqueue(notifications.send_appointment_confirmation, 0)
+        first, second = tasks.Worker(name='first'), tasks.Worker(name='second')
+        claimed = first.claim()
+        self.assertEqual(claimed.pk, task.pk)
+        self.assertIsNone(second.claim())
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        reclaimed = second.claim()
+        self.assertEqual(reclaimed.attempts, 2)
+        # The first worker's claim is stale: it leaves the task alone.
+        with self.assertLogs('hospital.tasks', 'WARNING'):
+            self.assertFalse(first.execute(claimed))
+        self.assertTrue(second.execute(reclaimed))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.result), (Task.DONE, {'sent': 0}))
+
+    def test_result_is_not_recorded_after_the_lease_is_lost(self):
+        task = tasks.enqueue(taken_over)
+        worker = tasks.Worker(name='slow')
+        with self.assertLogs('hospital.tasks', 'ERROR'):
+            self.assertFalse(worker.execute(worker.claim()))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.locked_by), (Task.RUNNING, 'other'))
+
+    @override_settings(TASK_LEASE_SECONDS=0.03)
+    def test_running_tasks_renew_their_lease(self):
+        task = tasks.enqueue(sleeps)
+        renewals = []
+
+        def extend(claimed):
+            renewals.append(threading.current_thread().name)
+            return True
+
+        with mock.patch.object(tasks, 'extend_lease', extend):
+            self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(renewals[0], threading.current_thread().name)
+        self.assertIn(f'task-{task.pk}-heartbeat', renewals[1:])
+
+    def test_bulk_import_can_run_in_the_background(self):
+        staff = User.objects.create_user(username='admin', is_staff=True)
+        self.client.force_login(staff)
+        body = (
+            'username,password,name,email,phone_number,hospital\n'
+            f'bg1,secret,Patient 1,bg1@example.com,555,{self.hospital.pk}\n'
+            f'bg2,secret,Patient 2,bg2@example.com,555,{self.hospital.pk}\n'
+        )
+        with tempfile.TemporaryDirectory() as spool, override_settings(TASK_SPOOL_DIR=spool):
+            response = self.client.post(
+                reverse('bulk_import', args=['patients']) + '?format=csv&background=1', body, content_type='text/csv',
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertFalse(User.objects.filter(username__startswith='bg').exists())
+            tasks.run_pending()
+        status = self.client.get(response.json()['status']).json()
+        self.assertEqual((status['status'], status['result']), (Task.DONE, {'created': 2, 'errors': []}))
+
+
+class HospitalStatsTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.north = make_hospital('North', capacity=4)
+        self.south = make_hospital('South')
+        self.doctor = make_doctor(self.north)
+        self.patients = [make_patient(self.north, username=f'p{i}') for i in range(3)]
+        self.today = timezone.localdate()
+        for i, patient in enumerate(self.patients):
+            Appointment.objects.create(
+                patient=patient, doctor=self.doctor, appointment_date=self.today,
+                appointment_time=datetime.time(9 + i, 0),
+            )
+
+    def snapshot(self):
+        return (
+            sorted(HospitalStats.objects.values_list('hospital_id', 'doctors', 'patients', 'appointments')),
+            sorted(DoctorDay.objects.filter(appointments__gt=0).values_list('doctor_id', 'date', 'appointments')),
+            sorted(HospitalDay.objects.filter(appointments__gt=0).values_list('hospital_id', 'date', 'appointments')),
+            sorted(SpecializationCount.objects.filter(doctors__gt=0).values_list(
+                'hospital_id', 'specialization', 'doctors',
+            )),
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_summary_reads_counters_in_two_queries(self):
+        with self.assertNumQueries(2):
+            summary = stats.hospital_summary(self.north, today=self.today)
+        self.assertEqual(summary, {
+            'doctors': 1, 'patients': 3, 'appointments': 3,
+            'appointments_today': 3, 'appointments_this_week': 3, 'utilization': 0.75,
+        })
+
+    def test_counters_follow_moves_and_deletes(self):
+        self.patients[0].hospital = self.south
+        self.patients[0].save()
+        appointment = Appointment.objects.first()
+        appointment.appointment_date = self.today + datetime.timedelta(days=8)
+        appointment.save()
+        self.doctor.hospital = self.south
+        self.doctor.save()
+        self.assertMatchesRebuild()
+        self.assertEqual(stats.hospital_summary(self.south)['appointments'], 3)
+
+        self.doctor.specialization = 'Neurology'
+        self.doctor.save()
+        self.assertMatchesRebuild()
+        self.assertEqual(
+            list(SpecializationCount.objects.filter(doctors__gt=0).values_list('hospital_id', 'specialization')),
+            [(self.south.pk, 'Neurology')],
+        )
+
+        self.patients[1].delete()
+        self.doctor.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(
+            HospitalStats.objects.get(hospital=self.south).appointments, 0,
+        )
+
+    def test_bulk_import_counts_each_chunk_at_once(self):
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True))
+        body = 'username,password,name,email,phone_number,hospital\n' + ''.join(
+            f'b{i},secret,Patient {i},b{i}@example.com,555,{self.south.pk}\n' for i in range(5)
+        )
+        self.client.post(reverse('bulk_import', args=['patients']) + '?format=csv', body, content_type='text/csv')
+        self.assertEqual(HospitalStats.objects.get(hospital=self.south).patients, 5)
+        self.assertMatchesRebuild()
+
+    def test_detail_page_and_admin_show_counters(self):
+        response = self.client.get(reverse('hospital_detail', args=[self.north.pk]))
+        self.assertContains(response, '75% of capacity')
+        self.assertContains(response, '3 today')
+
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True, is_superuser=True))
+        response = self.client.get(reverse('admin:hospital_hospital_changelist'))
+        self.assertContains(response, '75%')
+
+
+class FragmentCacheTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+        add_history(self.doctor, 3)
+
+    def dashboard(self, user, url_name):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(ctx.captured_queries)
+
+    def test_warm_dashboard_skips_the_list_and_choice_queries(self):
+        cold, cold_queries = self.dashboard(self.doctor.user, 'doctor_dashboard')
+        warm, warm_queries = self.dashboard(self.doctor.user, 'doctor_dashboard')
+        # The CSRF token and the events cursor differ on every render.
+        per_request = re.compile(r'name="csrfmiddlewaretoken" value="[^"]*"|since=\d+')
+        self.assertEqual(per_request.sub('', warm), per_request.sub('', cold))
+        self.assertEqual(warm_queries, cold_queries - 4)
+
+    def test_saves_refresh_the_cached_fragments(self):
+        self.dashboard(self.doctor.user, 'doctor_dashboard')
+        self.dashboard(self.patient.user, 'patient_dashboard')
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=datetime.date(2031, 5, 5), appointment_time=datetime.time(9, 0),
+        )
+        Prescription.objects.create(doctor=self.doctor, patient=self.patient, medication='Fresh pills')
+        make_patient(self.hospital, username='newcomer')
+
+        html, _ = self.dashboard(self.doctor.user, 'doctor_dashboard')
+        self.assertIn('Fresh pills', html)
+        self.assertIn('>Patient newcomer</option>', html)
+        html, _ = self.dashboard(self.patient.user, 'patient_dashboard')
+        self.assertIn('May 5, 2031', html)
+        self.assertIn('Fresh pills', html)
+
+
+class ConditionalGetTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+
+    def revalidate(self, path):
+        # The first visit may set the CSRF cookie, which is part of the ETag.
+        self.client.get(path)
+        first = self.client.get(path)
+        self.assertEqual(first.status_code, 200)
+        return first, self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_pages_answer_304_with_their_policy(self):
+        for name, args, cache_control in (
+            ('home', (), 'public, max-age=60'),
+            ('about', (), 'public, max-age=3600'),
+            ('contact', (), 'private, no-cache'),
+            ('hospital_detail', (self.hospital.pk,), 'public, max-age=30'),
+        ):
+            first, second = self.revalidate(reverse(name, args=args))
+            self.assertEqual(second.status_code, 304, name)
+            self.assertEqual(second.content, b'')
+            self.assertTrue(first.has_header('Last-Modified'), name)
+            for response in (first, second):
+                self.assertEqual(response['Cache-Control'], cache_control, name)
+                self.assertIn('Cookie', response['Vary'], name)
+
+    def test_if_modified_since(self):
+        first = self.client.get(reverse('home'))
+        response = self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate_the_validators(self):
+        home, _ = self.revalidate(reverse('home'))
+        detail, _ = self.revalidate(reverse('hospital_detail', args=[self.hospital.pk]))
+
+        self.hospital.capacity = 150
+        self.hospital.save()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=home['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '150')
+
+        detail, _ = self.revalidate(reverse('hospital_detail', args=[self.hospital.pk]))
+        Appointment.objects.create(
+            patient=make_patient(self.hospital), doctor=self.doctor,
+            appointment_date=timezone.localdate(), appointment_time=datetime.time(9, 0),
+        )
+        response = self.client.get(reverse('hospital_detail', args=[self.hospital.pk]), HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '1 today')
+
+        older = make_hospital('Other')
+        self.hospital.save()
+        home, _ = self.revalidate(reverse('home'))
+        older.delete()
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=home['ETag']).status_code, 200)
+
+    def test_signed_in_pages_are_private_and_validated_separately(self):
+        anonymous = self.client.get(reverse('home'))
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_revalidation_skips_rendering(self):
+        first = self.client.get(reverse('hospital_detail', args=[self.hospital.pk]))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse('hospital_detail', args=[self.hospital.pk]), HTTP_IF_NONE_MATCH=first['ETag'],
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(self.client.get(reverse('hospital_detail', args=[999])).status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_LAG=5)
+class ReplicaRouterTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = routers.ReplicaRouter()
+        self.state = routers.ReadState()
+        token = routers._state.set(self.state)
+        self.addCleanup(routers._state.reset, token)
+
+    def test_only_opted_in_reads_use_a_replica(self):
+        self.assertIsNone(self.router.db_for_read(Appointment))
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Appointment), 'replica1')
+            self.assertIsNone(self.router.db_for_read(User))
+        with routers.replica_reads(False):
+            self.assertIsNone(self.router.db_for_read(Appointment))
+
+    def test_writes_keep_the_request_on_the_primary(self):
+        self.router.db_for_write(Appointment)
+        with routers.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Appointment))
+
+    def test_pinned_clients_read_the_primary(self):
+        self.state.pinned = True
+        with routers.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Appointment))
+
+    def test_outside_requests_everything_uses_the_primary(self):
+        routers._state.set(None)
+        with routers.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Appointment))
+        self.assertEqual(self.router.db_for_write(Appointment), 'default')
+
+    def test_recent_stamps_are_read_from_the_primary(self):
+        [stamp] = cache.dashboards.get('doctor:1')
+        self.assertTrue(routers.recently_written(cache.Stamps.issued_at(stamp)))
+        self.assertFalse(routers.recently_written(cache.Stamps.issued_at(f'{time.time() - 60:.3f}-abc')))
+        self.assertTrue(routers.recently_written(cache.Stamps.issued_at('legacy')))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_LAG=5)
+class ReplicaPinTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+        self.client.force_login(self.patient.user)
+
+    def test_booking_pins_the_client_to_the_primary(self):
+        response = self.client.post(reverse('patient_dashboard'), {
+            'doctor': self.doctor.pk, 'appointment_date': '2031-02-03', 'appointment_time': '10:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        cookie = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertGreater(float(cookie.value), time.time())
+
+        # The fresh stamp and the pin both keep the lists on the primary.
+        response = self.client.get(reverse('patient_dashboard'))
+        self.assertContains(response, 'Feb. 3, 2031')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_reads_do_not_pin(self):
+        response = self.client.get(reverse('home'))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+class AdminTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        add_history(self.doctor, 3)
+        root = User.objects.create_user(username='root', is_staff=True, is_superuser=True)
+        self.client.force_login(root)
+        # Measure with the signed-in user cached, as after the first request.
+        accounts.get_user(root.pk)
+
+    def changelist(self, model, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f'admin:hospital_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        for model in ('doctor', 'patient', 'appointment', 'prescription', 'task', 'hospitalstats', 'doctorday', 'hospitalday'):
+            _, before = self.changelist(model)
+            add_history(make_doctor(self.hospital, username=f'{model}-doc'), 3)
+            _, after = self.changelist(model)
+            self.assertEqual(after, before, model)
+
+    def test_search_uses_the_full_text_index(self):
+        response, _ = self.changelist('patient', q='doc-p1')
+        self.assertContains(response, 'Patient doc-p1')
+        self.assertNotContains(response, 'Patient doc-p2')
+        response, _ = self.changelist('appointment', q='doc-p2')
+        self.assertEqual(list(response.context['cl'].result_list), list(Appointment.objects.filter(patient__name='Patient doc-p2')))
+        response, _ = self.changelist('appointment', q='patient')
+        self.assertEqual(len(response.context['cl'].result_list), Appointment.objects.count())
+
+    def test_large_tables_are_not_counted_exactly(self):
+        paginator = pagination.EstimatedCountPaginator(Appointment.objects.order_by('-pk'), 2)
+        paginator.threshold = 2
+        Appointment.objects.filter(pk=Appointment.objects.order_by('pk').first().pk).delete()
+        # The highest id stands in for the count, and pages past it are empty.
+        self.assertEqual(paginator.count, Appointment.objects.aggregate(n=Max('pk'))['n'])
+        self.assertEqual(len(paginator.page(paginator.num_pages + 1)), 0)
+
+        filtered = pagination.EstimatedCountPaginator(Appointment.objects.filter(doctor=self.doctor).order_by('-pk'), 2)
+        filtered.threshold = 1
+        self.assertEqual(filtered.count, 1)
+
+    def test_rollups_are_read_only(self):
+        response = self.client.get(reverse('admin:hospital_hospitalstats_change', args=[self.hospital.pk]))
+        self.assertNotContains(response, 'name="_save"')
+
+
+class DashboardEventTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.other = make_doctor(self.hospital, username='other')
+        self.patient = make_patient(self.hospital)
+
+    def book(self, days=1, doctor=None):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=doctor or self.doctor,
+            appointment_date=timezone.localdate() + datetime.timedelta(days=days),
+            appointment_time=datetime.time(10, 0),
+        )
+
+    def messages(self, text):
+        return [
+            dict(line.split(': ', 1) for line in block.splitlines())
+            for block in text.strip().split('\n\n')
+        ]
+
+    def test_changes_are_recorded_for_each_doctor_concerned(self):
+        appointment = self.book()
+        appointment.doctor = self.other
+        appointment.save()
+        appointment.delete()
+        Prescription.objects.create(doctor=self.doctor, patient=self.patient, medication='m')
+
+        self.assertEqual(
+            list(DashboardEvent.objects.order_by('id').values_list('doctor_id', 'kind', 'action')),
+            [
+                (self.doctor.pk, 'appointment', 'saved'),
+                (self.other.pk, 'appointment', 'saved'),
+                (self.doctor.pk, 'appointment', 'deleted'),
+                (self.other.pk, 'appointment', 'deleted'),
+                (self.doctor.pk, 'prescription', 'saved'),
+            ],
+        )
+
+    def test_render_sends_the_list_item_or_a_deletion(self):
+        upcoming = self.book(days=1)
+        past = self.book(days=-1)
+        moved = self.book(days=2)
+        moved.doctor = self.other
+        moved.save()
+
+        messages = self.messages(events.render(events.backlog(self.doctor.pk, last_event_id=0)))
+        data = [json.loads(m['data']) for m in messages]
+        self.assertEqual([m['event'] for m in messages], ['appointment'] * 4)
+        self.assertEqual([(d['id'], d['action']) for d in data], [
+            (upcoming.pk, 'saved'), (past.pk, 'saved'), (moved.pk, 'deleted'), (moved.pk, 'deleted'),
+        ])
+        self.assertEqual([d.get('list') for d in data], ['upcoming', 'past', None, None])
+        self.assertIn(f'data-id="{upcoming.pk}"', data[0]['html'])
+        self.assertIn(f'data-key="{upcoming.appointment_date.isoformat()}T10:00:00"', data[0]['html'])
+        self.assertIn(self.patient.name, data[0]['html'])
+
+    def test_backlog_resumes_from_the_last_event_or_page_load(self):
+        first = self.book(days=1)
+        seen = DashboardEvent.objects.latest('id').pk
+        second = self.book(days=2)
+        self.book(days=3, doctor=self.other)
+
+        self.assertEqual(events.backlog(self.doctor.pk), [])
+        self.assertEqual(
+            [e.object_id for e in events.backlog(self.doctor.pk, last_event_id=seen)], [second.pk],
+        )
+        earlier = timezone.now() - datetime.timedelta(minutes=1)
+        self.assertEqual(
+            [e.object_id for e in events.backlog(self.doctor.pk, since=earlier)], [first.pk, second.pk],
+        )
+
+        text, newest = events.opening(self.doctor.pk, last_event_id=seen)
+        self.assertEqual(newest, DashboardEvent.objects.latest('id').pk)
+        self.assertTrue(text.endswith(f'retry: {events.RETRY_MS}\nid: {newest}\n\n'))
+
+    def test_prune_drops_events_past_retention(self):
+        self.book()
+        DashboardEvent.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        self.book(days=2)
+        events.prune()
+        self.assertEqual(DashboardEvent.objects.count(), 1)
+
+    def test_stream_is_for_doctors_only(self):
+        self.client.force_login(self.patient.user)
+        self.assertEqual(self.client.get(reverse('dashboard_events')).status_code, 403)
+        self.client.force_login(self.doctor.user)
+        response = self.client.get(reverse('dashboard_events'), headers={'last-event-id': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_dashboard_subscribes_from_page_load(self):
+        self.client.force_login(self.doctor.user)
+        response = self.client.get(reverse('doctor_dashboard'))
+        self.assertContains(response, f"{reverse('dashboard_events')}?since=")
+        self.assertContains(response, '<ul id="upcoming-appointments">')
+
+
+class DashboardStreamTests(TransactionTestCase):
+    # Stream reads run on worker threads, which only see committed rows.
+    def setUp(self):
+        super().setUp()
+        reset_process_state()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+
+    def book(self):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            appointment_date=timezone.localdate() + datetime.timedelta(days=1),
+            appointment_time=datetime.time(10, 0),
+        )
+
+    def test_wsgi_requests_get_the_missed_events_and_reconnect(self):
+        appointment = self.book()
+        self.client.force_login(self.doctor.user)
+        response = self.client.get(reverse('dashboard_events'), headers={'last-event-id': '0'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn(f'"id": {appointment.pk}, "action": "saved"', body)
+        self.assertIn(f'retry: {events.RETRY_MS}', body)
+
+    async def test_asgi_stream_pushes_new_changes(self):
+        await self.async_client.aforce_login(self.doctor.user)
+        response = await self.async_client.get(reverse('dashboard_events'))
+        content = response.streaming_content
+        opening = await asyncio.wait_for(anext(content), 5)
+        self.assertNotIn(b'event:', opening)
+
+        appointment = await sync_to_async(self.book, thread_sensitive=False)()
+        pushed = await asyncio.wait_for(anext(content), 5)
+        self.assertIn(b'event: appointment', pushed)
+        self.assertIn(f'"id": {appointment.pk}'.encode(), pushed)
+        await content.aclose()
+
+    async def test_stream_unsubscribes_when_closed(self):
+        stream = events.stream(self.doctor.pk)
+        await anext(stream)
+        self.assertIn(self.doctor.pk, events.hub.subscribers)
+        await stream.aclose()
+        self.assertNotIn(self.doctor.pk, events.hub.subscribers)
+
+
+class AccountCacheTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+
+    def test_signed_in_requests_reach_the_view_without_queries(self):
+        self.client.force_login(self.patient.user)
+        self.client.get(reverse('profile'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile'))
+        self.assertContains(response, self.patient.name)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('dashboard'))
+        self.assertRedirects(response, reverse('patient_dashboard'), fetch_redirect_response=False)
+
+    def test_profile_and_hospital_edits_are_seen_at_once(self):
+        self.client.force_login(self.doctor.user)
+        self.client.get(reverse('profile'))
+        response = self.client.post(reverse('profile_edit'), {
+            'name': 'Dr Renamed', 'email': 'doc@example.com', 'phone_number': '555',
+            'specialization': 'Cardiology', 'hospital': self.hospital.pk, 'work_start': '09:00', 'work_end': '17:00', 'slot_minutes': 30,
+        })
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('profile')), 'Dr Renamed')
+
+        self.hospital.name = 'Renamed General'
+        self.hospital.save()
+        self.assertContains(self.client.get(reverse('profile')), 'Renamed General')
+
+    def test_password_change_signs_out_other_sessions(self):
+        self.client.force_login(self.doctor.user)
+        self.client.get(reverse('profile'))
+        user = User.objects.get(pk=self.doctor.user_id)
+        user.set_password('changed')
+        user.save()
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/accounts/login/', response['Location'])
+
+    def test_profile_reads_the_joined_user(self):
+        user = accounts.load_user(self.doctor.user_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(accounts.profile(user), self.doctor)
+            self.assertEqual(accounts.profile(user).hospital.name, self.hospital.name)
+        staff = accounts.load_user(User.objects.create_user(username='staff').pk)
+        with self.assertNumQueries(0):
+            self.assertIsNone(accounts.profile(staff))
+
+
+class RecordExportTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.patient = make_patient(self.hospital)
+        self.other = make_patient(self.hospital, username='other')
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=datetime.date(2030, 1, 2),
+            appointment_time=datetime.time(9, 30), message='Follow-up',
+        )
+        Prescription.objects.create(doctor=self.doctor, patient=self.patient, medication='Aspirin', notes='Daily')
+        Appointment.objects.create(
+            patient=self.other, doctor=self.doctor, appointment_date=datetime.date(2030, 1, 3),
+            appointment_time=datetime.time(10, 0),
+        )
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_patients_export_their_own_history_as_csv(self):
+        self.client.force_login(self.patient.user)
+        rows = list(csv.DictReader(io.StringIO(self.export(reverse('record_export')))))
+        self.assertEqual([(row['record'], row['patient_id']) for row in rows], [
+            ('patient', str(self.patient.pk)), ('appointment', str(self.patient.pk)),
+            ('prescription', str(self.patient.pk)),
+        ])
+        self.assertEqual((rows[1]['date'], rows[1]['time'], rows[1]['text']), ('2030-01-02', '09:30:00', 'Follow-up'))
+        self.assertEqual((rows[2]['doctor'], rows[2]['text'], rows[2]['notes']), (self.doctor.name, 'Aspirin', 'Daily'))
+
+    async def test_asgi_exports_stream_without_buffering(self):
+        await self.async_client.aforce_login(self.patient.user)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = await self.async_client.get(reverse('record_export'), {'format': 'ndjson'})
+            self.assertTrue(response.is_async)
+            lines = [line async for line in response.streaming_content]
+        self.assertEqual(
+            [json.loads(line)['resourceType'] for line in lines], ['Patient', 'Appointment', 'MedicationRequest'],
+        )
+
+    def test_ndjson_lines_are_fhir_resources(self):
+        self.client.force_login(self.patient.user)
+        resources = [json.loads(line) for line in self.export(reverse('record_export'), format='ndjson').splitlines()]
+        self.assertEqual(
+            [r['resourceType'] for r in resources], ['Patient', 'Appointment', 'MedicationRequest'],
+        )
+        patient, appointment, prescription = resources
+        self.assertEqual(patient['managingOrganization'], {'reference': f'Organization/{self.hospital.pk}'})
+        self.assertEqual(appointment['start'], '2030-01-02T09:30:00+00:00')
+        self.assertEqual(appointment['participant'][0]['actor'], {'reference': f'Patient/{self.patient.pk}'})
+        self.assertEqual(prescription['requester']['reference'], f'Practitioner/{self.doctor.pk}')
+        self.assertEqual(prescription['note'], [{'text': 'Daily'}])
+
+    def test_other_histories_are_for_staff(self):
+        self.client.force_login(self.patient.user)
+        self.assertEqual(self.client.get(reverse('patient_export', args=[self.other.pk])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('hospital_export', args=[self.hospital.pk])).status_code, 403)
+        self.client.force_login(self.doctor.user)
+        self.assertEqual(self.client.get(reverse('record_export')).status_code, 403)
+
+        self.client.force_login(User.objects.create_user(username='auditor', is_staff=True))
+        text = self.export(reverse('patient_export', args=[self.other.pk]))
+        self.assertEqual(text.count('\n'), 3)
+        self.assertEqual(self.client.get(reverse('patient_export', args=[0])).status_code, 404)
+        rows = list(csv.DictReader(io.StringIO(self.export(reverse('hospital_export', args=[self.hospital.pk])))))
+        self.assertEqual([row['record'] for row in rows], ['patient', 'patient', 'appointment', 'appointment', 'prescription'])
+
+    def test_queries_depend_on_chunks_not_history_length(self):
+        def queries(chunk_size):
+            with CaptureQueriesContext(connection) as ctx:
+                lines = list(records.export(Patient.objects.filter(hospital=self.hospital), 'ndjson', chunk_size))
+            return len(lines), len(ctx.captured_queries)
+
+        self.assertEqual(queries(500), (5, 4))
+        add_history(self.doctor, 10)
+        # Three queries per chunk of patients, and one to find there are no more.
+        self.assertEqual(queries(500), (35, 4))
+        self.assertEqual(queries(5), (35, 3 * 3 + 1))
+
+    def test_command_writes_a_compressed_hospital_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ndjson.gz')
+            call_command('export_patient_records', self.hospital.pk, output=path, stderr=io.StringIO())
+            with gzip.open(path, 'rt') as stream:
+                self.assertEqual(len(stream.readlines()), 5)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    THROTTLE_RATES={'registration': '2/h', 'booking': '1/m', 'graphql': '2/m'},
+)
+class ThrottlingTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.addCleanup(throttling.reset)
+
+    def register(self, username, ip='10.0.0.1'):
+        return self.client.post(reverse('register_patient'), {
+            'username': username, 'password': 'pw', 'name': 'New Patient',
+            'email': f'{username}@example.com', 'phone_number': '555', 'hospital': self.hospital.pk,
+        }, REMOTE_ADDR=ip)
+
+    def book(self, patient, time):
+        self.client.force_login(patient.user)
+        return self.client.post(reverse('patient_dashboard'), {
+            'doctor': self.doctor.pk,
+            'appointment_date': (timezone.localdate() + datetime.timedelta(days=1)).isoformat(),
+            'appointment_time': time,
+        })
+
+    def test_buckets_refill_over_the_period(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = throttling.BucketStore(os.path.join(directory, 'buckets.sqlite3'))
+            self.assertEqual([store.take('k', 3, 60, now=1000) for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(store.take('k', 3, 60, now=1000), 20)
+            self.assertAlmostEqual(store.take('k', 3, 60, now=1010), 10)
+            self.assertEqual(store.take('k', 3, 60, now=1020), 0)
+            self.assertEqual(store.take('other', 3, 60, now=1020), 0)
+
+    def test_registration_is_limited_per_ip(self):
+        self.assertEqual(self.register('a').status_code, 302)
+        self.assertEqual(self.register('b').status_code, 302)
+        response = self.register('c')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1800')
+        self.assertFalse(User.objects.filter(username='c').exists())
+        self.assertEqual(self.client.get(reverse('register_patient'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEqual(self.register('c', ip='10.0.0.2').status_code, 302)
+        self.assertEqual(throttling.stats[('registration', 'rate')], 1)
+
+    def test_booking_is_limited_per_user(self):
+        first, second = make_patient(self.hospital, 'first'), make_patient(self.hospital, 'second')
+        self.assertEqual(self.book(first, '10:00').status_code, 302)
+        self.assertEqual(self.book(first, '10:30').status_code, 429)
+        self.assertEqual(self.book(second, '11:00').status_code, 302)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_graphql_is_limited(self):
+        statuses = [self.client.get('/graphql/', {'query': '{ allHospitals { name } }'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_admission_sheds_writes_over_the_limit(self):
+        throttling._admission = gate = throttling.Admission(max_concurrency=1, target=0.02, queue=0, wait=0.01)
+        self.assertTrue(gate.try_acquire())
+        response = self.register('late')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(User.objects.filter(username='late').exists())
+        gate.release()
+        self.assertEqual(self.register('late').status_code, 302)
+        self.assertEqual(throttling.stats[('registration', 'overload')], 1)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        self.assertIn(
+            'hospital_throttled_requests_total{scope="registration",reason="overload"} 1',
+            self.client.get(reverse('metrics')).content.decode(),
+        )
+
+    def test_admission_limit_follows_query_time(self):
+        gate = throttling.Admission(max_concurrency=4, target=0.01, queue=1, wait=0.01)
+        for _ in range(10):
+            gate.try_acquire()
+            gate.release(0.1)
+        self.assertEqual(int(gate.limit), 1)
+        self.assertTrue(gate.try_acquire())
+        self.assertFalse(gate.acquire())
+
+        waiter = threading.Thread(target=gate.acquire)
+        gate.wait = 1
+        waiter.start()
+        while not gate.waiting:
+            time.sleep(0.001)
+        # The queue holds one request; the next is shed without waiting.
+        started = time.perf_counter()
+        self.assertFalse(gate.acquire())
+        self.assertLess(time.perf_counter() - started, 0.5)
+        gate.release()
+        waiter.join()
+        self.assertEqual(gate.active, 1)
+
+        for _ in range(50):
+            gate.release(0.0001)
+            gate.try_acquire()
+        self.assertEqual(int(gate.limit), 4)
+
+
+class DoctorDirectoryTests(HospitalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.north = make_hospital('North')
+        self.south = make_hospital('South')
+        self.doctors = [
+            make_doctor(self.north, username=f'cardio{i}') for i in range(5)
+        ] + [
+            make_doctor(self.north, username='neuro', specialization='Neurology'),
+            make_doctor(self.south, username='south', specialization='Cardiology'),
+            make_doctor(self.south, username='general', specialization=''),
+        ]
+        self.patient = make_patient(self.north)
+        self.client.force_login(self.patient.user)
+
+    def directory(self, **params):
+        response = self.client.get(reverse('doctor_directory'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lists_a_hospital_alphabetically_in_pages(self):
+        names, cursor = [], ''
+        while True:
+            body = self.directory(hospital=self.north.pk, limit=4, cursor=cursor)
+            names += [result['name'] for result in body['results']]
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(names, sorted(d.name for d in self.doctors if d.hospital_id == self.north.pk))
+        self.assertEqual(body['count'], 6)
+        self.assertEqual(body['results'][0]['hospital_name'], 'North')
+
+    def test_facets_apply_the_other_filter(self):
+        body = self.directory(hospital=self.north.pk, specialization='Cardiology')
+        self.assertEqual(body['count'], 5)
+        self.assertEqual(body['facets']['hospitals'], [
+            {'id': self.north.pk, 'name': 'North', 'count': 5},
+            {'id': self.south.pk, 'name': 'South', 'count': 1},
+        ])
+        self.assertEqual(body['facets']['specializations'], [
+            {'value': 'Cardiology', 'count': 5}, {'value': 'Neurology', 'count': 1},
+        ])
+        self.assertEqual(self.directory()['count'], 8)
+
+    def test_typeahead_matches_prefixes_within_the_filters(self):
+        body = self.directory(q='dr car', hospital=self.north.pk, limit=3)
+        self.assertEqual(len(body['results']), 3)
+        self.assertTrue(all(result['specialization'] == 'Cardiology' for result in body['results']))
+        self.assertIsNone(body['next_cursor'])
+        body = self.directory(q='neur', specialization='Neurology')
+        self.assertEqual([result['label'] for result in body['results']], ['Dr neuro (Neurology)'])
+
+    def test_facets_never_count_the_doctors_table(self):
+        selectors.hospital_catalogue()
+        with CaptureQueriesContext(connection) as ctx:
+            directory.facets(self.north.pk, 'Cardiology')
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertFalse(any('hospital_doctor' in query['sql'] for query in ctx.captured_queries))
+
+    def test_rejects_bad_parameters_and_anonymous_visitors(self):
+        url = reverse('doctor_directory')
+        self.assertEqual(self.client.get(url, {'hospital': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'nope'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_booking_form_renders_a_picker_not_every_doctor(self):
+        response = self.client.get(reverse('patient_dashboard'))
+        self.assertContains(response, 'class="doctor-picker"')
+        self.assertContains(response, f'data-hospital="{self.north.pk}"')
+        self.assertNotContains(response, 'Dr cardio3')
+
+        doctor = self.doctors[3]
+        response = self.client.post(reverse('patient_dashboard'), {
+            'doctor': doctor.pk,
+            'appointment_date': (timezone.localdate() + datetime.timedelta(days=1)).isoformat(),
+            'appointment_time': '25:00',
+        })
+        self.assertEqual(response.status_code, 200)
+        # Shown again with the chosen doctor's name after a validation error.
+        self.assertContains(response, 'value="Dr cardio3 (Cardiology)"')
@@ -0,0 +1,304 @@
+"""Rate limits and admission control for the endpoints that write.
+
+``limit(scope)`` wraps a view. Before it runs, a request takes a token from
+the bucket for its scope and client: the signed-in user or, for anonymous
+visitors, the IP address. ``THROTTLE_RATES`` sets each scope's rate as
+``'<count>/<s|m|h>'``. A client may spend the whole count at once, and then
+gets it back evenly over the period. An empty bucket answers 429 with
+``Retry-After``.
+
+The buckets live in a small SQLite file (``THROTTLE_STORE``) that every
+worker on the host opens, so a limit holds across processes. Each check is
+one upsert in that file, never in the application database. If the file
+can't be used, requests are let through and the error is logged.
+
+Views that write also pass the ``Admission`` controller. It caps how many
+of them run at once in this process. The cap starts at
+``ADMISSION_MAX_CONCURRENCY``. It shrinks while the average query time of
+admitted requests is above ``ADMISSION_TARGET_MS`` (SQLite's single writer
+shows up as queries waiting on the lock), and it grows back once queries are
+fast again. Requests over the cap wait up to ``ADMISSION_WAIT`` seconds, with
+at most ``ADMISSION_QUEUE`` waiting. The rest are shed with a 429 straight
+away instead of timing out. Rejections are counted in ``stats`` and served
+on ``/metrics/``.
+"""
+import functools
+import itertools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import instrumentation
+
+
+logger = logging.getLogger('hospital.throttling')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+# Buckets idle this long are full again and can be dropped; each process
+# looks for them every PRUNE_EVERY checks.
+PRUNE_AFTER = 86400
+PRUNE_EVERY = 1000
+_checks = itertools.count(1)
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(scope, reason):
+    with _stats_lock:
+        stats[(scope, reason)] += 1
+
+
+def parse_rate(rate):
+    """``'10/m'`` -> ``(10, 60)``: a burst of 10, refilled over 60 seconds."""
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period]
+
+
+def rate_for(scope):
+    rate = getattr(settings, 'THROTTLE_RATES', {}).get(scope)
+    return parse_rate(rate) if rate else None
+
+
+class BucketStore:
+    """Token buckets in a SQLite file shared by this host's workers."""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS bucket '
+        '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL)'
+    )
+    # Every SET expression sees the row as it was before the update.
+    TAKE = '''
+        INSERT INTO bucket (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:burst, tokens + (:now - updated) * :refill)
+                - (min(:burst, tokens + (:now - updated) * :refill) >= 1),
+            allowed = min(:burst, tokens + (:now - updated) * :refill) >= 1,
+            updated = :now
+        RETURNING tokens, allowed
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            # Buckets are disposable: losing the last few on a crash is fine.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, count, period, now=None):
+        """Take a token from ``key``'s bucket; return 0 if there was one, else seconds until there is."""
+        now = time.time() if now is None else now
+        refill = count / period
+        tokens, allowed = self._connection().execute(
+            self.TAKE, {'key': key, 'burst': count, 'now': now, 'refill': refill},
+        ).fetchone()
+        return 0 if allowed else (1 - tokens) / refill
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        self._connection().execute('DELETE FROM bucket WHERE updated < ?', (now - PRUNE_AFTER,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM bucket')
+
+
+class Admission:
+    """A cap on concurrent writes in this process that follows database latency."""
+
+    # Weight of the newest request in the moving average of query time.
+    SMOOTHING = 0.2
+
+    def __init__(self, max_concurrency, target, queue, wait):
+        self.max_concurrency = max_concurrency
+        self.target = target
+        self.queue = queue
+        self.wait = wait
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.latency = 0.0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        """Take a slot if one is free now, without waiting."""
+        with self._condition:
+            if self.active < int(self.limit):
+                self.active += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Take a slot, waiting up to ``wait`` seconds; False when shed."""
+        with self._condition:
+            if self.active < int(self.limit):
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self.active < int(self.limit), self.wait)
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def release(self, query_seconds=None):
+        """Free a slot; ``query_seconds`` is the request's mean query time, if known."""
+        with self._condition:
+            self.active -= 1
+            if query_seconds is not None:
+                self.latency += self.SMOOTHING * (query_seconds - self.latency)
+                if self.latency > self.target:
+                    self.limit = max(1.0, self.limit * 0.9)
+                else:
+                    # About one more slot for every ``limit`` fast requests.
+                    self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._condition.notify()
+
+
+_store = None
+_admission = None
+_lock = threading.Lock()
+
+
+def store():
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = BucketStore(getattr(settings, 'THROTTLE_STORE', ':memory:'))
+    return _store
+
+
+def admission():
+    global _admission
+    if _admission is None:
+        with _lock:
+            if _admission is None:
+                _admission = Admission(
+                    max_concurrency=getattr(settings, 'ADMISSION_MAX_CONCURRENCY', 8),
+                    target=getattr(settings, 'ADMISSION_TARGET_MS', 20) / 1000,
+                    queue=getattr(settings, 'ADMISSION_QUEUE', 16),
+                    wait=getattr(settings, 'ADMISSION_WAIT', 0.5),
+                )
+    return _admission
+
+
+def reset():
+    """Empty the buckets and the counters, and rebuild both from the settings."""
+    global _store, _admission
+    store().clear()
+    with _lock:
+        _store = _admission = None
+    with _stats_lock:
+        stats.clear()
+
+
+def client_key(request, scope):
+    user = request.user
+    if user.is_authenticated:
+        return f'{scope}:user:{user.pk}'
+    return f'{scope}:ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def check_rate(request, scope):
+    """Seconds the client must wait before ``scope`` takes its request, or 0."""
+    rate = rate_for(scope)
+    if rate is None:
+        return 0
+    try:
+        wait = store().take(client_key(request, scope), *rate)
+        if next(_checks) % PRUNE_EVERY == 0:
+            store().prune()
+    except (sqlite3.Error, OSError):
+        logger.exception('Rate limit store failed; letting the request through')
+        return 0
+    if wait:
+        _count(scope, 'rate')
+    return wait
+
+
+def too_many(scope, retry_after, reason):
+    response = HttpResponse(f'Too many requests ({reason}); try again shortly.\n', status=429, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _query_seconds(metrics, before):
+    if metrics is None or metrics.queries == before[0]:
+        return None
+    return (metrics.sql_seconds - before[1]) / (metrics.queries - before[0])
+
+
+def limit(scope, methods=('POST',), admit=False):
+    """Rate-limit ``methods`` requests to a view under ``scope``; ``admit`` also puts them through admission.
+
+    Works on sync and coroutine views.
+    """
+    def applies(request):
+        return methods is None or request.method in methods
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if not applies(request):
+                    return await view(request, *args, **kwargs)
+                request.user = await request.auser()
+                wait = await sync_to_async(check_rate)(request, scope)
+                if wait:
+                    return too_many(scope, wait, 'rate limit')
+                if not admit:
+                    return await view(request, *args, **kwargs)
+                gate = admission()
+                if not gate.try_acquire() and not await sync_to_async(gate.acquire, thread_sensitive=False)():
+                    _count(scope, 'overload')
+                    return too_many(scope, gate.wait, 'server busy')
+                metrics = instrumentation.current()
+                before = (metrics.queries, metrics.sql_seconds) if metrics else None
+                try:
+                    return await view(request, *args, **kwargs)
+                finally:
+                    gate.release(_query_seconds(metrics, before))
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if not applies(request):
+                    return view(request, *args, **kwargs)
+                wait = check_rate(request, scope)
+                if wait:
+                    return too_many(scope, wait, 'rate limit')
+                if not admit:
+                    return view(request, *args, **kwargs)
+                gate = admission()
+                if not gate.acquire():
+                    _count(scope, 'overload')
+                    return too_many(scope, gate.wait, 'server busy')
+                metrics = instrumentation.current()
+                before = (metrics.queries, metrics.sql_seconds) if metrics else None
+                try:
+                    return view(request, *args, **kwargs)
+                finally:
+                    gate.release(_query_seconds(metrics, before))
+        return wrapper
+    return decorator
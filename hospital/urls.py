@@ -1,11 +1,12 @@
 from django.urls import path
 from django.contrib.auth.views import LogoutView
-from . import views
+from . import throttling, views
 
 # Graphene/GraphQL is optional. Import only if available to avoid
 # hard-failing when the package is not installed in the environment.
 try:
-    from graphene_django.views import GraphQLView
+    from .graphql_limits import validation_rules
+    from .graphql_views import CachedGraphQLView
     from .schema import schema
     _graphql_available = True
 except Exception:
@@ -21,11 +22,25 @@ urlpatterns = [
     path('dashboard/doctor/', views.doctor_dashboard, name='doctor_dashboard'),
     path('dashboard/patient/', views.patient_dashboard, name='patient_dashboard'),
     path('dashboard/', views.dashboard_redirect, name='dashboard'),
+    path('dashboard/feed/<str:feed>/', views.dashboard_feed, name='dashboard_feed'),
+    path('dashboard/events/', views.dashboard_events, name='dashboard_events'),
+    path('slots/', views.free_slots, name='free_slots'),
+    path('search/', views.search_view, name='search'),
+    path('doctors/', views.doctor_directory, name='doctor_directory'),
+    path('bulk/<str:kind>/import/', views.bulk_import, name='bulk_import'),
+    path('bulk/<str:kind>/export/', views.bulk_export, name='bulk_export'),
+    path('patients/<int:pk>/export/', views.patient_export, name='patient_export'),
+    path('hospital/<int:pk>/export/', views.hospital_export, name='hospital_export'),
+    path('tasks/<int:pk>/', views.task_status, name='task_status'),
+    path('metrics/', views.metrics, name='metrics'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit/', views.profile_edit, name='profile_edit'),
+    path('profile/export/', views.patient_export, name='record_export'),
     path('logout/', views.custom_logout, name='custom_logout'),
     path('logout/', LogoutView.as_view(next_page='home'), name='logout'),
 ]
 
 if _graphql_available:
-    urlpatterns.append(path('graphql/', GraphQLView.as_view(graphiql=True, schema=schema)))
\ No newline at end of file
+    urlpatterns.append(path('graphql/', throttling.limit('graphql', methods=None)(CachedGraphQLView.as_view(
+        graphiql=True, schema=schema, validation_rules=validation_rules(),
+    ))))
\ No newline at end of file
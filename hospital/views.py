@@ -1,9 +1,27 @@
+import asyncio
+import datetime
+import functools
+import itertools
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, connections, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.models import User
 from django.contrib.auth import logout
-from .models import Hospital, Doctor, Patient, Appointment
+from .models import Doctor, Patient, Prescription, Task
 from .forms import (
     DoctorRegistrationForm,
     PatientRegistrationForm,
@@ -11,34 +29,132 @@ from .forms import (
     AppointmentForm,
 )
 from .forms import DoctorForm, PatientForm
+from . import (
+    accounts, bulk, cache, conditional, directory, events, instrumentation, notifications, pagination, passwords, records,
+    routers, search, selectors, stats, tasks, throttling,
+)
+from .scheduling import availability
+
+
+# The coroutine views below (home, hospital_detail and both dashboards) keep
+# the event loop free while they wait on the database when served over ASGI.
+# Template rendering, sessions, messages and the sync caches still run in
+# sync_to_async threads.
+arender = sync_to_async(render)
+
+
+async def aget_user(request):
+    # Django 5.0 caches request.auser() and request.user separately; share
+    # the one load so templates don't query for the user again.
+    request.user = await request.auser()
+    return request.user
+
+
+def async_login_required(view):
+    """``login_required`` for coroutine views; Django 5.0's decorator is sync-only."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def conditional_page(validators, public_max_age=None):
+    """Answer GETs whose ``validators`` match the client's copy with a 304.
+
+    ``validators(request, *args, **kwargs)`` returns ``(etag, last_modified)``.
+    Unlike ``django.views.decorators.http.condition`` it runs them in a
+    thread for coroutine views, and it sets the page's Cache-Control policy
+    (see ``conditional.apply_policy``) on both 200s and 304s.
+    """
+    def check(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None, None, None
+        etag, last_modified = validators(request, *args, **kwargs)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=etag, last_modified=timestamp), etag, timestamp
 
+    def finish(request, response, etag, timestamp):
+        if etag is not None and response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            if timestamp is not None:
+                response.headers.setdefault('Last-Modified', http_date(timestamp))
+        return conditional.apply_policy(request, response, public_max_age)
 
-def home(request):
-    hospitals = Hospital.objects.all()
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                await aget_user(request)
+                response, etag, timestamp = await sync_to_async(check)(request, *args, **kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(request, response, etag, timestamp)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                response, etag, timestamp = check(request, *args, **kwargs)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return finish(request, response, etag, timestamp)
+        return wrapper
+    return decorator
+
+
+def _hospital_list(is_staff):
+    # The hospital cards only vary with the staff-only admin links.
+    return cache.hospitals.get_or_set(
+        f'home_list:staff={is_staff}',
+        lambda: render_to_string('hospital/partials/hospital_list.html', {
+            'hospitals': selectors.hospital_catalogue(),
+            'is_staff': is_staff,
+        }),
+    )
+
+
+@conditional_page(conditional.catalogue, public_max_age=60)
+async def home(request):
+    user = await aget_user(request)
+    hospitals, hospital_list = await asyncio.gather(
+        sync_to_async(selectors.hospital_catalogue)(),
+        sync_to_async(_hospital_list)(user.is_staff),
+    )
     # show account registration forms on the homepage
     doctor_reg_form = DoctorRegistrationForm()
     patient_reg_form = PatientRegistrationForm()
-    return render(request, 'hospital/home.html', {
+    return await arender(request, 'hospital/home.html', {
         'hospitals': hospitals,
+        'hospital_list': mark_safe(hospital_list),
         'doctor_reg_form': doctor_reg_form,
         'patient_reg_form': patient_reg_form,
     })
 
 
+@conditional_page(conditional.template('hospital/about.html'), public_max_age=3600)
 def about(request):
     return render(request, 'hospital/about.html')
 
 
+# Private: the page embeds a CSRF token for its form.
+@conditional_page(conditional.template('hospital/contact.html'))
 def contact(request):
     return render(request, 'hospital/contact.html')
 
 
-def hospital_detail(request, pk):
-    """Show a single hospital's details (database-backed)."""
-    hospital = get_object_or_404(Hospital, pk=pk)
-    return render(request, 'hospital/detail.html', {'hospital': hospital})
+@conditional_page(conditional.hospital, public_max_age=30)
+async def hospital_detail(request, pk):
+    """Show a single hospital's details (from the hospital cache) and its counters."""
+    hospital = await sync_to_async(selectors.get_hospital)(pk)
+    summary = await stats.ahospital_summary(hospital)
+    return await arender(request, 'hospital/detail.html', {'hospital': hospital, 'stats': summary})
+
 
+REGISTRATION_BUSY = 'We are handling a lot of registrations right now; please try again in a moment.'
 
+
+@throttling.limit('registration', admit=True)
 def register_doctor(request):
     # Render a registration page on GET; on POST create User+Doctor or re-render with errors
     if request.method == 'POST':
@@ -51,7 +167,11 @@ def register_doctor(request):
             if User.objects.filter(username=username).exists():
                 form.add_error('username', 'Username already exists.')
             else:
-                user = User.objects.create_user(username=username, email=email, password=password)
+                try:
+                    user = passwords.create_user(username, email, password)
+                except passwords.HashingBusy:
+                    form.add_error(None, REGISTRATION_BUSY)
+                    return render(request, 'hospital/register_doctor.html', {'form': form}, status=503)
                 # create doctor profile
                 Doctor.objects.create(
                     user=user,
@@ -68,6 +188,7 @@ def register_doctor(request):
     return render(request, 'hospital/register_doctor.html', {'form': form})
 
 
+@throttling.limit('registration', admit=True)
 def register_patient(request):
     # Render a registration page on GET; on POST create User+Patient or re-render with errors
     if request.method == 'POST':
@@ -79,7 +200,11 @@ def register_patient(request):
             if User.objects.filter(username=username).exists():
                 form.add_error('username', 'Username already exists.')
             else:
-                user = User.objects.create_user(username=username, email=email, password=password)
+                try:
+                    user = passwords.create_user(username, email, password)
+                except passwords.HashingBusy:
+                    form.add_error(None, REGISTRATION_BUSY)
+                    return render(request, 'hospital/register_patient.html', {'form': form}, status=503)
                 Patient.objects.create(
                     user=user,
                     name=form.cleaned_data['name'],
@@ -94,77 +219,263 @@ def register_patient(request):
     return render(request, 'hospital/register_patient.html', {'form': form})
 
 
-@login_required
-def doctor_dashboard(request):
+def _dashboard_lists(appointments, prescriptions, stamp):
+    # The lists sit in a {% cache %} fragment keyed on the owner's dashboard
+    # stamp and today's date; their rows are fetched while rendering, and
+    # only when that fragment is missing.
+    # They may come from a read replica, unless the stamp is so recent that
+    # the replica could still be missing the change and the fragment would
+    # cache the stale rows under the new stamp.
+    today = timezone.localdate()
+    replica = not routers.recently_written(cache.Stamps.issued_at(stamp))
+
+    def page(fetch):
+        def read():
+            with routers.replica_reads(replica):
+                return fetch()
+        return pagination.LazyPage(read)
+
+    return {
+        'prescriptions': page(lambda: pagination.prescription_page(prescriptions)),
+        'upcoming_appointments': page(lambda: pagination.appointment_page(appointments, 'upcoming', today=today)),
+        'past_appointments': page(lambda: pagination.appointment_page(appointments, 'past', today=today)),
+        'lists_stamp': stamp,
+        'today': today,
+    }
+
+
+@async_login_required
+async def doctor_dashboard(request):
     # only allow users who have a doctor profile
-    try:
-        doctor = request.user.doctor
-    except Doctor.DoesNotExist:
+    doctor = await accounts.aprofile(await aget_user(request))
+    if not isinstance(doctor, Doctor):
         messages.error(request, 'Access denied: not a doctor account.')
         return redirect('home')
 
     # Provide a prescription form - show patients from same hospital, or all patients if none in same hospital
     if request.method == 'POST':
         form = PrescriptionForm(request.POST)
-        hospital_patients = Patient.objects.filter(hospital=doctor.hospital)
-        form.fields['patient'].queryset = hospital_patients if hospital_patients.exists() else Patient.objects.all()
-        if form.is_valid():
+        form.fields['patient'].queryset = await sync_to_async(selectors.prescribable_patients)(doctor)
+        if await sync_to_async(form.is_valid)():
             prescription = form.save(commit=False)
             prescription.doctor = doctor
-            prescription.save()
+            await prescription.asave()
             messages.success(request, 'Prescription created.')
             return redirect('doctor_dashboard')
     else:
         form = PrescriptionForm()
-        hospital_patients = Patient.objects.filter(hospital=doctor.hospital)
-        form.fields['patient'].queryset = hospital_patients if hospital_patients.exists() else Patient.objects.all()
+        form.fields['patient'].queryset = await sync_to_async(selectors.prescribable_patients)(doctor)
 
-    prescriptions = doctor.prescriptions.all()
-    appointments = doctor.appointments.all()
-    return render(request, 'hospital/doctor_dashboard.html', {
+    stamp, patients_stamp = await sync_to_async(cache.dashboards.get)(
+        f'doctor:{doctor.pk}', f'patients:{doctor.hospital_id}',
+    )
+    # The live updates replay changes from here on; reaching back by the
+    # replica lag covers lists read from a replica that was behind.
+    events_since = int(time.time() - routers.replica_lag())
+    return await arender(request, 'hospital/doctor_dashboard.html', {
         'doctor': doctor, 
         'form': form, 
-        'prescriptions': prescriptions,
-        'appointments': appointments
+        'patients_stamp': patients_stamp,
+        'events_since': events_since,
+        **_dashboard_lists(selectors.doctor_appointments(doctor), selectors.doctor_prescriptions(doctor), stamp),
     })
 
 
-@login_required
-def patient_dashboard(request):
-    try:
-        patient = request.user.patient
-    except Patient.DoesNotExist:
+@async_login_required
+@throttling.limit('booking', admit=True)
+async def patient_dashboard(request):
+    patient = await accounts.aprofile(await aget_user(request))
+    if not isinstance(patient, Patient):
         messages.error(request, 'Access denied: not a patient account.')
         return redirect('home')
 
     if request.method == 'POST':
-        form = AppointmentForm(request.POST)
-        if form.is_valid():
+        form = AppointmentForm(request.POST, hospital_id=patient.hospital_id)
+        if await sync_to_async(form.is_valid)():
             appointment = form.save(commit=False)
             appointment.patient = patient
-            appointment.save()
-            messages.success(request, f'Appointment booked with Dr. {appointment.doctor.name} on {appointment.appointment_date} at {appointment.appointment_time}')
-            return redirect('patient_dashboard')
+            try:
+                # In a savepoint, so a clash leaves any surrounding transaction usable.
+                await sync_to_async(transaction.atomic(appointment.save))()
+            except IntegrityError:
+                # Someone else took the slot after the form checked it.
+                form.add_error('appointment_time', f'Dr. {appointment.doctor.name} is already booked at that time.')
+            else:
+                # Emails go out from the task workers, not this request.
+                await sync_to_async(notifications.appointment_booked)(appointment)
+                messages.success(request, f'Appointment booked with Dr. {appointment.doctor.name} on {appointment.appointment_date} at {appointment.appointment_time}')
+                return redirect('patient_dashboard')
     else:
-        form = AppointmentForm()
+        form = AppointmentForm(hospital_id=patient.hospital_id)
 
-    prescriptions = patient.prescriptions.all()
-    appointments = patient.appointments.all()
-    return render(request, 'hospital/patient_dashboard.html', {
+    [stamp] = await sync_to_async(cache.dashboards.get)(f'patient:{patient.pk}')
+    slots = await sync_to_async(availability.next_free_slots)(5, hospital_id=patient.hospital_id)
+    return await arender(request, 'hospital/patient_dashboard.html', {
         'patient': patient, 
-        'prescriptions': prescriptions, 
-        'appointments': appointments,
-        'appointment_form': form
+        **_dashboard_lists(selectors.patient_appointments(patient), selectors.patient_prescriptions(patient), stamp),
+        'appointment_form': form,
+        'free_slots': slots,
+    })
+
+
+@login_required
+def free_slots(request):
+    """Next free appointment slots, optionally narrowed by hospital, specialization or doctor."""
+    try:
+        count = max(1, min(int(request.GET.get('count', 10)), 50))
+        hospital_id = int(request.GET['hospital']) if request.GET.get('hospital') else None
+        doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+    except ValueError:
+        return HttpResponseBadRequest('count, hospital and doctor must be integers.')
+    slots = availability.next_free_slots(
+        count, hospital_id=hospital_id, doctor_id=doctor_id,
+        specialization=request.GET.get('specialization'),
+    )
+    return JsonResponse({'slots': [
+        {
+            'doctor': slot.doctor_id,
+            'doctor_name': slot.doctor_name,
+            'specialization': slot.specialization,
+            'date': slot.date.isoformat(),
+            'time': slot.time.strftime('%H:%M'),
+        }
+        for slot in slots
+    ]})
+
+
+@login_required
+def dashboard_feed(request, feed):
+    """Lazy-load the next page of a dashboard list as an HTML fragment plus cursor."""
+    profile = accounts.profile(request.user)
+    if isinstance(profile, Doctor):
+        role = 'doctor'
+        appointments = selectors.doctor_appointments(profile)
+        prescriptions = selectors.doctor_prescriptions(profile)
+    elif isinstance(profile, Patient):
+        role = 'patient'
+        appointments = selectors.patient_appointments(profile)
+        prescriptions = selectors.patient_prescriptions(profile)
+    else:
+        return JsonResponse({'error': 'No dashboard available for your account.'}, status=403)
+
+    cursor = request.GET.get('cursor')
+    try:
+        if feed == 'appointments':
+            window = request.GET.get('window', 'upcoming')
+            if window not in pagination.APPOINTMENT_WINDOWS:
+                return HttpResponseBadRequest('Unknown window.')
+            page = pagination.appointment_page(appointments, window, cursor)
+            template = 'hospital/partials/appointment_items.html'
+        elif feed == 'prescriptions':
+            page = pagination.prescription_page(prescriptions, cursor)
+            template = 'hospital/partials/prescription_items.html'
+        else:
+            return HttpResponseBadRequest('Unknown feed.')
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor.')
+
+    html = render_to_string(template, {'items': page.items, 'role': role}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+
+@async_login_required
+async def dashboard_events(request):
+    """Server-Sent Events stream of changes to the signed-in doctor's dashboard lists."""
+    doctor = await accounts.aprofile(await aget_user(request))
+    if not isinstance(doctor, Doctor):
+        return HttpResponseForbidden('Not a doctor account.')
+    try:
+        last_event_id = int(request.headers['Last-Event-ID']) if request.headers.get('Last-Event-ID') else None
+        since = float(request.GET['since']) if request.GET.get('since') else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid event id.')
+    if since is not None:
+        since = datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc)
+
+    if isinstance(request, ASGIRequest):
+        # The stream reads on the shared executor; don't keep this request's
+        # thread holding a connection for as long as the browser stays.
+        await sync_to_async(connections.close_all)()
+        content = events.stream(doctor.pk, last_event_id, since)
+    else:
+        # A WSGI worker can't be held open: send what was missed, and the
+        # browser reconnects after the retry delay.
+        text, _ = await events.aopening(doctor.pk, last_event_id, since)
+        content = [text]
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+SEARCH_MODELS = {'patients': Patient, 'doctors': Doctor, 'prescriptions': Prescription}
+
+
+def _search_result(kind, obj):
+    if kind == 'prescriptions':
+        return {
+            'id': obj.pk, 'medication': obj.medication, 'patient': obj.patient_id,
+            'doctor': obj.doctor_id, 'created_at': obj.created_at.isoformat(),
+        }
+    hospital = selectors.hospitals_by_pk().get(obj.hospital_id)
+    result = {
+        'id': obj.pk, 'name': obj.name, 'email': obj.email, 'phone_number': obj.phone_number,
+        'hospital': obj.hospital_id, 'hospital_name': hospital.name if hospital else '',
+    }
+    if kind == 'doctors':
+        result['specialization'] = obj.specialization
+    return result
+
+
+@login_required
+def search_view(request):
+    """Ranked prefix search; doctors and patients only see their own hospital."""
+    kind = request.GET.get('kind', 'patients')
+    if kind not in SEARCH_MODELS:
+        return HttpResponseBadRequest('Unknown search kind.')
+    scope = selectors.search_scope(request.user, kind)
+    if scope is None:
+        return JsonResponse({'error': 'Search is not available for your account.'}, status=403)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 50)
+        if request.GET.get('hospital') and request.user.is_staff and kind != 'prescriptions':
+            scope['hospital_id'] = int(request.GET['hospital'])
+    except ValueError:
+        return HttpResponseBadRequest('limit and hospital must be integers.')
+    results = search.search(SEARCH_MODELS[kind], request.GET.get('q', ''), limit=max(limit, 1), **scope)
+    return JsonResponse({'results': [_search_result(kind, obj) for obj in results]})
+
+
+@login_required
+def doctor_directory(request):
+    """Doctors by hospital and specialization, with type-ahead search and facet counts."""
+    try:
+        hospital_id = int(request.GET['hospital']) if request.GET.get('hospital') else None
+        limit = min(int(request.GET.get('limit', directory.PAGE_SIZE)), directory.MAX_PAGE)
+    except ValueError:
+        return HttpResponseBadRequest('hospital and limit must be integers.')
+    specialization = request.GET.get('specialization') or None
+    try:
+        page = directory.doctors(
+            hospital_id, specialization, request.GET.get('q', ''), request.GET.get('cursor'), max(limit, 1),
+        )
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor.')
+    return JsonResponse({
+        'results': [directory.entry(doctor) for doctor in page],
+        'next_cursor': page.next_cursor,
+        **directory.facets(hospital_id, specialization),
     })
 
 
 @login_required
 def dashboard_redirect(request):
     """Redirect logged-in users to the appropriate dashboard based on their profile."""
-    user = request.user
-    if hasattr(user, 'doctor'):
+    profile = accounts.profile(request.user)
+    if isinstance(profile, Doctor):
         return redirect('doctor_dashboard')
-    if hasattr(user, 'patient'):
+    if isinstance(profile, Patient):
         return redirect('patient_dashboard')
     messages.error(request, 'No dashboard available for your account.')
     return redirect('home')
@@ -172,13 +483,11 @@ def dashboard_redirect(request):
 
 @login_required
 def profile_view(request):
-    user = request.user
     # show doctor or patient profile
-    if hasattr(user, 'doctor'):
-        profile = user.doctor
+    profile = accounts.profile(request.user)
+    if isinstance(profile, Doctor):
         return render(request, 'hospital/doctor_profile.html', {'doctor': profile})
-    if hasattr(user, 'patient'):
-        profile = user.patient
+    if isinstance(profile, Patient):
         return render(request, 'hospital/patient_profile.html', {'patient': profile})
     messages.error(request, 'No profile available for your account.')
     return redirect('home')
@@ -186,9 +495,9 @@ def profile_view(request):
 
 @login_required
 def profile_edit(request):
-    user = request.user
-    if hasattr(user, 'doctor'):
-        doctor = user.doctor
+    profile = accounts.profile(request.user)
+    if isinstance(profile, Doctor):
+        doctor = profile
         if request.method == 'POST':
             form = DoctorForm(request.POST, instance=doctor)
             if form.is_valid():
@@ -199,8 +508,8 @@ def profile_edit(request):
             form = DoctorForm(instance=doctor)
         return render(request, 'hospital/edit_doctor_profile.html', {'form': form})
 
-    if hasattr(user, 'patient'):
-        patient = user.patient
+    if isinstance(profile, Patient):
+        patient = profile
         if request.method == 'POST':
             form = PatientForm(request.POST, instance=patient)
             if form.is_valid():
@@ -215,6 +524,121 @@ def profile_edit(request):
     return redirect('home')
 
 
+@login_required
+def bulk_import(request, kind):
+    """Import records from an uploaded ``file`` or the raw request body (staff only).
+
+    With ``?background=1`` the import runs as a task; the 202 response links to its status.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST a CSV or JSON-lines body.'}, status=405)
+    fmt = request.GET.get('format', 'csv')
+    if kind not in bulk.IMPORTERS or fmt not in bulk.FORMATS:
+        return HttpResponseBadRequest('Unknown record kind or format.')
+    source = request.FILES.get('file') or request
+    if request.GET.get('background'):
+        path = bulk.spool(source, fmt)
+        task = tasks.enqueue(bulk.import_spooled, kind, path, fmt)
+        return JsonResponse({'task': task.pk, 'status': reverse('task_status', args=[task.pk])}, status=202)
+    lines = (line.decode('utf-8') for line in source)
+    try:
+        report = bulk.import_records(kind, bulk.read_records(lines, fmt))
+    except ValueError as exc:
+        return JsonResponse({'error': f'Malformed input: {exc}'}, status=400)
+    return JsonResponse(report.as_dict())
+
+
+@login_required
+def task_status(request, pk):
+    """Progress and outcome of a background task (staff only)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    task = get_object_or_404(Task, pk=pk)
+    return JsonResponse({
+        'id': task.pk, 'name': task.name, 'status': task.status, 'attempts': task.attempts,
+        'run_at': task.run_at.isoformat(), 'result': task.result, 'error': task.last_error,
+    })
+
+
+def _streaming_content(request, lines, batch=200):
+    """``lines``, an export generator, as content for a ``StreamingHttpResponse``.
+
+    Under ASGI Django reads a synchronous iterator to the end before sending
+    anything, holding the whole export in memory; hand it an async iterator
+    that reads a batch of lines at a time on the database thread instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return lines
+    take = sync_to_async(lambda: list(itertools.islice(lines, batch)))
+
+    async def content():
+        while chunk := await take():
+            for line in chunk:
+                yield line
+
+    return content()
+
+
+@login_required
+def bulk_export(request, kind):
+    """Stream every record of ``kind`` as CSV or JSON lines (staff only)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    fmt = request.GET.get('format', 'csv')
+    if kind not in bulk.EXPORT_FIELDS or fmt not in bulk.FORMATS:
+        return HttpResponseBadRequest('Unknown record kind or format.')
+    response = StreamingHttpResponse(
+        _streaming_content(request, bulk.export_records(kind, fmt)),
+        content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+def _record_export(request, patients, name):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in records.FORMATS:
+        return HttpResponseBadRequest('Unknown format.')
+    response = StreamingHttpResponse(
+        _streaming_content(request, records.export(patients, fmt)), content_type=records.CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+
+@login_required
+def patient_export(request, pk=None):
+    """Stream a patient's complete history: the signed-in patient's own, or any patient's for staff."""
+    if pk is None:
+        profile = accounts.profile(request.user)
+        if not isinstance(profile, Patient):
+            return JsonResponse({'error': 'No patient record for your account.'}, status=403)
+        pk = profile.pk
+    elif not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    get_object_or_404(Patient, pk=pk)
+    return _record_export(request, Patient.objects.filter(pk=pk), f'patient-{pk}')
+
+
+@login_required
+def hospital_export(request, pk):
+    """Stream the histories of every patient of a hospital (staff only)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    hospital = selectors.get_hospital(pk)
+    return _record_export(request, Patient.objects.filter(hospital_id=hospital.pk), f'hospital-{pk}-patients')
+
+
+def metrics(request):
+    """This process's request metrics in Prometheus text format."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in allowed):
+        return HttpResponseForbidden()
+    return HttpResponse(instrumentation.registry.render(), content_type='text/plain; version=0.0.4')
+
+
 def custom_logout(request):
     """Custom logout view that redirects to home with personalized message."""
     username = request.user.username if request.user.is_authenticated else 'User'
@@ -2,6 +2,8 @@
 ASGI config for hospitalProject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (e.g. ``uvicorn hospitalProject.asgi:application``) for the live
+doctor dashboards: under WSGI they only catch up when the browser reconnects.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -1,5 +1,9 @@
+import importlib.util
+import os
 from pathlib import Path
 
+import django
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,8 +41,12 @@ if graphene_django:
 
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware.
+    'hospital.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Sends a client's reads to the primary for a while after it writes.
+    'hospital.routers.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -50,7 +58,8 @@ ROOT_URLCONF = 'hospitalProject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, plus render timing for hospital.instrumentation.
+        'BACKEND': 'hospital.instrumentation.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,20 +73,188 @@ TEMPLATES = [
     },
 ]
 
+# TEMPLATE_PROFILE=production spells out the cached loader (Django's default
+# since 4.1, but reset on every code change while DEBUG is on) and turns off
+# template debug information, which DEBUG would otherwise switch on.
+TEMPLATE_PROFILE = os.environ.get('TEMPLATE_PROFILE', 'development')
+
+if TEMPLATE_PROFILE == 'production':
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['debug'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'hospitalProject.wsgi.application'
 
 
+# Request instrumentation (hospital.instrumentation)
+#
+# Every request gets a Server-Timing header and a JSON line on the
+# 'hospital.requests' logger; REQUEST_LOG_LEVEL=INFO shows them all, the
+# default only those repeating a statement METRICS_DUPLICATE_QUERY_THRESHOLD
+# times or more. /metrics/ answers staff and METRICS_ALLOWED_IPS.
+
+METRICS_SERVER_TIMING = True
+METRICS_DUPLICATE_QUERY_THRESHOLD = 5
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'hospital.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'hospital.tasks': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'hospital.throttling': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'hospital.events': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# HOSPITAL_DB selects the profile: 'sqlite' (default) or 'postgres'.
+
+HOSPITAL_DB = os.environ.get('HOSPITAL_DB', 'sqlite')
+
+if HOSPITAL_DB == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'hospital'),
+            'USER': os.environ.get('POSTGRES_USER', 'hospital'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Reuse connections across requests, checking them before reuse.
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # Django 5.1+ with psycopg 3 can pool connections in-process instead;
+    # pooling replaces persistent connections.
+    if django.VERSION >= (5, 1) and os.environ.get('DB_POOL_MAX_SIZE'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a connection waits for the write lock.
+                'timeout': 20,
+            },
+        }
+    }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Read replicas, named replica1, replica2, ...: POSTGRES_REPLICA_HOSTS lists
+# 'host[:port]' entries, SQLITE_REPLICA_PATHS database files (kept current
+# with `manage.py sync_replicas`). Only reads that opt in go to them; see
+# hospital.routers. DATABASE_REPLICA_LAG is how far, in seconds, a replica
+# may trail the primary.
+
+if HOSPITAL_DB == 'postgres':
+    _replicas = [
+        {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+        for host, _, port in (
+            entry.partition(':') for entry in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if entry
+        )
+    ]
+else:
+    _replicas = [{'NAME': path} for path in os.environ.get('SQLITE_REPLICA_PATHS', '').split(',') if path]
+for _number, _replica in enumerate(_replicas, 1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        **_replica,
+        # Tests run every query against the test copy of 'default'.
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_REPLICA_LAG = float(os.environ.get('DATABASE_REPLICA_LAG', 5))
+DATABASE_ROUTERS = ['hospital.routers.ReplicaRouter']
+
+# Applied to every new SQLite connection by hospital.db.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'foreign_keys': 'ON',
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# 'shared' is visible to every worker process; the hospital catalogue and
+# its rendered fragments live there behind a per-process LRU.
+# 'template_fragments' holds {% cache %} blocks per process; their keys carry
+# version stamps from the shared cache, so a change seen by any worker
+# retires them everywhere.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('HOSPITAL_CACHE_DIR', BASE_DIR / '.cache' / 'shared'),
+    },
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+HOSPITAL_CACHE_ALIAS = 'shared'
+# How long a process trusts its copy of a namespace's version token.
+HOSPITAL_CACHE_VERSION_SECONDS = 1.0
+
+
+# Sessions and signed-in users
+#
+# Sessions are read from the shared cache and written through to the
+# database; SESSION_ENGINE=django.contrib.sessions.backends.db restores
+# plain database sessions. hospital.accounts caches each signed-in user
+# with their doctor or patient profile for USER_CACHE_SECONDS.
+
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'shared'
+AUTHENTICATION_BACKENDS = ['hospital.accounts.CachedUserBackend']
+USER_CACHE_SECONDS = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -97,6 +274,82 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing (hospital.passwords)
+#
+# PASSWORD_HASHER picks the hasher for new passwords: 'argon2' (the default
+# when argon2-cffi is installed), 'scrypt' or 'pbkdf2'. The others stay
+# listed so existing hashes still verify, and are upgraded on login.
+# Argon2id defaults to OWASP's minimum (19 MiB, 2 passes, 1 lane); scrypt to
+# Django's own defaults.
+
+PASSWORD_ARGON2 = {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1}
+PASSWORD_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}
+
+_PASSWORD_HASHERS = {
+    'argon2': 'hospital.passwords.TunedArgon2PasswordHasher',
+    'scrypt': 'hospital.passwords.TunedScryptPasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get(
+    'PASSWORD_HASHER', 'argon2' if importlib.util.find_spec('argon2') else 'scrypt',
+)
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Registration hashes on a bounded pool: workers default to the CPU count.
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', 0)) or None
+PASSWORD_HASHING_QUEUE = 32
+PASSWORD_HASHING_WAIT = 5
+
+
+# Background tasks (hospital.tasks) and email
+#
+# Workers are `python manage.py run_tasks` processes. A task whose worker
+# dies is retried once TASK_LEASE_SECONDS have passed. Background imports
+# are spooled to TASK_SPOOL_DIR, which every worker must be able to read.
+
+TASK_LEASE_SECONDS = 300
+TASK_SPOOL_DIR = os.environ.get('TASK_SPOOL_DIR', BASE_DIR / '.cache' / 'spool')
+APPOINTMENT_REMINDER_HOURS = 24
+
+
+# Rate limits and admission control (hospital.throttling)
+#
+# THROTTLE_RATES allow each signed-in user (or IP address, when anonymous)
+# that many requests per period on booking, registration and GraphQL. The
+# buckets are kept in THROTTLE_STORE, a SQLite file shared by the host's
+# workers. Each process admits at most ADMISSION_MAX_CONCURRENCY writes at
+# once, fewer while their queries average over ADMISSION_TARGET_MS; up to
+# ADMISSION_QUEUE more wait ADMISSION_WAIT seconds, the rest get a 429.
+
+THROTTLE_RATES = {
+    'booking': '10/m',
+    'registration': '20/h',
+    'graphql': '300/m',
+}
+THROTTLE_STORE = os.environ.get('THROTTLE_STORE', BASE_DIR / '.cache' / 'throttle.sqlite3')
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', 8))
+ADMISSION_TARGET_MS = 20
+ADMISSION_QUEUE = 16
+ADMISSION_WAIT = 0.5
+
+# Live doctor dashboards (hospital.events)
+#
+# Served over ASGI (hospitalProject.asgi). Each process checks for changes
+# made elsewhere every DASHBOARD_EVENTS_POLL_SECONDS; events older than
+# DASHBOARD_EVENTS_RETENTION seconds are pruned.
+
+DASHBOARD_EVENTS_POLL_SECONDS = float(os.environ.get('DASHBOARD_EVENTS_POLL_SECONDS', 1))
+DASHBOARD_EVENTS_RETENTION = 3600
+
+# Prints emails to the worker's console unless EMAIL_BACKEND says otherwise
+# (e.g. django.core.mail.backends.smtp.EmailBackend with EMAIL_HOST).
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'appointments@hospital.local')
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 